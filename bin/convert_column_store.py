@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# Copyright 20220312 Xiangchong Li.
+# This task converts FITS catalogs to column stores (a directory of per-column
+# .npy files), which are memory-mapped by the analysis tasks
+import argparse
+from utils_shear_ana import preutil
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="convert to column store")
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        type=str,
+        help="input FITS catalogs (combined into one store)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        type=str,
+        help="directory of the column store",
+    )
+    parser.add_argument(
+        "--columns",
+        default=None,
+        type=str,
+        help="comma separated columns to convert [default: all]",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        default=1000000,
+        type=int,
+        help="number of rows converted at a time",
+    )
+    args = parser.parse_args()
+    columns = None
+    if args.columns is not None:
+        columns = [col.strip() for col in args.columns.split(",")]
+    store = preutil.write_column_store(
+        args.inputs, args.output, columns=columns, chunk_size=args.chunk_size
+    )
+    print(
+        "Wrote %d rows of %d columns to %s"
+        % (len(store), len(store.dtype), args.output)
+    )
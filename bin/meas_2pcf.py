@@ -1,22 +1,11 @@
 # This task measure the two point correlation function for real space
 # cosmic shear
-import gc
 import os
-import glob
-import fitsio
-import argparse
-import treecorr
 import numpy as np
-from utils_shear_ana import mea2pcf
 import astropy.table as astTable
-
-ntheta = 17         # number of angular bins
-cor = treecorr.GGCorrelation(
-    nbins=ntheta,
-    min_sep=2.188,
-    max_sep=332.954,
-    sep_units="arcmin",
-)
+from utils_shear_ana import catutil
+from utils_shear_ana import mea2pcf
+from utils_shear_ana import preutil
 
 nzs =   4           # number of tomographic redshift bins
 blind_ver='cat0'
@@ -35,31 +24,49 @@ for i in range(4):
         wrkDir,
         "S19ACatalogs/catalog_2pt/cat_fiducial_rmrg_zbin%s.fits" %(i+1)
     )
-    dd = fitsio.read(fname)
+    # only read the columns used by convert_data2treecat
+    dd = preutil.load_catalog(fname, funcs=[mea2pcf.convert_data2treecat])
     dataG.append(dd)
 
 
-strTmp=os.path.join(wrkDir,'cosmicShear/tpcf/%s/cor%d%d_fiducial_rmrg.fits')
-cors0={}
-# Measure the correlation function
-for i in range(nzs):
-    cati= mea2pcf.convert_data2treecat(
-        dataG[i],mrTab['m_shear_cat0'][i],
-        mrTab['m_sel'][i],
-        mrTab['a_sel'][i],
-    )
-    for j in range(i,nzs):
-        ofname= strTmp%(blind_ver,i+1,j+1)
-        if os.path.isfile(ofname):
-            continue
-        catj = mea2pcf.convert_data2treecat(
-            dataG[j],
-            mrTab['m_shear_cat0'][j],   # multiplicative bias
-            mrTab['m_sel'][j],          # multplicative selection bias
-            mrTab['a_sel'][j],          # additive selection bias
+# index arrays of the fields in each redshift bin
+fields=[]
+for i,dd in enumerate(dataG):
+    ra,dec=catutil.get_radec(dd)
+    code=catutil.get_field_code(ra,dec)
+    # the correlations over all the fields are summed from the fields
+    if not np.all(code>=0):
+        raise ValueError(
+            'find %d galaxies outside the fields in zbin%d' %(np.sum(code<0),i+1)
         )
-        # correlation
-        cor.clear()
-        cor.process(cati,catj)
-        cor.write(ofname)
-        del catj
+    order,ranges=catutil.get_field_partition(code)
+    fields.append({ff: order[i0:i1] for ff,(i0,i1) in ranges.items()})
+    del ra,dec,code,order
+
+corDir=os.path.join(wrkDir,'cosmicShear/tpcf/%s/' %blind_ver)
+strTmp={ff: os.path.join(corDir,'cor%%d%%d_%s_fiducial_rmrg.fits' %ff) for ff in catutil.field_names}
+strTmp['all']=os.path.join(corDir,'cor%d%d_fiducial_rmrg.fits')
+# Measure the correlation function of each field and all the fields (each
+# redshift bin is converted once; pairs with existing outputs are skipped)
+engine=mea2pcf.CorrelationEngine("DF")
+# the correlations over all the fields are the sums of the pair sums of the
+# fields and of the pairs across the fields closer than max_sep (GAMA09H and
+# WIDE12H); the other fields should be separated by more than max_sep
+groups=mea2pcf.check_field_groups(catutil.field_names,engine)
+print('groups of fields with pairs across fields: %s' %groups)
+biases = [
+    (
+        mrTab['m_shear_cat0'][i],   # multiplicative bias
+        mrTab['m_sel'][i],          # multplicative selection bias
+        mrTab['a_sel'][i],          # additive selection bias
+    )
+    for i in range(nzs)
+]
+cors = mea2pcf.measure_tomographic_2pcf(
+    dataG,
+    biases,
+    engine=engine,
+    outFname=strTmp,
+    fields=fields,
+)
+cors0 = cors['all']
@@ -5,12 +5,14 @@
 import gc
 import os
 import glob
+from concurrent import futures
 import fitsio
 import argparse
 import schwimmbad
 import numpy as np
 from utils_shear_ana import catutil
 from utils_shear_ana import mea2pcf
+from utils_shear_ana import preutil
 import astropy.table as astTable
 
 # correction for shell thickness
@@ -18,16 +20,20 @@ corrs = np.array([1.17133725, 1.08968149, 1.06929737, 1.05591374])
 
 
 class Worker(object):
-    def __init__(self, datname, fieldname, do_finer):
+    def __init__(self, datname, fieldname, do_finer, prefetch=False):
         self.nz = 4
+        self.prefetch = prefetch
         self.blind_ver = datname
         self.fieldname = fieldname
         wrkDir = os.environ["homeWrk"]
         self.do_finer = do_finer
+        # correlation version
         if not self.do_finer:
             self.cor_ver = "cor_fields"
+            self.engine = mea2pcf.CorrelationEngine("DF")
         else:
             self.cor_ver = "cor_finer"
+            self.engine = mea2pcf.CorrelationEngine("B360")
         self.oDir = os.path.join(
             wrkDir, "cosmicShear/mocksim/%s_%s/" % (self.cor_ver, self.blind_ver)
         )
@@ -35,90 +41,133 @@ class Worker(object):
             os.makedirs(self.oDir, exist_ok=True)
         self.mockDir = os.path.join(wrkDir, "S19ACatalogs/catalog_mock/shape_v2/")
         self.msklist = []
+        # index arrays of the fields in each redshift bin ("fields" mode)
+        self.fields = None
+        if fieldname == "fields":
+            self.fields = []
         for i in range(self.nz):
             _ = os.path.join(
                 os.environ["homeWrk"], "cosmicShear/catalog/field_zbin%d.fits" % (i + 1)
             )
-            if fieldname != "all":
-                self.msklist.append(fitsio.read(_)["field"] == fieldname)
+            # only read the field column
+            field = fitsio.read(_, columns=["field"])["field"]
+            if fieldname not in ["all", "fields"]:
+                self.msklist.append(field == fieldname)
             else:
-                self.msklist.append(fitsio.read(_)["field"] != "nan")
+                self.msklist.append(field != "nan")
                 # self.msklist.append(~np.load("./msk_%d.npy" %i))
+            if self.fields is not None:
+                field = field[self.msklist[i]]
+                self.fields.append(
+                    {str(ff): np.where(field == ff)[0] for ff in np.unique(field)}
+                )
+        if self.fields is not None:
+            # measure each field in one job, and get "all" by summing the pair
+            # sums of the fields and of the pairs across the close fields
+            self.outlist = list(self.fields[0].keys()) + ["all"]
+            for i in range(1, self.nz):
+                assert self.fields[i].keys() == self.fields[0].keys()
+            # fields closer than max_sep are measured with the pairs across
+            # them; the others should be separated by more than max_sep
+            groups = mea2pcf.check_field_groups(self.outlist[:-1], self.engine)
+            print("groups of fields with pairs across fields: %s" % groups)
+        else:
+            self.outlist = [fieldname]
         # for i in range(self.nz):
         #     print(np.sum(~self.msklist[i]))
         self.mrTab = astTable.Table.read(
             os.path.join(os.environ["HOME"], "hsc_blinds/shear_biases_fiducial.csv")
         )
+        # scratch buffers reused by all the mock catalogs of the worker
+        self.workspace = catutil.MockWorkspace()
         return
 
     def read_data(self, fname, iz):
-        dd = fitsio.read(fname)
-        dd = dd[self.msklist[iz]]
-        dd = catutil.make_mock_catalog(
-            dd,
-            mbias=self.mrTab["m_shear_%s" % self.blind_ver][iz],
-            msel=self.mrTab["m_sel"][iz],
-            corr=corrs[iz],
-        )
-        msk = (dd["noise1_int"] ** 2.0 + dd["noise2_int"] ** 2.0) < 10.0
-        msk = msk & ((dd["noise1_mea"] ** 2.0 + dd["noise2_mea"] ** 2.0) < 10.0)
-        dd = dd[msk]
-        del msk
-        cat = mea2pcf.convert_mock2treecat(
-            dd, self.mrTab["m_shear_%s" % self.blind_ver][iz], self.mrTab["m_sel"][iz]
-        )
-        return cat
+        # only read the columns used by prepare_mock_treecat
+        dd = preutil.read_fits_required(fname, mea2pcf.prepare_mock_treecat)
+        return dd[self.msklist[iz]]
 
-    def run(self, ref):
+    def load_realization(self, ref):
+        """Reads the catalogs of all the redshift bins of a realization, returns
+        None if all the correlations of the realization have been measured
+        """
         isim = ref // 13
         irot = ref % 13
-        # correlation version
-        if not self.do_finer:
-            cor = mea2pcf.corDF
-        else:
-            cor = mea2pcf.corB360
-        flist = glob.glob(
-            os.path.join(
-                self.oDir, "r%03d_rotmat%d_%s_cor*.fits" % (isim, irot, self.fieldname)
+        ndone = 0
+        for ff in self.outlist:
+            flist = glob.glob(
+                os.path.join(
+                    self.oDir, "r%03d_rotmat%d_%s_cor*.fits" % (isim, irot, ff)
+                )
             )
-        )
-        if len(flist) == self.nz * (self.nz + 1) / 2:
+            ndone += len(flist) == self.nz * (self.nz + 1) / 2
+        if ndone == len(self.outlist):
             print(
                 "Already have all the fiels for isim: %d, irot: %d, field: %s \n\
                 at %s"
                 % (isim, irot, self.fieldname, self.oDir)
             )
-            return
-
+            return None
+        catalogs = []
         for i in range(self.nz):
             znmi = os.path.join(
                 self.mockDir,
                 "fiducial_zbins/cat_r%03d_rotmat%d_zbin%d.fits" % (isim, irot, i + 1),
             )
-            catI = self.read_data(znmi, i)
-            for j in range(i, self.nz):
-                znmj = os.path.join(
-                    self.mockDir,
-                    "fiducial_zbins/cat_r%03d_rotmat%d_zbin%d.fits"
-                    % (isim, irot, j + 1),
-                )
-                catJ = self.read_data(znmj, j)
-                cor.clear()
-                cor.process(catI, catJ)
-                _ofname = os.path.join(
-                    self.oDir,
-                    "r%03d_rotmat%d_%s_cor%d%d.fits"
-                    % (isim, irot, self.fieldname, i + 1, +j + 1),
-                )
-                cor.write(_ofname)
-                del catJ
-                gc.collect()
-            del catI
-            gc.collect()
+            catalogs.append(self.read_data(znmi, i))
+        return catalogs
+
+    def run(self, ref, catalogs=None):
+        isim = ref // 13
+        irot = ref % 13
+        if catalogs is None:
+            catalogs = self.load_realization(ref)
+            if catalogs is None:
+                return
+        biases = [
+            (self.mrTab["m_shear_%s" % self.blind_ver][iz], self.mrTab["m_sel"][iz])
+            for iz in range(self.nz)
+        ]
+        _ofname = {
+            ff: os.path.join(
+                self.oDir, "r%03d_rotmat%d_%s_cor%%d%%d.fits" % (isim, irot, ff)
+            )
+            for ff in self.outlist
+        }
+        if self.fields is None:
+            _ofname = _ofname[self.fieldname]
+        # each redshift bin is converted once and kept for all its pairs
+        mea2pcf.measure_tomographic_2pcf_mock(
+            catalogs,
+            biases,
+            corrs=corrs,
+            engine=self.engine,
+            outFname=_ofname,
+            workspace=self.workspace,
+            fields=self.fields,
+        )
+        del catalogs
+        gc.collect()
         return
 
-    def __call__(self, ref):
-        self.run(ref)
+    def __call__(self, refs):
+        if np.isscalar(refs):
+            self.run(refs)
+            return
+        if not self.prefetch:
+            for ref in refs:
+                self.run(ref)
+            return
+        # read the next realization in the background while treecorr runs
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            nxt = executor.submit(self.load_realization, refs[0])
+            for n, ref in enumerate(refs):
+                catalogs = nxt.result()
+                if n + 1 < len(refs):
+                    nxt = executor.submit(self.load_realization, refs[n + 1])
+                if catalogs is not None:
+                    self.run(ref, catalogs)
+                del catalogs
         return
 
 
@@ -134,7 +183,8 @@ if __name__ == "__main__":
         "--field",
         required=True,
         type=str,
-        help="field name, all, XMM, VVDS or GAMA09H, HECTOMAP etc.",
+        help="field name, all, XMM, VVDS or GAMA09H, HECTOMAP etc., or fields "
+        "(each field, and all from the pair sums of the fields)",
     )
     parser.add_argument(
         "--datname", default="cat0", type=str, help="data name. cat0, cat1 or cat2"
@@ -142,6 +192,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--finer", default=False, type=bool, help="whether do finer for B-mode test"
     )
+    parser.add_argument(
+        "--prefetch",
+        default=False,
+        action="store_true",
+        help="read the next realization in a background thread",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        default=13,
+        type=int,
+        help="number of realizations per task (with --prefetch)",
+    )
     # mpi
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
@@ -157,8 +219,12 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     pool = schwimmbad.choose_pool(mpi=args.mpi, processes=args.n_cores)
-    worker = Worker(args.datname, args.field, args.finer)
+    worker = Worker(args.datname, args.field, args.finer, args.prefetch)
     refs = list(range(args.minId, args.maxId))
+    if args.prefetch:
+        # a task processes a chunk of realizations, so that the next one can be
+        # read while the current one is measured
+        refs = catutil.chunkPList(refs, args.chunk_size)
     for r in pool.map(worker, refs):
         pass
     pool.close()
@@ -8,10 +8,11 @@ import fitsio
 import argparse
 import schwimmbad
 import numpy as np
+from utils_shear_ana import mea2pcf
 
 
 class Worker(object):
-    def __init__(self, datname, fieldname, do_finer):
+    def __init__(self, datname, fieldname, do_finer, rebin=None, rebin_tol=1e-6):
         self.nz = 4
         wrkDir = os.environ["homeWrk"]
         self.fieldname = fieldname
@@ -20,6 +21,14 @@ class Worker(object):
             self.cor_ver = "cor_fields"
         else:
             self.cor_ver = "cor_finer"
+        # rebin the finer correlations to a coarser binning (e.g. DF)
+        self.out_ver = self.cor_ver
+        self.engine = None
+        if rebin is not None:
+            assert do_finer, "rebinning is for the finer correlations"
+            self.engine = mea2pcf.CorrelationEngine(rebin)
+            self.rebin_tol = rebin_tol
+            self.out_ver = "%s_rebin%s" % (self.cor_ver, rebin)
         self.blind_ver = datname
         self.corDir = os.path.join(
             wrkDir, "cosmicShear/mocksim/%s_%s/" % (self.cor_ver, self.blind_ver)
@@ -54,7 +63,12 @@ class Worker(object):
                     % (isim, irot, self.fieldname, i + 1, j + 1),
                 )
                 data = fitsio.read(fname)
-                dd = np.hstack([data["xip"], data["xim"]])
+                if self.engine is not None:
+                    cor = mea2pcf.rebin_correlation(data, self.engine, self.rebin_tol)
+                    dd = np.hstack([cor.xip, cor.xim])
+                    del cor
+                else:
+                    dd = np.hstack([data["xip"], data["xim"]])
                 # if not np.all((np.abs(dd) > 1e-20) & (np.abs(dd) < 1e-3)):
                 #     print(
                 #         "Find a problematic simulation: isim: %d, irot: %d, field: %s"
@@ -89,6 +103,19 @@ if __name__ == "__main__":
     parser.add_argument(
         "--finer", default=False, type=bool, help="whether do finer for B-mode test"
     )
+    parser.add_argument(
+        "--rebin",
+        default=None,
+        type=str,
+        help="rebin the finer correlations to a binning, e.g. DF",
+    )
+    parser.add_argument(
+        "--rebin_tol",
+        default=1e-6,
+        type=float,
+        help="tolerance of the bin edge alignment for --rebin, in units of the "
+        "finer bin size (larger for the correlations with unaligned bins)",
+    )
     # mpi
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
@@ -104,7 +131,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     pool = schwimmbad.choose_pool(mpi=args.mpi, processes=args.n_cores)
-    worker = Worker(args.datname, args.field, args.finer)
+    worker = Worker(args.datname, args.field, args.finer, args.rebin, args.rebin_tol)
     refs = list(range(args.minId, args.maxId))
     outputs = []
     for r in pool.map(worker, refs):
@@ -114,6 +141,6 @@ if __name__ == "__main__":
     fname = os.path.join(
         os.environ["homeWrk"],
         "cosmicShear/mocksim/%s_%s_%s.fits"
-        % (worker.cor_ver, args.field, worker.blind_ver),
+        % (worker.out_ver, args.field, worker.blind_ver),
     )
     fitsio.write(fname, outputs)
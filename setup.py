@@ -19,6 +19,7 @@ scripts = [
         "bin/shear_config",
         "bin/meas_2pcf_mock.py",
         "bin/merge_2pcf_mock.py",
+        "bin/convert_column_store.py",
         ]
 
 setup(
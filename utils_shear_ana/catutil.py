@@ -17,14 +17,20 @@
 # python lib
 
 import os
+import sys
+import json
 import warnings
+import functools
+import threading
+import concurrent.futures
 import numpy as np
 import healpy as hp
 import scipy.optimize
 
 import astropy.io.fits as pyfits
 from astropy.table import Table, join
-from scipy.interpolate import griddata
+from scipy.interpolate import interp1d
+from scipy.interpolate import LinearNDInterpolator, NearestNDInterpolator
 
 # Field keys used in the noise variance file for simulations
 field_names = {
@@ -73,6 +79,326 @@ def chunkPList(seq, per):
     return out
 
 
+class CatalogView(object):
+    """A read-only view of a catalog which memoizes the columns derived by the
+    `get_*` accessors of this module.
+
+    The accessors accept a CatalogView in place of the structured array. The
+    column aliases of the catalog schema (S15/S16A/S18A/S19A/pipe 7/mock) are
+    resolved once and the derived quantities (e.g. SNR, resolution, galaxy and
+    PSF ellipticities) are computed once per view. Row selections
+    `view[mask]` return sub-views, which only slice the columns (and the
+    cached derived columns of the parent view) that are accessed, instead of
+    copying every column of the selected rows.
+
+    Note: the view assumes that the underlying catalog is not modified after
+    a derived column is cached.
+
+    Args:
+        catalog (ndarray):      input catalog (structured array)
+    """
+
+    def __init__(self, catalog):
+        if isinstance(catalog, CatalogView):
+            catalog = catalog.data
+        self._base = catalog
+        self._parent = None
+        self._index = None
+        self._cache = {}
+        self._len = len(catalog)
+        return
+
+    def _subview(self, index):
+        """Returns the sub-view for rows selected by index"""
+        out = object.__new__(type(self))
+        out._base = None
+        out._parent = self
+        out._cache = {}
+        if isinstance(index, slice):
+            out._len = len(range(*index.indices(self._len)))
+        else:
+            index = np.asarray(index)
+            if index.dtype == bool:
+                if index.shape != (self._len,):
+                    raise IndexError("boolean index does not match the catalog")
+                out._len = int(np.count_nonzero(index))
+            elif index.ndim != 1:
+                # a scalar index would select a record instead of a sub-view
+                raise IndexError("rows are selected by a slice or a 1-d index")
+            else:
+                out._len = len(index)
+        out._index = index
+        return out
+
+    @property
+    def dtype(self):
+        """dtype of the underlying catalog"""
+        view = self
+        while view._parent is not None:
+            view = view._parent
+        return view._base.dtype
+
+    @property
+    def shape(self):
+        return (self._len,)
+
+    @property
+    def size(self):
+        return self._len
+
+    @property
+    def data(self):
+        """The selected rows as a structured ndarray [copied for sub-views]"""
+        if self._parent is None:
+            return self._base
+        return self._parent.data[self._index]
+
+    def __len__(self):
+        return self._len
+
+    def _column(self, name):
+        key = ("column", name)
+        if key not in self._cache:
+            if self._parent is None:
+                self._cache[key] = self._base[name]
+            else:
+                self._cache[key] = self._parent._column(name)[self._index]
+        return self._cache[key]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._column(key)
+        if isinstance(key, list) and len(key) > 0 and isinstance(key[0], str):
+            return self.data[key]
+        return self._subview(key)
+
+    def __setitem__(self, key, value):
+        if self._parent is not None or not isinstance(key, str):
+            raise TypeError("only columns of a root CatalogView can be updated")
+        self._base[key] = value
+        # derived columns may depend on the updated column
+        self._cache.clear()
+        return
+
+    def memoize(self, key, func):
+        """Returns the cached value of key, computing it with func() if it is
+        not in the cache; for sub-views, the value cached by the parent view
+        is sliced instead of being recomputed.
+        """
+        if key in self._cache:
+            return self._cache[key]
+        value = None
+        if self._parent is not None:
+            pvalue = self._parent._cache.get(key)
+            if pvalue is not None:
+                value = _slice_derived(pvalue, self._index)
+        if value is None:
+            value = func()
+        # callers share the cached arrays, so they must not modify them
+        _set_readonly(value)
+        self._cache[key] = value
+        return value
+
+    def clear_cache(self):
+        """Drops all the cached columns"""
+        self._cache.clear()
+        return
+
+
+"""column_store_version: version of the manifest of the column stores"""
+column_store_version = 1
+
+
+class ColumnStore(CatalogView):
+    """A catalog stored as a directory of per-column .npy files with a JSON
+    manifest (written by `preutil.write_column_store`). The columns are
+    memory-mapped (read-only) when they are first accessed, so only the
+    columns used by the accessors are read, without copies, and processes on
+    the same node share the page cache. The store is a `CatalogView`, so it
+    can be passed to the accessors of this module in place of a structured
+    array.
+
+    Args:
+        dirname (str):      directory of the store
+    """
+
+    def __init__(self, dirname):
+        with open(os.path.join(dirname, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != column_store_version:
+            raise ValueError(
+                "Unsupported column store version: %s" % manifest.get("version")
+            )
+        self.dirname = dirname
+        self.meta = manifest.get("meta", {})
+        self._dtype = np.dtype(
+            [(name, dt, tuple(shape)) for name, dt, shape in manifest["columns"]]
+        )
+        self._base = None
+        self._parent = None
+        self._index = None
+        self._cache = {}
+        self._len = int(manifest["nrow"])
+        return
+
+    @property
+    def dtype(self):
+        """dtype of the catalog"""
+        view = self
+        while view._parent is not None:
+            view = view._parent
+        return view._dtype
+
+    @property
+    def data(self):
+        """The selected rows as a structured ndarray [copied]"""
+        out = np.empty(self._len, dtype=self.dtype)
+        for name in self.dtype.names:
+            out[name] = self._column(name)
+        return out
+
+    def _column(self, name):
+        key = ("column", name)
+        if key not in self._cache:
+            if self._parent is None:
+                if name not in self._dtype.names:
+                    raise ValueError("no field of name %s" % name)
+                self._cache[key] = np.load(
+                    os.path.join(self.dirname, "%s.npy" % name), mmap_mode="r"
+                )
+            else:
+                self._cache[key] = self._parent._column(name)[self._index]
+        return self._cache[key]
+
+    def __getitem__(self, key):
+        if isinstance(key, list) and len(key) > 0 and isinstance(key[0], str):
+            # only copies the selected columns
+            out = np.empty(self._len, dtype=[(k, self.dtype[k]) for k in key])
+            for name in key:
+                out[name] = self._column(name)
+            return out
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        raise TypeError("column stores are read-only")
+
+
+def _slice_derived(value, index):
+    """Slices a (tuple of) derived column(s) cached by a CatalogView"""
+    if isinstance(value, tuple):
+        return tuple(_slice_derived(vv, index) for vv in value)
+    return value[index]
+
+
+def _set_readonly(value):
+    """Sets a (tuple of) derived column(s) cached by a CatalogView read-only"""
+    if isinstance(value, tuple):
+        for vv in value:
+            _set_readonly(vv)
+    elif isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    return
+
+
+def _cached_on_view(func):
+    """Decorator memoizing the result of a catalog accessor on CatalogView
+    inputs; the cached arrays are returned read-only. Plain ndarray inputs are
+    passed through unchanged.
+    """
+
+    @functools.wraps(func)
+    def wrapper(catalog, *args, **kwargs):
+        if not isinstance(catalog, CatalogView):
+            return func(catalog, *args, **kwargs)
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        return catalog.memoize(key, lambda: func(catalog, *args, **kwargs))
+
+    return wrapper
+
+
+def uses_columns(*alternatives, requires=(), optional=(), branches=None):
+    """Decorator declaring the source columns read by a catalog accessor, so
+    that readers can load only the columns needed by a stage (see
+    `required_columns`).
+
+    Args:
+        alternatives (tuple):   columns read for each catalog schema, in the
+                                order tested by the accessor; an alternative
+                                is used if its first column is in the catalog
+        requires (list):        accessors called by the accessor (functions,
+                                or names of functions in the same module), or
+                                (accessor, branch) pairs
+        optional (tuple):       columns read whenever they are in the catalog
+        branches (dict):        alternatives read only by a branch of the
+                                accessor, keyed by the value of the argument
+                                selecting the branch (e.g. the photo-z method);
+                                all the branches are read if the requirement
+                                does not give the branch
+    """
+
+    def decorator(func):
+        func.catalog_columns = (
+            tuple(tuple(alt) for alt in alternatives),
+            tuple(requires),
+            tuple(optional),
+            {
+                key: tuple(tuple(alt) for alt in alts)
+                for key, alts in (branches or {}).items()
+            },
+        )
+        return func
+
+    return decorator
+
+
+def required_columns(funcs, names):
+    """Returns the columns of a catalog read by a list of accessors (declared
+    with `uses_columns`), including the accessors they call
+
+    Args:
+        funcs (list):       accessors, or (accessor, branch) pairs [or a single
+                            accessor]
+        names (list):       columns of the catalog (e.g. the column names of
+                            the FITS table)
+    Returns:
+        columns (list):     needed columns, in the order of names
+    """
+    if callable(funcs):
+        funcs = [funcs]
+    names = list(names)
+    available = set(names)
+    out = set()
+    stack = [req if isinstance(req, tuple) else (req, None) for req in funcs]
+    done = set()
+    while len(stack) > 0:
+        func, branch = stack.pop()
+        if (func, branch) in done:
+            continue
+        done.add((func, branch))
+        if not hasattr(func, "catalog_columns"):
+            raise ValueError("%s does not declare its columns" % func.__name__)
+        alternatives, requires, optional, branches = func.catalog_columns
+        if branch is None:
+            groups = [alternatives] + list(branches.values())
+        elif branch in branches:
+            groups = [alternatives, branches[branch]]
+        else:
+            raise ValueError("%s has no branch %s" % (func.__name__, branch))
+        for alts in groups:
+            for alt in alts:
+                if alt[0] in available:
+                    out.update(alt)
+                    break
+        out.update(optional)
+        module = sys.modules[func.__module__]
+        for req in requires:
+            req, rbranch = req if isinstance(req, tuple) else (req, None)
+            if isinstance(req, str):
+                req = getattr(module, req)
+            stack.append((req, rbranch))
+    return [name for name in names if name in out]
+
+
 def m_func(x, b, c, d, e):
     """Empirically-motivated model we are trying to fit for m(SNR, res).
 
@@ -191,32 +517,23 @@ def prepare_field_catalog(filename, fieldname, isim=-1, ngalR=100, ngrid=64):
     catalog["ipos"] = catalog["ipos"].astype(int)
     inds = np.lexsort([catalog["centDist"], catalog["ipos"]])
     catalog = catalog[inds]
-    inds_unique = np.unique(catalog["ipos"], return_index=True)[1]
+    ipos = np.asarray(catalog["ipos"])
+    first = np.ones(len(ipos), dtype=bool)
+    first[1:] = ipos[1:] != ipos[:-1]
+    inds_unique = np.where(first)[0]
 
-    catU = catalog[inds_unique]
     """
     # Identify pairs based on their input ipos values
     """
     n = ngalR * ngalR  # Number of grid points
-    mask_even = np.in1d(
-        catU["ipos"] % n, 2 * np.arange(n / 2).astype("int"), assume_unique=True
-    )
-    mask_odd = np.in1d(
-        catU["ipos"] % n, 2 * np.arange(n / 2).astype("int") + 1, assume_unique=True
-    )
-
-    # Find index of broken pairs
-    broken_pairs = np.setxor1d(
-        catU["ipos"][mask_even] % n, catU["ipos"][mask_odd] % n - 1
-    )
-    mask_pairs = ~np.in1d(
-        catU["ipos"] % n,
-        np.concatenate([broken_pairs, broken_pairs + 1]),
-        assume_unique=True,
-    )
+    # Direct-addressed lookup over grid points: the partner of grid point k is
+    # k ^ 1 (i.e. 2j <-> 2j + 1), and a pair is complete if both are detected
+    kpos = ipos[inds_unique] % n
+    detected = np.zeros(n + 1, dtype=bool)
+    detected[kpos] = True
+    mask_pairs = detected[kpos ^ 1]
 
     catalog["paired"][inds_unique] = mask_pairs
-    catalog.sort(["paired", "ipos"])
 
     """
     # Load information from psfPre
@@ -256,6 +573,80 @@ def prepare_field_catalog(filename, fieldname, isim=-1, ngalR=100, ngrid=64):
     return catalog
 
 
+def get_pair_index(catalog, ngalR=100):
+    """Returns the row index of the 90-degree rotated partner of every galaxy
+    in a simulation catalog. The partner of the galaxy on grid point k of
+    subfield isim is the galaxy on grid point k ^ 1 of the same subfield, so
+    the partners are found from the (isim, ipos) keys by direct addressing
+    over the grid points of the subfields in the catalog, without sorting.
+    The result does not rely on the order of rows, and it is valid for the
+    rows of any selection or concatenation of the catalogs.
+
+    Args:
+        catalog (ndarray):      simulation catalog with 'isim', 'ipos' and
+                                'paired' columns
+        ngalR (int):            number of stamps in each row
+    Returns:
+        pair_index (ndarray):   row index of the partner, -1 for galaxies
+                                without partner in the catalog
+    """
+    n = ngalR * ngalR
+    pair_index = np.full(len(catalog["paired"]), -1, dtype=np.int64)
+    rows = np.where(catalog["paired"])[0]
+    if len(rows) == 0:
+        return pair_index
+    isim = np.asarray(catalog["isim"])[rows].astype(np.int64)
+    kpos = np.asarray(catalog["ipos"])[rows].astype(np.int64) % n
+    # dense index of the subfields in the catalog
+    isim = isim - isim.min()
+    present = np.bincount(isim) > 0
+    dense = np.cumsum(present) - 1
+    # n + 1 grid points per subfield, since k ^ 1 = n for k = n - 1 if n is odd
+    offset = dense[isim] * (n + 1)
+    lookup = np.full(int(np.count_nonzero(present)) * (n + 1), -1, dtype=np.int64)
+    lookup[offset + kpos] = rows
+    if np.count_nonzero(lookup >= 0) != len(rows):
+        raise ValueError("the (isim, ipos) keys of the paired galaxies are not unique")
+    pair_index[rows] = lookup[offset + (kpos ^ 1)]
+    return pair_index
+
+
+def _has_pair_keys(names):
+    """Returns whether a catalog identifies its 90-degree pairs with the
+    (isim, ipos) keys
+    """
+    return "paired" in names and "isim" in names and "ipos" in names
+
+
+def _get_pair_rows(catalog, names=None, ngalR=100):
+    """Returns the row indices (ind1, ind2) of the first (on the even grid
+    point) and the second members of the 90-degree pairs. The partners are
+    found from the (isim, ipos) keys of the rows (see `get_pair_index`), so
+    the result does not depend on the order of rows. Catalogs without these
+    keys rely on the order of the paired rows (partners next to each other).
+
+    Args:
+        catalog (ndarray | dict):   catalog (or dict of its columns)
+        names (tuple):              column names [default: catalog.dtype.names]
+        ngalR (int):                number of stamps in each row
+    Returns:
+        ind1 (ndarray):             rows of the first members
+        ind2 (ndarray):             rows of the second members
+    """
+    if names is None:
+        names = catalog.dtype.names
+    if not _has_pair_keys(names):
+        ind_pair = np.where(catalog["paired"])[0]
+        if len(ind_pair) % 2 != 0:
+            raise ValueError("odd number of paired galaxies without (isim, ipos)")
+        return ind_pair[0::2], ind_pair[1::2]
+    pair_index = get_pair_index(catalog, ngalR=ngalR)
+    # the first member sits on the even grid point
+    kpos = np.asarray(catalog["ipos"]) % (ngalR * ngalR)
+    ind1 = np.where((pair_index >= 0) & (kpos % 2 == 0))[0]
+    return ind1, pair_index[ind1]
+
+
 def galaxy_selector(
     catalog,
     min_snr=None,
@@ -285,7 +676,7 @@ def galaxy_selector(
     the input of the simulation.
 
     Args:
-        catalog (ndarray):
+        catalog (ndarray | CatalogView):
             catalog on which the cuts apply.
         min_snr (float):
             minimum i-band unforced cmodel SNR cut
@@ -321,135 +712,320 @@ def galaxy_selector(
             done.
 
     """
-    if force_90_pair and "paired" not in catalog.dtype.names:
-        raise Exception("cannot cancel shape noise since 'paired' column not found")
-
-    mask = np.ones(len(catalog)).astype(bool)
-    if ("npass" in catalog.dtype.names) and minNpass > 0:
-        mask &= get_npass(catalog) >= minNpass
+    cuts = GalaxyCuts(
+        min_snr=min_snr,
+        max_snr=max_snr,
+        min_res=min_res,
+        max_res=max_res,
+        max_magA10=max_magA10,
+        max_sigma_e=max_sigma_e,
+        max_e=max_e,
+        max_mag=max_mag,
+        min_fpfs_flux=min_fpfs_flux,
+        max_fpfs_flux=max_fpfs_flux,
+        lower_psf_size=lower_psf_size,
+        upper_psf_size=upper_psf_size,
+        force_90_pair=force_90_pair,
+        max_stampCent_distance=max_stampCent_distance,
+        max_logb=max_logb,
+        applyboth=applyboth,
+        minNpass=minNpass,
+        doBOmsk=doBOmsk,
+    )
+    return cuts(catalog)
 
-    if doBOmsk:
-        mask &= ~get_briObj_cuts_s18(catalog)
 
-    if max_stampCent_distance is not None:
-        dx = abs(catalog["base_SdssCentroid_x"] % 64 - 32)
-        dy = abs(catalog["base_SdssCentroid_y"] % 64 - 32)
-        mask &= dx**2.0 + dy**2.0 <= max_stampCent_distance**2.0
+def _iter_row_chunks(catalog, chunk_size=None):
+    """Yields (start, chunk) for contiguous row chunks of the catalog; the
+    chunks are views (basic slices), not copies.
+    """
+    nrow = len(catalog)
+    if chunk_size is None or chunk_size >= nrow:
+        yield 0, catalog
+        return
+    if chunk_size <= 0:
+        raise ValueError("chunk_size should be positive")
+    for start in range(0, nrow, chunk_size):
+        yield start, catalog[start : start + chunk_size]
+
+
+class GalaxyCuts(object):
+    """Compiled version of the `galaxy_selector` cuts (see `galaxy_selector`
+    for the definition of the arguments).
+
+    The cuts are compiled into lists of row-wise predicates, which are
+    evaluated column-wise in a single pass over the catalog (optionally in
+    fixed-size row chunks). Each derived column (e.g. SNR, resolution) is
+    computed once per chunk and shared by all the predicates, and the
+    catalog rows are never copied; only the boolean results are combined at
+    the end. The 90-degree pair bookkeeping (`force_90_pair`, `applyboth`) and
+    the PSF-size percentile cuts are applied on these booleans, so that the
+    output mask is identical to the original sequential selection.
+
+    Example:
+        cuts = GalaxyCuts(min_snr=10.0, min_res=0.3, max_mag=24.5)
+        mask = cuts(catalog, chunk_size=1000000)
+    """
 
-    if force_90_pair:
-        ind_pair = np.where(catalog["paired"])[0]
-        ind_pair1 = ind_pair[0::2]
-        ind_pair2 = ind_pair[1::2]
-        # Masking elements not in a pair to begin with
-        mask &= catalog["paired"]
-    else:
-        ind_pair1 = np.empty(0)
-        ind_pair2 = np.empty(0)
-
-    # Basic sanity checks: none of the quantities that we want to use should
-    # be NaN. We also impose the sigma_e and e cuts here, because even just
-    # a few bad values can totally mess stuff up.
-    e1_psf, e2_psf = get_psf_ellip(catalog)
-    e1_regaus, e2_regaus = get_gal_ellip(catalog)
-    if (min_res is not None) or (max_sigma_e is not None) or (max_e is not None):
-        mask &= (
-            (~np.isnan(e1_regaus))
-            & (~np.isnan(e2_regaus))
-            & (~np.isnan(e1_psf))
-            & (~np.isnan(e2_psf))
-            & (~np.isnan(get_res(catalog)))
-            & (~np.isnan(get_sigma_e(catalog)))
+    def __init__(
+        self,
+        min_snr=None,
+        max_snr=None,
+        min_res=None,
+        max_res=None,
+        max_magA10=None,
+        max_sigma_e=None,
+        max_e=None,
+        max_mag=None,
+        min_fpfs_flux=None,
+        max_fpfs_flux=None,
+        lower_psf_size=0.0,
+        upper_psf_size=100.0,
+        force_90_pair=True,
+        max_stampCent_distance=None,
+        max_logb=None,
+        applyboth="",
+        minNpass=2,
+        doBOmsk=False,
+    ):
+        self.min_snr = min_snr
+        self.max_snr = max_snr
+        self.min_res = min_res
+        self.max_res = max_res
+        self.max_magA10 = max_magA10
+        self.max_sigma_e = max_sigma_e
+        self.max_e = max_e
+        self.max_mag = max_mag
+        self.min_fpfs_flux = min_fpfs_flux
+        self.max_fpfs_flux = max_fpfs_flux
+        self.lower_psf_size = lower_psf_size
+        self.upper_psf_size = upper_psf_size
+        self.force_90_pair = force_90_pair
+        self.max_stampCent_distance = max_stampCent_distance
+        self.max_logb = max_logb
+        self.applyboth = applyboth
+        self.minNpass = minNpass
+        self.doBOmsk = doBOmsk
+        return
+
+    def compile(self, names):
+        """Compiles the cuts into row-wise predicates for a catalog schema
+
+        Args:
+            names (tuple):      column names of the catalog
+        Returns:
+            stages (dict):      lists of predicates for the 'sanity' cuts
+                                (synchronized within pairs), the 'basic'
+                                cuts, the 'fpfs' cuts and the cuts applied to
+                                'both' galaxies in a pair
+        """
+        if self.force_90_pair and "paired" not in names:
+            raise Exception("cannot cancel shape noise since 'paired' column not found")
+        sanity = []
+        basic = []
+        fpfs = []
+        both = []
+
+        if ("npass" in names) and self.minNpass > 0:
+            sanity.append(lambda cat: get_npass(cat) >= self.minNpass)
+        if self.doBOmsk:
+            sanity.append(lambda cat: ~get_briObj_cuts_s18(cat))
+        if self.max_stampCent_distance is not None:
+
+            def _stamp_cut(cat):
+                dx = abs(cat["base_SdssCentroid_x"] % 64 - 32)
+                dy = abs(cat["base_SdssCentroid_y"] % 64 - 32)
+                return dx**2.0 + dy**2.0 <= self.max_stampCent_distance**2.0
+
+            sanity.append(_stamp_cut)
+        if self.force_90_pair:
+            sanity.append(lambda cat: cat["paired"])
+
+        # Basic sanity checks: none of the quantities that we want to use
+        # should be NaN
+        if (
+            (self.min_res is not None)
+            or (self.max_sigma_e is not None)
+            or (self.max_e is not None)
+        ):
+
+            def _nan_cut(cat):
+                e1_psf, e2_psf = get_psf_ellip(cat)
+                e1_regaus, e2_regaus = get_gal_ellip(cat)
+                return (
+                    (~np.isnan(e1_regaus))
+                    & (~np.isnan(e2_regaus))
+                    & (~np.isnan(e1_psf))
+                    & (~np.isnan(e2_psf))
+                    & (~np.isnan(get_res(cat)))
+                    & (~np.isnan(get_sigma_e(cat)))
+                )
+
+            sanity.append(_nan_cut)
+        if (self.min_snr is not None) or (self.max_snr is not None):
+            sanity.append(lambda cat: ~np.isnan(get_snr(cat)))
+        if self.max_magA10 is not None:
+            sanity.append(lambda cat: ~np.isnan(get_imag_A10(cat)))
+        if self.max_mag is not None:
+            sanity.append(lambda cat: ~np.isnan(get_imag(cat)))
+        if (self.min_fpfs_flux is not None) or (self.max_fpfs_flux is not None):
+            sanity.append(lambda cat: ~np.isnan(get_FPFS1_obs(cat)[4]))
+        if self.max_sigma_e is not None:
+            sanity.append(lambda cat: get_sigma_e(cat) <= self.max_sigma_e)
+        if self.max_e is not None:
+            sanity.append(lambda cat: get_abs_ellip(cat) <= self.max_e)
+
+        # Cuts on resolution, S/N and magnitude
+        if self.min_res is not None:
+            basic.append(lambda cat: get_res(cat) >= self.min_res)
+        if self.max_res is not None:
+            basic.append(lambda cat: get_res(cat) <= self.max_res)
+        if self.min_snr is not None:
+            basic.append(lambda cat: get_snr(cat) >= self.min_snr)
+        if self.max_snr is not None:
+            basic.append(lambda cat: get_snr(cat) <= self.max_snr)
+        if self.max_magA10 is not None:
+            basic.append(lambda cat: get_imag_A10(cat) <= self.max_magA10)
+        if self.max_mag is not None:
+            if "a_i" in names:
+                basic.append(lambda cat: get_imag(cat) - cat["a_i"] <= self.max_mag)
+            else:
+                warnings.warn(
+                    "Extinction not revised: Do not have Extinction observables in catalog"
+                )
+                basic.append(lambda cat: get_imag(cat) <= self.max_mag)
+        if self.max_logb is not None:
+            basic.append(lambda cat: get_logb(cat) <= self.max_logb)
+
+        if self.min_fpfs_flux is not None:
+            fpfs.append(lambda cat: get_FPFS1_obs(cat)[4] >= self.min_fpfs_flux)
+        if self.max_fpfs_flux is not None:
+            fpfs.append(lambda cat: get_FPFS1_obs(cat)[4] <= self.max_fpfs_flux)
+
+        # Cuts applied to both galaxies in a pair to introduce selection bias
+        if self.force_90_pair and self.applyboth != "":
+            if "resolution" in self.applyboth and self.min_res is not None:
+                both.append(lambda cat: get_res(cat) >= self.min_res)
+            if "snr" in self.applyboth and self.min_snr is not None:
+                both.append(lambda cat: get_snr(cat) >= self.min_snr)
+            if "mag" in self.applyboth and self.max_mag is not None:
+                both.append(lambda cat: get_imag(cat) - cat["a_i"] < self.max_mag)
+        return {"sanity": sanity, "basic": basic, "fpfs": fpfs, "both": both}
+
+    @property
+    def _use_psf_size(self):
+        return (self.lower_psf_size > 0.0) or (self.upper_psf_size < 100.0)
+
+    def __call__(self, catalog, chunk_size=None):
+        """Returns the selection mask of the catalog
+
+        Args:
+            catalog (ndarray | CatalogView):
+                                input catalog
+            chunk_size (int):   number of rows evaluated at a time
+                                [default: None, the whole catalog]
+        Returns:
+            mask (ndarray):     selection mask
+        """
+        return self.evaluate(
+            _iter_row_chunks(catalog, chunk_size),
+            len(catalog),
+            catalog.dtype.names,
         )
-    if (min_snr is not None) or (max_snr is not None):
-        mask &= ~np.isnan(get_snr(catalog))
-    if max_magA10 is not None:
-        mask &= ~np.isnan(get_imag_A10(catalog))
-    if max_mag is not None:
-        mask &= ~np.isnan(get_imag(catalog))
-    if (min_fpfs_flux is not None) or (max_fpfs_flux is not None):
-        mask &= ~np.isnan(get_FPFS1_obs(catalog)[4])
-
-    if max_sigma_e is not None:
-        sigma_e = get_sigma_e(catalog[mask])
-        mask[mask] &= sigma_e <= max_sigma_e
-    if max_e is not None:
-        absE = get_abs_ellip(catalog[mask])
-        mask[mask] &= absE <= max_e
-
-    # The sanity checks are systematically applied to both members of the pair
-    # Since NaN's make the data unusable, we have to self-consistently impose
-    # this across both 90-degree-rotated pairs (if we're using shape noise
-    # cancellation):
-    if force_90_pair:
-        mask[ind_pair1] = mask[ind_pair1] & mask[ind_pair2]
-        mask[ind_pair2] = mask[ind_pair1]
-
-    # Now we move on to the cuts on resolution, S/N and magnitude.
-    # We should only try to make the cuts on the galaxies that passed the flag
-    # cuts, otherwise we get lots of warnings about invalid values etc.
-    if min_res is not None:
-        mask[mask] &= get_res(catalog[mask]) >= min_res
-    if max_res is not None:
-        mask[mask] &= get_res(catalog[mask]) <= max_res
-
-    if min_snr is not None:
-        snr = get_snr(catalog[mask])
-        mask[mask] &= snr >= min_snr
-    if max_snr is not None:
-        snr = get_snr(catalog[mask])
-        mask[mask] &= snr <= max_snr
-
-    if max_magA10 is not None:
-        magA10 = get_imag_A10(catalog[mask])
-        mask[mask] &= magA10 <= max_magA10
-    if max_mag is not None:
-        if "a_i" in catalog.dtype.names:
-            mag = get_imag(catalog[mask]) - catalog["a_i"][mask]
-        else:
-            warnings.warn(
-                "Extinction not revised: Do not have Extinction observables in catalog"
-            )
-            mag = get_imag(catalog[mask])
-        mask[mask] &= mag <= max_mag
-
-    if max_logb is not None:
-        mask[mask] &= get_logb(catalog[mask]) <= max_logb
-
-    # For PSF size
-    psf_size = get_psf_size(catalog[mask])
-    if lower_psf_size > 0.0:
-        cut_val = np.percentile(psf_size, lower_psf_size)
-        mask[mask] &= psf_size >= cut_val
-    if upper_psf_size < 100.0:
-        cut_val = np.percentile(psf_size, upper_psf_size)
-        mask[mask] &= psf_size < cut_val
-
-    if min_fpfs_flux is not None:
-        mask[mask] &= get_FPFS1_obs(catalog[mask])[4] >= min_fpfs_flux
-    if max_fpfs_flux is not None:
-        mask[mask] &= get_FPFS1_obs(catalog[mask])[4] <= max_fpfs_flux
-
-    # For noise cancellation, apply the cut only to the first element of the
-    # pair to avoid funny selection biases.
-    # But enable introduction of selection bias due to single cuts through applyboth.
-    if force_90_pair:
-        mask[ind_pair2] = mask[ind_pair1]
-        if applyboth != "":
-            if "resolution" in applyboth:
-                if min_res is not None:
+
+    def evaluate(self, chunks, nrow, names):
+        """Evaluates the cuts on a sequence of row chunks
+
+        Args:
+            chunks (iterable):  (start, chunk) for row chunks covering the
+                                catalog; the chunks can be ndarrays or
+                                CatalogViews
+            nrow (int):         total number of rows
+            names (tuple):      column names of the catalog
+        Returns:
+            mask (ndarray):     selection mask
+        """
+        stages = self.compile(names)
+        state = self._initialize(nrow, stages, names)
+        for start, chunk in chunks:
+            self._evaluate_chunk(start, chunk, stages, state)
+        return self._finalize(state)
+
+    def _initialize(self, nrow, stages, names):
+        state = {"nrow": nrow}
+        for key in stages:
+            if len(stages[key]) > 0:
+                state[key] = np.ones(nrow, dtype=bool)
+        if self.force_90_pair:
+            state["pairs"] = {"paired": np.zeros(nrow, dtype=bool)}
+            for name in ["isim", "ipos"]:
+                if name in names:
+                    state["pairs"][name] = np.zeros(nrow, dtype=np.int64)
+        if self._use_psf_size:
+            state["psf_size"] = np.empty(nrow)
+        return state
+
+    def _evaluate_chunk(self, start, chunk, stages, state):
+        """Evaluates all the predicates on one chunk of rows in one pass"""
+        if not isinstance(chunk, CatalogView):
+            chunk = CatalogView(chunk)
+        stop = start + len(chunk)
+        for key, predicates in stages.items():
+            if len(predicates) == 0:
+                continue
+            out = state[key][start:stop]
+            for func in predicates:
+                np.logical_and(out, func(chunk), out=out)
+        if self.force_90_pair:
+            for name, column in state["pairs"].items():
+                column[start:stop] = chunk[name]
+        if self._use_psf_size:
+            state["psf_size"][start:stop] = get_psf_size(chunk)
+        return
+
+    def _finalize(self, state):
+        """Combines the per-row results into the selection mask"""
+        nrow = state["nrow"]
+        if self.force_90_pair:
+            pairs = state["pairs"]
+            ind_pair1, ind_pair2 = _get_pair_rows(pairs, names=tuple(pairs))
+
+        mask = state.get("sanity", np.ones(nrow, dtype=bool))
+        # The sanity checks are systematically applied to both members of the
+        # pair
+        if self.force_90_pair:
+            mask[ind_pair1] = mask[ind_pair1] & mask[ind_pair2]
+            mask[ind_pair2] = mask[ind_pair1]
+        if "basic" in state:
+            mask &= state["basic"]
+
+        # For PSF size (percentiles of the galaxies passing the cuts above)
+        if self._use_psf_size:
+            psf_size = state["psf_size"][mask]
+            sel = np.ones(len(psf_size), dtype=bool)
+            if self.lower_psf_size > 0.0:
+                cut_val = np.percentile(psf_size, self.lower_psf_size)
+                sel &= psf_size >= cut_val
+            if self.upper_psf_size < 100.0:
+                cut_val = np.percentile(psf_size, self.upper_psf_size)
+                sel &= psf_size < cut_val
+            mask[mask] = sel
+        if "fpfs" in state:
+            mask &= state["fpfs"]
+
+        # For noise cancellation, apply the cut only to the first element of
+        # the pair to avoid funny selection biases.
+        if self.force_90_pair:
+            mask[ind_pair2] = mask[ind_pair1]
+            if "both" in state:
+                if "resolution" in self.applyboth and self.min_res is not None:
                     print("Applying resolution cut to both objects in pair!")
-                    mask[mask] &= get_res(catalog[mask]) >= min_res
-            if "snr" in applyboth:
-                if min_snr is not None:
+                if "snr" in self.applyboth and self.min_snr is not None:
                     print("Applying SNR cut to both objects in pair!")
-                    snr = get_snr(catalog[mask])
-                    mask[mask] &= snr >= min_snr
-            if "mag" in applyboth:
-                if max_mag is not None:
+                if "mag" in self.applyboth and self.max_mag is not None:
                     print("Applying magnitude cut to both objects in pair!")
-                    mag = get_imag(catalog[mask]) - catalog["a_i"][mask]
-                    mask[mask] &= mag < max_mag
-    return mask
+                mask &= state["both"]
+        return mask
 
 
 def weighted_percentile(data, percents, weights=None):
@@ -518,6 +1094,203 @@ def sliding_window_def(snr, res, weights=None, n_gal=100, n_bin_1d=20, snr_overl
     return snr_lower, snr_upper, res_lower, res_upper
 
 
+def _sorted_percentile(data, percents, weights=None):
+    """Returns the percentiles of sorted data (same as `weighted_percentile`,
+    but without sorting)
+
+    Args:
+        data (ndarray):         sorted data
+        percents (ndarray):     percentiles in units of 1%
+        weights (ndarray):      weights of the sorted data [default: None]
+    """
+    if weights is None:
+        # np.percentile only depends on the sorted values
+        return np.percentile(data, percents)
+    p = 1.0 * weights.cumsum() / weights.sum() * 100
+    return np.interp(percents, p, data)
+
+
+class SlidingWindowEngine(object):
+    """Vectorized version of the sliding windows in (SNR, resolution) defined by
+    `sliding_window_def` (see `sliding_window_def` for the definition of the
+    arguments).
+
+    The data are sorted once by SNR and once by resolution. The SNR bins are
+    contiguous ranges in the SNR ordering, and the galaxies of each SNR bin
+    keep the resolution ordering, so that the resolution window edges are
+    derived from the cumulative weights, and the per-window weighted sums are
+    differences of prefix sums at the edges (located by `np.searchsorted`).
+    All the windows are measured in one pass over the data for each SNR bin.
+
+    Args:
+        snr (ndarray):          SNR of galaxies
+        res (ndarray):          resolution of galaxies
+        weights (ndarray):      weights of galaxies [default: None]
+        n_gal (int):            the minimum number of galaxies in a 2d bin
+        n_bin_1d (int):         number of bins in 1 dimension
+        snr_overlap (float):    overlap in snr binning
+    """
+
+    def __init__(self, snr, res, weights=None, n_gal=100, n_bin_1d=20, snr_overlap=1.4):
+        self.snr = np.asarray(snr)
+        self.res = np.asarray(res)
+        if weights is not None:
+            weights = np.asarray(weights)
+        self.weights = weights
+        self.n_gal = n_gal
+        self.n_bin_1d = n_bin_1d
+        self.snr_overlap = snr_overlap
+        # the only two sorts
+        self.snr_order = np.argsort(self.snr, kind="stable")
+        self.res_order = np.argsort(self.res, kind="stable")
+        self.snr_lower, self.snr_upper = self._snr_edges()
+        self._bins = []
+        self.res_lower = np.zeros((n_bin_1d, n_bin_1d))
+        self.res_upper = np.zeros((n_bin_1d, n_bin_1d))
+        for sbin in range(n_bin_1d):
+            self._bins.append(self._res_edges(sbin))
+        return
+
+    def _snr_edges(self):
+        """Returns the lower and upper edges of the overlapping SNR bins"""
+        n_bin_1d = self.n_bin_1d
+        lower_percentiles = np.linspace(0.0, 100.0, n_bin_1d + 1)[:-1]
+        delta_perc = lower_percentiles[1] - lower_percentiles[0]
+        lower_percentiles -= (0.5 * (self.snr_overlap - 1.0)) * delta_perc
+        lower_percentiles[0] = 0
+        upper_percentiles = np.linspace(0.0, 100.0, n_bin_1d + 1)[1:]
+        upper_percentiles += (0.5 * (self.snr_overlap - 1.0)) * delta_perc
+        upper_percentiles[-1] = 100.0
+        snr_sorted = self.snr[self.snr_order]
+        if self.weights is None:
+            wsorted = None
+        else:
+            wsorted = self.weights[self.snr_order]
+        snr_lower = _sorted_percentile(snr_sorted, lower_percentiles, wsorted)
+        snr_upper = _sorted_percentile(snr_sorted, upper_percentiles, wsorted)
+        return snr_lower, snr_upper
+
+    def _res_edges(self, sbin):
+        """Derives the resolution window edges of a SNR bin, and returns the
+        indices of the galaxies in the bin (in the resolution ordering) and the
+        index ranges of the windows
+        """
+        n_bin_1d = self.n_bin_1d
+        snr_res = self.snr[self.res_order]
+        sbin_mask = (snr_res >= self.snr_lower[sbin]) & (snr_res < self.snr_upper[sbin])
+        inds = self.res_order[sbin_mask]
+        ngal = len(inds)
+        if ngal < 1.1 * self.n_gal:
+            raise RuntimeError("Not enough objects to make " + "sliding window")
+        tmp_res = self.res[inds]
+        if self.weights is None:
+            tmp_wt = None
+        else:
+            tmp_wt = self.weights[inds]
+        # width of bin in percentiles
+        delta_perc = 100.0 * max(float(self.n_gal) / ngal, 1.0 / n_bin_1d)
+        bounds_percentiles = np.linspace(0.0, 100.0, n_bin_1d + 1)
+        cent_percentiles = (bounds_percentiles[:-1] + bounds_percentiles[1:]) / 2.0
+        lower_percentiles = cent_percentiles - delta_perc / 2.0
+        upper_percentiles = lower_percentiles + delta_perc
+        lower_percentiles[0] = 0.0
+        upper_percentiles[-1] = 100.0
+        self.res_lower[sbin, :] = _sorted_percentile(tmp_res, lower_percentiles, tmp_wt)
+        self.res_upper[sbin, :] = _sorted_percentile(tmp_res, upper_percentiles, tmp_wt)
+        # windows are [lower, upper) in resolution
+        i0 = np.searchsorted(tmp_res, self.res_lower[sbin, :], side="left")
+        i1 = np.searchsorted(tmp_res, self.res_upper[sbin, :], side="left")
+        return inds, i0, i1
+
+    @property
+    def edges(self):
+        """Window edges: (snr_lower, snr_upper, res_lower, res_upper), the same
+        as the outputs of `sliding_window_def`
+        """
+        return self.snr_lower, self.snr_upper, self.res_lower, self.res_upper
+
+    def window_mask(self, sbin, rbin):
+        """Returns the boolean mask of galaxies in a window"""
+        mask = np.zeros(len(self.snr), dtype=bool)
+        inds, i0, i1 = self._bins[sbin]
+        mask[inds[i0[rbin] : i1[rbin]]] = True
+        return mask
+
+    def window_sums(self, values, weights=None):
+        """Returns the (weighted) sums of quantities in every window
+
+        Args:
+            values (dict):      quantities of galaxies (ndarray), or the
+                                products of quantities to sum
+            weights (ndarray):  weights applied to all the quantities
+                                [default: None, no weights]
+        Returns:
+            out (dict):         sums in windows, each is an ndarray of shape
+                                (n_bin_1d, n_bin_1d); the number of galaxies
+                                is stored with key 'ngal' and the sum of
+                                weights with key 'w'
+        """
+        n_bin_1d = self.n_bin_1d
+        out = {kk: np.zeros((n_bin_1d, n_bin_1d)) for kk in values}
+        out["ngal"] = np.zeros((n_bin_1d, n_bin_1d), dtype=int)
+        if weights is not None:
+            out["w"] = np.zeros((n_bin_1d, n_bin_1d))
+        for sbin, (inds, i0, i1) in enumerate(self._bins):
+            out["ngal"][sbin] = i1 - i0
+            if weights is not None:
+                wbin = weights[inds]
+                out["w"][sbin] = self._prefix_diff(wbin, i0, i1)
+            else:
+                wbin = None
+            for key, val in values.items():
+                vbin = val[inds] if wbin is None else wbin * val[inds]
+                out[key][sbin] = self._prefix_diff(vbin, i0, i1)
+        return out
+
+    @staticmethod
+    def _prefix_diff(values, i0, i1):
+        """Returns the sums of values in index ranges [i0, i1) from the prefix
+        sums
+        """
+        prefix = np.zeros(len(values) + 1)
+        np.cumsum(values, out=prefix[1:])
+        return prefix[i1] - prefix[i0]
+
+    def estimate_shear(self, e1, e2, e_rms, weights, roundtrip_data=None):
+        """Estimates the shear in every window following
+        `estimate_subfield_shear`
+
+        Args:
+            e1 (ndarray):           the first component of ellipticity
+            e2 (ndarray):           the second component of ellipticity
+            e_rms (ndarray):        RMS of intrinsic ellipticity
+            weights (ndarray):      weights of galaxies
+            roundtrip_data (tuple): (m, c1, c2) of galaxies [default: None]
+        Returns:
+            g1 (ndarray):           the first component of shear
+            g2 (ndarray):           the second component of shear
+            responsivity (ndarray): shear responsivity
+        """
+        values = {"e1": e1, "e2": e2, "erms2": e_rms**2}
+        if roundtrip_data is not None:
+            values["m"], values["c1"], values["c2"] = roundtrip_data
+        sums = self.window_sums(values, weights)
+        sum_weight = sums["w"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            responsivity = 1.0 - sums["erms2"] / sum_weight
+            if roundtrip_data is None:
+                bias = 0.0
+                add_1 = 0.0
+                add_2 = 0.0
+            else:
+                bias = sums["m"] / sum_weight
+                add_1 = sums["c1"] / ((1.0 + bias) * sum_weight)
+                add_2 = sums["c2"] / ((1.0 + bias) * sum_weight)
+            g1 = sums["e1"] / (2.0 * responsivity * sum_weight * (1.0 + bias)) - add_1
+            g2 = sums["e2"] / (2.0 * responsivity * sum_weight * (1.0 + bias)) - add_2
+        return g1, g2, responsivity
+
+
 def estimate_subfield_shear(
     catalog,
     use_model=False,
@@ -570,13 +1343,23 @@ def estimate_subfield_shear(
         weights = get_weight_model(catalog)
         e_rms = get_erms_model(catalog)
         sigma_e = get_sigma_e_model(catalog)
+    if reweight or force_weight:
+        # copies, since the arrays may be columns of the catalog or read-only
+        # arrays cached by a CatalogView
+        weights = np.array(weights)
+        e_rms = np.array(e_rms)
+        sigma_e = np.array(sigma_e)
     if reweight:
         weights *= catalog["weight"]
     # Enforce equality of weights etc. for galaxies in a pair if shape noise cancellation is requested.
     if force_weight:
-        weights[1::2] = weights[0::2]
-        e_rms[1::2] = e_rms[0::2]
-        sigma_e[1::2] = sigma_e[0::2]
+        if _has_pair_keys(catalog.dtype.names):
+            ind1, ind2 = _get_pair_rows(catalog)
+        else:
+            ind1, ind2 = slice(0, None, 2), slice(1, None, 2)
+        weights[ind2] = weights[ind1]
+        e_rms[ind2] = e_rms[ind1]
+        sigma_e[ind2] = sigma_e[ind1]
 
     # Deal gracefully with the case of zero weights (generally due to reweight_option).
     if np.sum(weights) == 0:
@@ -624,6 +1407,131 @@ def estimate_subfield_shear(
         return g1, g2, responsivity
 
 
+def estimate_subfield_shear_grouped(
+    catalog,
+    key="isim",
+    use_model=False,
+    verbose=False,
+    report_resp=True,
+    reweight=True,
+    roundtrip_data=None,
+    force_weight=True,
+):
+    """Estimates the shear for every subfield in a catalog at once, following
+    `estimate_subfield_shear` (see it for the definition of the options). The
+    subfields are identified by the `key` column; galaxies are grouped with a
+    stable sort, so that the galaxies of a subfield keep their order (which
+    defines the pairs for `force_weight` if the catalog does not have the
+    (isim, ipos) keys), and the sums are computed with `np.bincount`. The input catalog is not modified.
+
+    Args:
+        catalog (ndarray):          catalog of all the subfields
+        key (str):                  column name of the subfield index
+        use_model (bool):           use get_X_model routines for weights, RMS
+                                    ellipticity, and sigma_e?
+        verbose (bool):             emit diagnostic statements?
+        report_resp (bool):         return the responsivity?
+        reweight (bool):            use the S16A reweighting?
+        roundtrip_data (tuple):     (m, c1, c2) with the same length as
+                                    `catalog` [default: None]
+        force_weight (bool):        equalize the weights etc. in pairs of each
+                                    subfield
+    Returns:
+        keys (ndarray):             subfield indices (sorted)
+        g1 (ndarray):               the first component of shear
+        g2 (ndarray):               the second component of shear
+        responsivity (ndarray):     shear responsivity [if report_resp]
+    """
+    if verbose:
+        print("Using %d objects in input catalog" % (len(catalog)))
+    order = np.argsort(catalog[key], kind="stable")
+    keys, starts, counts = np.unique(
+        catalog[key][order], return_index=True, return_counts=True
+    )
+    ngroup = len(keys)
+    seg = np.repeat(np.arange(ngroup), counts)
+
+    if not use_model:
+        weights = catalog["i_hsmshaperegauss_derived_weight"]
+        e_rms = catalog["i_hsmshaperegauss_derived_rms_e"]
+    else:
+        weights = get_weight_model(catalog)
+        e_rms = get_erms_model(catalog)
+    # fancy indexing returns copies
+    weights = np.asarray(weights, dtype=float)[order]
+    e_rms = np.asarray(e_rms, dtype=float)[order]
+    if reweight:
+        weights *= catalog["weight"][order]
+    # Enforce equality of weights etc. for galaxies in a pair of each subfield
+    if force_weight:
+        if _has_pair_keys(catalog.dtype.names):
+            ind1, ind2 = _get_pair_rows(catalog)
+            # positions of the rows after grouping
+            inverse = np.empty(len(order), dtype=np.int64)
+            inverse[order] = np.arange(len(order))
+            ind1 = inverse[ind1]
+            ind2 = inverse[ind2]
+        else:
+            if np.any(counts % 2 != 0):
+                raise ValueError(
+                    "subfields %s have odd number of galaxies" % keys[counts % 2 != 0]
+                )
+            pos = np.arange(len(order)) - np.repeat(starts, counts)
+            ind2 = np.where(pos % 2 == 1)[0]
+            ind1 = ind2 - 1
+        weights[ind2] = weights[ind1]
+        e_rms[ind2] = e_rms[ind1]
+
+    e1, e2 = get_gal_ellip(catalog)
+    e1 = np.asarray(e1)[order]
+    e2 = np.asarray(e2)[order]
+
+    def _sum(values):
+        return np.bincount(seg, weights=values, minlength=ngroup)
+
+    sum_weight = _sum(weights)
+    shear_num_1 = _sum(weights * e1)
+    shear_num_2 = _sum(weights * e2)
+    resp_num = _sum(weights * e_rms**2)
+    if roundtrip_data is None:
+        bias_num = np.zeros(ngroup)
+        add_num_1 = np.zeros(ngroup)
+        add_num_2 = np.zeros(ngroup)
+    else:
+        model_m, model_c1, model_c2 = roundtrip_data
+        bias_num = _sum(weights * np.asarray(model_m)[order])
+        add_num_1 = _sum(weights * np.asarray(model_c1)[order])
+        add_num_2 = _sum(weights * np.asarray(model_c2)[order])
+
+    # Deal gracefully with the case of zero weights
+    good = sum_weight != 0
+    g1 = np.zeros(ngroup)
+    g2 = np.zeros(ngroup)
+    responsivity = np.zeros(ngroup)
+    sum_weight = sum_weight[good]
+    bias = bias_num[good] / sum_weight
+    responsivity[good] = 1.0 - resp_num[good] / sum_weight
+    bad = good & ((responsivity > 2.0) | (responsivity < 0.0))
+    if np.any(bad):
+        ib = np.where(bad)[0][0]
+        raise RuntimeError(
+            "Error: responsivity is %f in subfield %s" % (responsivity[ib], keys[ib])
+        )
+    if verbose:
+        print("Mean shear responsivity: %f" % np.mean(responsivity[good]))
+    resp = responsivity[good]
+    g1[good] = shear_num_1[good] / (2.0 * resp * sum_weight * (1.0 + bias)) - add_num_1[
+        good
+    ] / ((1.0 + bias) * sum_weight)
+    g2[good] = shear_num_2[good] / (2.0 * resp * sum_weight * (1.0 + bias)) - add_num_2[
+        good
+    ] / ((1.0 + bias) * sum_weight)
+    if not report_resp:
+        return keys, g1, g2
+    else:
+        return keys, g1, g2, responsivity
+
+
 def fitline(xarr, yarr):
     """
     Fit a line y = a + b * x to input x and y arrays by least squares.
@@ -674,6 +1582,48 @@ def systematics_func(x, m, a):
     return m * x[0, :] + a * x[1, :]
 
 
+def _ma_terms(x1, x2, y, sigma):
+    """Returns the per-point terms of the normal equations of the weighted
+    least-squares fit y = m * x1 + a * x2, i.e. the columns (w*x1*x1, w*x1*x2,
+    w*x2*x2, w*x1*y, w*x2*y) with w = 1 / sigma**2
+    """
+    w = 1.0 / sigma**2.0
+    return np.stack([w * x1 * x1, w * x1 * x2, w * x2 * x2, w * x1 * y, w * x2 * y], -1)
+
+
+def _solve_ma(sums):
+    """Solves the (stacked) 2x2 normal equations from the sums of the terms
+    returned by `_ma_terms` along the last axis
+
+    Returns:
+        m (ndarray):    multiplicative bias
+        a (ndarray):    coefficient of the PSF leakage
+        det (ndarray):  determinant of the normal matrix
+    """
+    sxx, sxy, syy, sxz, syz = np.moveaxis(sums, -1, 0)
+    det = sxx * syy - sxy * sxy
+    m = (syy * sxz - sxy * syz) / det
+    a = (sxx * syz - sxy * sxz) / det
+    return m, a, det
+
+
+def _fit_ma(x1, x2, y, sigma):
+    """Closed-form weighted least-squares fit of y = m * x1 + a * x2, with the
+    covariance scaled by the reduced chi2 (same as `scipy.optimize.curve_fit`
+    with `absolute_sigma=False`)
+
+    Returns:
+        out (tuple):    (m, a, sigma_m, sigma_a)
+    """
+    sums = np.sum(_ma_terms(x1, x2, y, sigma), axis=0)
+    m, a, det = _solve_ma(sums)
+    chi2 = np.sum(((y - m * x1 - a * x2) / sigma) ** 2.0)
+    s2 = chi2 / (len(y) - 2)
+    var_m = s2 * sums[2] / det
+    var_a = s2 * sums[0] / det
+    return m, a, np.sqrt(var_m), np.sqrt(var_a)
+
+
 def get_ma_sim(
     g1, g2, g1_true, g2_true, psf_e1, psf_e2, sigma_vals, separate_components=True
 ):
@@ -697,45 +1647,178 @@ def get_ma_sim(
 
     # Our default algorithm is going to be to fit for
     # g-g_true = m g_true + a e_PSF
-    # for each component, using scipy.optimize.curve_fit.
-    # This can eventually accomodate weights as needed.
+    # for each component, using closed-form weighted least squares (the
+    # solution of scipy.optimize.curve_fit for this linear model).
     if separate_components:
-        popt1, pcov1 = scipy.optimize.curve_fit(
-            systematics_func,
-            np.vstack((g1_true, psf_e1)),
-            g1 - g1_true,
-            sigma=sigma_vals,
-        )
-        popt2, pcov2 = scipy.optimize.curve_fit(
-            systematics_func,
-            np.vstack((g2_true, psf_e2)),
-            g2 - g2_true,
-            sigma=sigma_vals,
-        )
         # Return everything: (m, a, sigma_m, sigma_a) first for component 1 then for
         # component 2.
-        return (
-            popt1[0],
-            popt1[1],
-            np.sqrt(pcov1[0][0]),
-            np.sqrt(pcov1[1][1]),
-            popt2[0],
-            popt2[1],
-            np.sqrt(pcov2[0][0]),
-            np.sqrt(pcov2[1][1]),
+        return _fit_ma(g1_true, psf_e1, g1 - g1_true, sigma_vals) + _fit_ma(
+            g2_true, psf_e2, g2 - g2_true, sigma_vals
         )
     else:
         g = np.concatenate([g1, g2])
         g_true = np.concatenate([g1_true, g2_true])
         psf_e = np.concatenate([psf_e1, psf_e2])
         sigma_vals = np.concatenate([sigma_vals, sigma_vals])
-        popt, pcov = scipy.optimize.curve_fit(
-            systematics_func, np.vstack((g_true, psf_e)), g - g_true, sigma=sigma_vals
-        )
         # Return everything: (m, a, sigma_m, sigma_a).
-        return popt[0], popt[1], np.sqrt(pcov[0][0]), np.sqrt(pcov[1][1])
+        return _fit_ma(g_true, psf_e, g - g_true, sigma_vals)
+
+
+def _bootstrap_ma_sums(terms, n_draw, seed):
+    """Draws bootstrap resamples as an index matrix and returns the sums of the
+    normal-equation terms for every resample
+
+    Args:
+        terms (ndarray):        normal-equation terms, shape (n, ncol)
+        n_draw (int):           number of resamples
+        seed (SeedSequence):    seed of the resamples
+    Returns:
+        sums (ndarray):         sums, shape (n_draw, ncol)
+    """
+    n = len(terms)
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, n, size=(n_draw, n))
+    offsets = (np.arange(n_draw) * n)[:, None]
+    counts = np.bincount((index + offsets).ravel(), minlength=n_draw * n)
+    return counts.reshape(n_draw, n) @ terms
+
+
+def get_ma_sim_resample(
+    g1,
+    g2,
+    g1_true,
+    g2_true,
+    psf_e1,
+    psf_e2,
+    sigma_vals,
+    separate_components=True,
+    method="bootstrap",
+    n_resample=1000,
+    n_jack=None,
+    seed=None,
+    n_proc=1,
+    chunk_size=100,
+    return_samples=False,
+):
+    """Same fit as `get_ma_sim`, but the uncertainties of (m, a) are estimated
+    by resampling the input points (e.g. subfields). All the resamples are
+    solved at once with stacked normal equations: bootstrap resamples are
+    drawn as an index matrix and converted to counts; jackknife resamples are
+    the total sums minus the sums of the deleted groups.
+
+    Args:
+        g1, g2 (ndarray):           estimated shear
+        g1_true, g2_true (ndarray): true shear
+        psf_e1, psf_e2 (ndarray):   PSF ellipticity
+        sigma_vals (ndarray):       uncertainties of the estimated shear
+        separate_components (bool): fit the two components separately?
+        method (str):               'bootstrap' or 'jackknife'
+        n_resample (int):           number of bootstrap resamples
+        n_jack (int):               number of jackknife groups (contiguous
+                                    blocks of points) [default: None,
+                                    delete-one jackknife]
+        seed (int):                 seed of the bootstrap resamples
+        n_proc (int):               number of processes for bootstrap
+        chunk_size (int):           number of bootstrap resamples per task
+        return_samples (bool):      also return the resampled (m, a)?
+    Returns:
+        out (tuple):                same as `get_ma_sim`, with the resampling
+                                    uncertainties; followed by the resampled
+                                    (m, a), shape (n_resample, 2 or 4), if
+                                    `return_samples`
+    """
+    g1 = np.array(g1)
+    g2 = np.array(g2)
+    g1_true = np.array(g1_true)
+    g2_true = np.array(g2_true)
+    psf_e1 = np.array(psf_e1)
+    psf_e2 = np.array(psf_e2)
+    sigma_vals = np.array(sigma_vals)
+    terms1 = _ma_terms(g1_true, psf_e1, g1 - g1_true, sigma_vals)
+    terms2 = _ma_terms(g2_true, psf_e2, g2 - g2_true, sigma_vals)
+    if separate_components:
+        terms = np.hstack([terms1, terms2])
+    else:
+        # both components of a point are resampled together
+        terms = terms1 + terms2
+    n = len(terms)
+
+    if method == "bootstrap":
+        # The resamples are split into fixed tasks with independent seeds, so
+        # that the results do not depend on the number of processes
+        ntask = (n_resample + chunk_size - 1) // chunk_size
+        seeds = np.random.SeedSequence(seed).spawn(ntask)
+        ndraws = [min(chunk_size, n_resample - i * chunk_size) for i in range(ntask)]
+        if n_proc is not None and n_proc <= 1:
+            sums = [_bootstrap_ma_sums(terms, nd, ss) for nd, ss in zip(ndraws, seeds)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_proc) as pool:
+                sums = list(
+                    pool.map(_bootstrap_ma_sums, [terms] * ntask, ndraws, seeds)
+                )
+        sums = np.vstack(sums)
+    elif method == "jackknife":
+        if n_jack is None:
+            n_jack = n
+        group = np.arange(n) * n_jack // n
+        gsums = np.stack(
+            [np.bincount(group, weights=tt, minlength=n_jack) for tt in terms.T], -1
+        )
+        sums = np.sum(terms, axis=0) - gsums
+    else:
+        raise ValueError("method should be 'bootstrap' or 'jackknife'")
+
+    nfit = 2 if separate_components else 1
+    samples = []
+    for ic in range(nfit):
+        m, a, _ = _solve_ma(sums[:, 5 * ic : 5 * (ic + 1)])
+        samples.extend([m, a])
+    samples = np.stack(samples, -1)
+    if method == "bootstrap":
+        std = np.std(samples, axis=0, ddof=1)
+    else:
+        nj = len(samples)
+        std = np.sqrt(
+            (nj - 1.0) / nj * np.sum((samples - samples.mean(axis=0)) ** 2.0, axis=0)
+        )
+
+    best = get_ma_sim(
+        g1,
+        g2,
+        g1_true,
+        g2_true,
+        psf_e1,
+        psf_e2,
+        sigma_vals,
+        separate_components=separate_components,
+    )
+    out = ()
+    for ic in range(nfit):
+        out = out + (best[4 * ic], best[4 * ic + 1], std[2 * ic], std[2 * ic + 1])
+    if return_samples:
+        out = out + (samples,)
+    return out
 
 
+@uses_columns(
+    (
+        "i_hsmshaperegauss_derived_weight",
+        "i_hsmshaperegauss_derived_rms_e",
+        "i_hsmshaperegauss_e1",
+        "i_hsmshaperegauss_e2",
+        "i_hsmshaperegauss_derived_shear_bias_c1",
+        "i_hsmshaperegauss_derived_shear_bias_c2",
+    ),
+    (
+        "ishape_hsm_regauss_derived_shape_weight",
+        "ishape_hsm_regauss_derived_rms_e",
+        "ishape_hsm_regauss_e1",
+        "ishape_hsm_regauss_e2",
+        "ishape_hsm_regauss_derived_shear_bias_c1",
+        "ishape_hsm_regauss_derived_shear_bias_c2",
+    ),
+    requires=("get_psf_ellip",),
+)
 def get_shear_regauss(catalog, mbias, msel=0.0, asel=0.0):
     """Returns the regauss shear in data *on single galaxy level*.
     Note: shape weight should be added when caluculating ensemble average.
@@ -777,6 +1860,21 @@ def get_shear_regauss(catalog, mbias, msel=0.0, asel=0.0):
     return g1, g2
 
 
+@uses_columns(
+    branches={
+        "all": (("e1_mock", "e2_mock", "weight", "noise1_int", "noise2_int"),),
+        "shape": (
+            (
+                "noise1_int",
+                "noise2_int",
+                "noise1_mea",
+                "noise2_mea",
+                "weight",
+            ),
+        ),
+        "shear": (("shear1_sim", "shear2_sim", "kappa"),),
+    }
+)
 def get_shear_regauss_mock(datIn, mbias, msel=0.0, version="all"):
     """Returns the regauss shear in mocks *on single galaxy level*.
     Note: shape weight should be added when caluculating ensemble average.
@@ -822,6 +1920,19 @@ def get_shear_regauss_mock(datIn, mbias, msel=0.0, version="all"):
     return g1, g2
 
 
+@uses_columns(
+    (
+        "shear1_sim",
+        "shear2_sim",
+        "kappa",
+        "noise1_int",
+        "noise2_int",
+        "noise1_mea",
+        "noise2_mea",
+        "e1_mock",
+        "e2_mock",
+    )
+)
 def make_mock_catalog(data_mock, mbias=0.0, msel=0.0, corr=1.0):
     """Rescales the shear by (1 + mbias) following section 5.6 and calculate
     the mock ellipticities according to eq. (24) and (25) of
@@ -890,6 +2001,183 @@ def make_mock_catalog(data_mock, mbias=0.0, msel=0.0, corr=1.0):
     out["e2_mock"] = e2_mock / (1.0 + de) + out["noise2_mea"]
     return out
 
+
+class MockWorkspace(object):
+    """Scratch buffers reused by `make_mock_catalog_inplace` across calls, so
+    that processing many mock catalogs does not allocate new temporaries; the
+    buffers grow when a larger catalog comes in.
+    """
+
+    """nbuf (int): number of buffers used by `make_mock_catalog_inplace`"""
+    nbuf = 8
+
+    def __init__(self):
+        self._buffers = {}
+        return
+
+    def get(self, n, dtype):
+        """Returns a list of `nbuf` contiguous arrays with length n
+
+        Args:
+            n (int):            length of the arrays
+            dtype (dtype):      data type of the arrays
+        Returns:
+            buffers (list):     scratch arrays (views of the workspace)
+        """
+        dtype = np.dtype(dtype)
+        buf = self._buffers.get(dtype)
+        if buf is None or buf.shape[1] < n:
+            buf = np.empty((self.nbuf, n), dtype=dtype)
+            self._buffers[dtype] = buf
+        return [buf[i, :n] for i in range(self.nbuf)]
+
+    def clear(self):
+        """Releases the buffers"""
+        self._buffers.clear()
+        return
+
+
+@uses_columns(
+    (
+        "shear1_sim",
+        "shear2_sim",
+        "kappa",
+        "noise1_int",
+        "noise2_int",
+        "noise1_mea",
+        "noise2_mea",
+        "e1_mock",
+        "e2_mock",
+    )
+)
+def make_mock_catalog_inplace(
+    data_mock,
+    mbias=0.0,
+    msel=0.0,
+    corr=1.0,
+    e1_out=None,
+    e2_out=None,
+    workspace=None,
+    dtype=None,
+):
+    """Same as `make_mock_catalog`, but without copying the catalog: the mock
+    ellipticities are written into the 'e1_mock' and 'e2_mock' columns of the
+    input catalog (or into the preallocated `e1_out` and `e2_out` arrays), and
+    all the intermediate quantities are computed in the scratch buffers of a
+    `MockWorkspace`, which can be reused across calls.
+
+    Args:
+        data_mock (ndaray):     Original HSC S19A mock catalog (it should haave
+                                m=0)
+        mbias (float):          The multiplicative bias
+        msel (float):           Selection bias [default=0.]
+        corr (float):           Correction term for shell thickness, finite
+                                resolution and missmatch between n(z_data) and
+                                n(z_mock)
+        e1_out (ndarray):       output array of the first component [default:
+                                None, data_mock['e1_mock']]
+        e2_out (ndarray):       output array of the second component [default:
+                                None, data_mock['e2_mock']]
+        workspace (MockWorkspace):
+                                scratch buffers [default: None, a new one]
+        dtype (dtype):          data type of the computation, e.g. np.float32
+                                [default: None, the type of the input columns]
+
+    Returns:
+    out (ndarray):  data_mock (with m=mbias) if e1_out and e2_out are not
+                    given, otherwise (e1_out, e2_out)
+    """
+    if not isinstance(mbias, (float, int)):
+        raise TypeError("multiplicative shear estimation bias should be a float.")
+    if not isinstance(msel, (float, int)):
+        raise TypeError("multiplicative selection bias should be a float.")
+    if not isinstance(corr, (float, int)):
+        raise TypeError("multiplicative selection bias should be a float.")
+    if (e1_out is None) != (e2_out is None):
+        raise ValueError("e1_out and e2_out should be given together")
+
+    bratio = (1 + mbias) * (1 + msel) * corr
+    if dtype is None:
+        # same promotion as the array operations in `make_mock_catalog`
+        names = ["shear1_sim", "shear2_sim", "kappa", "noise1_int", "noise2_int"]
+        dtype = np.result_type(*[data_mock[nn] for nn in names], bratio)
+    # computation in native byte order
+    dtype = np.dtype(dtype).newbyteorder("=")
+    if workspace is None:
+        workspace = MockWorkspace()
+    n = len(data_mock)
+    b0, b1, b2, b3, b4, b5, b6, b7 = workspace.get(n, dtype)
+
+    shear1 = data_mock["shear1_sim"]
+    shear2 = data_mock["shear2_sim"]
+    noise1 = data_mock["noise1_int"]
+    noise2 = data_mock["noise2_int"]
+    # b0: 1 - kappa
+    np.subtract(1, data_mock["kappa"], out=b0)
+    # b1: (1 - kappa)^2 + gamma^2 (gamma rescaled by (1+m))
+    np.multiply(shear1, shear1, out=b1)
+    np.multiply(shear2, shear2, out=b6)
+    b1 += b6
+    b1 *= bratio**2.0
+    np.multiply(b0, b0, out=b6)
+    b1 += b6
+    # b2, b3: the distortion delta
+    np.multiply(2.0, b0, out=b2)
+    b2 *= shear1
+    b2 *= bratio
+    b2 /= b1
+    np.multiply(2.0, b0, out=b3)
+    b3 *= shear2
+    b3 *= bratio
+    b3 /= b1
+    # b5: 1 + de (for denominators)
+    np.multiply(b2, noise1, out=b5)
+    np.multiply(b3, noise2, out=b6)
+    b5 += b6
+    b5 += 1.0
+    # b4: dd
+    np.multiply(b2, b2, out=b4)
+    np.multiply(b3, b3, out=b6)
+    b4 += b6
+    # b7: 1 - (1 - dd)^0.5
+    np.subtract(1.0, b4, out=b7)
+    np.sqrt(b7, out=b7)
+    np.subtract(1.0, b7, out=b7)
+    # b1: dis1 * noise2 - dis2 * noise1 (no longer need the denominator)
+    np.multiply(b2, noise2, out=b1)
+    np.multiply(b3, noise1, out=b6)
+    b1 -= b6
+    # b0: tmp2 * (1 - (1 - dd)^0.5), avoiding dividing by zero (this term is 0
+    # under the limit dd->0)
+    b0[:] = 0.0
+    np.divide(b3, b4, out=b0, where=b4 != 0)
+    b0 *= b7
+    # b0: the nominator for e1
+    b0 *= b1
+    np.add(noise1, b2, out=b6)
+    b0 += b6
+    b0 /= b5
+    b0 += data_mock["noise1_mea"]
+    # b7: the nominator for e2 (the cross term of e2 is -b1)
+    np.negative(b1, out=b1)
+    b6[:] = 0.0
+    np.divide(b2, b4, out=b6, where=b4 != 0)
+    b7 *= b6
+    b7 *= b1
+    np.add(noise2, b3, out=b6)
+    b7 += b6
+    b7 /= b5
+    b7 += data_mock["noise2_mea"]
+    # update e1_mock and e2_mock
+    if e1_out is None and e2_out is None:
+        data_mock["e1_mock"] = b0
+        data_mock["e2_mock"] = b7
+        return data_mock
+    e1_out[:] = b0
+    e2_out[:] = b7
+    return e1_out, e2_out
+
+
 def generate_mock_shape_from_sim(
         gamma1_sim,
         gamma2_sim,
@@ -1019,10 +2307,98 @@ def simulate_shape_noise(
     return shape1_int, shape2_int, shape1_meas, shape2_meas
 
 
+def _shape_noise_rng(entropy, k):
+    """Returns the random generator of the k-th shape-noise realization"""
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(k,)))
+
+
+def simulate_shape_noise_batch(e1, e2, e_rms, sigma_e, nreal, seed=None, start=0):
+    """Simulates a batch of shape-noise realizations (see
+    `simulate_shape_noise`) for a galaxy sample. Realization k uses its own
+    random stream, `SeedSequence(seed, spawn_key=(k,))` (the k-th child of
+    `SeedSequence(seed).spawn`), so it is reproducible no matter which worker
+    (or which batch) produces it, and the global `np.random` state is not
+    touched.
+
+    Args:
+        e1, e2 (ndarray):   reGauss ellipticity
+        e_rms (ndarray):    intrinsic shape dispersion calibrated with simulation
+        sigma_e (ndarray):  measurement error calibrated with image simulation
+        nreal (int):        number of realizations
+        seed (int):         random seed [default: None, fresh entropy]
+        start (int):        index of the first realization
+
+    Returns:
+        shape1_int (ndarray):   first component of intrinsic shape noise
+        shape2_int (ndarray):   second component of intrinsic shape noise
+        shape1_meas (ndarray):  first component of measurement error
+        shape2_meas (ndarray):  second component of measurement error
+                                [all with shape (nreal, ngal)]
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    e1 = np.asarray(e1)
+    e2 = np.asarray(e2)
+    sigma_e = np.asarray(sigma_e)
+    ngal = len(e1)
+    f = np.sqrt(e_rms * e_rms / (e_rms * e_rms + sigma_e * sigma_e))
+    shape1_int = np.empty((nreal, ngal))
+    shape2_int = np.empty((nreal, ngal))
+    shape1_meas = np.empty((nreal, ngal))
+    shape2_meas = np.empty((nreal, ngal))
+    for i in range(nreal):
+        rng = _shape_noise_rng(seed, start + i)
+        # Rotation angle
+        phi = 2.0 * np.pi * rng.random(ngal)
+        cs = np.cos(phi)
+        ss = np.sin(phi)
+        # Rotate the ellipticity and get the intrinsic shape
+        shape1_int[i] = (e1 * cs + e2 * ss) * f
+        shape2_int[i] = (-1.0 * e1 * ss + e2 * cs) * f
+        # measurement error from image noise
+        rng.standard_normal(ngal, out=shape1_meas[i])
+        rng.standard_normal(ngal, out=shape2_meas[i])
+    shape1_meas *= sigma_e
+    shape2_meas *= sigma_e
+    return shape1_int, shape2_int, shape1_meas, shape2_meas
+
+
+def iter_shape_noise(e1, e2, e_rms, sigma_e, nreal, seed, block_size=100, start=0):
+    """Streams shape-noise realizations in blocks to bound memory; the
+    realizations are the same as those of `simulate_shape_noise_batch` with
+    the same seed.
+
+    Args:
+        e1, e2 (ndarray):   reGauss ellipticity
+        e_rms (ndarray):    intrinsic shape dispersion calibrated with simulation
+        sigma_e (ndarray):  measurement error calibrated with image simulation
+        nreal (int):        number of realizations
+        seed (int):         random seed
+        block_size (int):   number of realizations in a block
+        start (int):        index of the first realization
+
+    Yields:
+        k0 (int):           index of the first realization of the block
+        noise (tuple):      (shape1_int, shape2_int, shape1_meas, shape2_meas)
+                            of the block, each with shape (nblock, ngal)
+    """
+    if seed is None:
+        raise ValueError("seed is required to stream reproducible realizations")
+    for k0 in range(start, start + nreal, block_size):
+        nblock = min(block_size, start + nreal - k0)
+        yield k0, simulate_shape_noise_batch(
+            e1, e2, e_rms, sigma_e, nblock, seed=seed, start=k0
+        )
+
+
+@_cached_on_view
+@uses_columns(("tract", "patch"))
 def get_TPid(catalog):
     return catalog["tract"] * 1000 + catalog["patch"]
 
 
+@_cached_on_view
+@uses_columns(("parent_id",), ("parent",))
 def get_isIso(catalog):
     """Returns the flag showing whether the galaxy is isolated"""
     if "parent_id" in catalog.dtype.names:
@@ -1034,6 +2410,8 @@ def get_isIso(catalog):
     return isIso
 
 
+@_cached_on_view
+@uses_columns(("cmodel_obj",), ("i_cmodel_objective",))
 def get_cmodel_obj(catalog):
     """Returns the cmodel objective"""
     if "cmodel_obj" in catalog.dtype.names:
@@ -1045,6 +2423,8 @@ def get_cmodel_obj(catalog):
     return obj
 
 
+@_cached_on_view
+@uses_columns(("brimsk18",), ("i_mask_s18a_bright_objectcenter",))
 def get_briObj_cuts_s18(catalog):
     """Returns the bright object cut (for S18A)"""
     if "brimsk18" in catalog.dtype.names:
@@ -1057,6 +2437,8 @@ def get_briObj_cuts_s18(catalog):
     return bmsk
 
 
+@_cached_on_view
+@uses_columns(("brimsk19I",), ("i_mask_brightstar_any",))
 def get_briObj_cuts_v1(catalog):
     """The bright object cut (more conservative)"""
     if "brimsk19I" in catalog.dtype.names:
@@ -1069,6 +2451,11 @@ def get_briObj_cuts_v1(catalog):
     return bmsk
 
 
+@_cached_on_view
+@uses_columns(
+    ("brimsk19II",),
+    ("i_mask_brightstar_halo", "i_mask_brightstar_ghost", "i_mask_brightstar_blooming"),
+)
 def get_mask_briObj_cuts_v2(catalog):
     """The bright object cut applied"""
     if "brimsk19II" in catalog.dtype.names:
@@ -1085,6 +2472,21 @@ def get_mask_briObj_cuts_v2(catalog):
     return bmsk
 
 
+@uses_columns(
+    (
+        "i_deblend_skipped",
+        "i_cmodel_flag_badcentroid",
+        "i_sdsscentroid_flag",
+        "i_detect_isprimary",
+        "i_pixelflags_edge",
+        "i_pixelflags_interpolatedcenter",
+        "i_pixelflags_saturatedcenter",
+        "i_pixelflags_crcenter",
+        "i_pixelflags_bad",
+        "i_pixelflags_suspectcenter",
+        "i_pixelflags_clipped",
+    )
+)
 def get_pixel_cuts(catalog):
     """Returns pixel cuts"""
     mask = (
@@ -1105,6 +2507,8 @@ def get_pixel_cuts(catalog):
     return mask
 
 
+@_cached_on_view
+@uses_columns(("fps_momentsG",), ("fpfs_momentsG",), ("fpfs_moments",))
 def get_FPFS1_obs(data, Delta=2077.966, cRatio=4.0):
     if "fps_momentsG" in data.dtype.names:
         moments = data["fps_momentsG"]
@@ -1136,6 +2540,14 @@ def get_FPFS1_obs(data, Delta=2077.966, cRatio=4.0):
     return num1, num2, denom1, denom2, flux
 
 
+@_cached_on_view
+@uses_columns(
+    ("snr",),
+    ("i_cmodel_fluxsigma", "i_cmodel_flux"),
+    ("iflux_cmodel", "iflux_cmodel_err"),
+    ("i_cmodel_fluxerr", "i_cmodel_flux"),
+    ("modelfit_CModel_instFlux", "modelfit_CModel_instFluxErr"),
+)
 def get_snr(catalog):
     """This utility computes the S/N for each object in the catalog, based on
     cmodel_flux. It does not impose any cuts and returns NaNs for invalid S/N
@@ -1158,6 +2570,33 @@ def get_snr(catalog):
     return snr
 
 
+@_cached_on_view
+@uses_columns(
+    (
+        "i_apertureflux_10_fluxsigma",
+        "i_apertureflux_10_flux",
+        "i_apertureflux_15_fluxsigma",
+        "i_apertureflux_15_flux",
+        "i_apertureflux_20_fluxsigma",
+        "i_apertureflux_20_flux",
+    ),
+    (
+        "i_apertureflux_10_fluxerr",
+        "i_apertureflux_10_flux",
+        "i_apertureflux_15_fluxerr",
+        "i_apertureflux_15_flux",
+        "i_apertureflux_20_fluxerr",
+        "i_apertureflux_20_flux",
+    ),
+    (
+        "base_CircularApertureFlux_3_0_instFlux",
+        "base_CircularApertureFlux_3_0_instFluxErr",
+        "base_CircularApertureFlux_4_5_instFlux",
+        "base_CircularApertureFlux_4_5_instFluxErr",
+        "base_CircularApertureFlux_6_0_instFlux",
+        "base_CircularApertureFlux_6_0_instFluxErr",
+    ),
+)
 def get_snr_apertures(catalog):
     """This utility computes the S/N for each object in the catalog, based on
     aperture_fluxes. It does not impose any cuts and returns NaNs for invalid
@@ -1197,6 +2636,12 @@ def get_snr_apertures(catalog):
     return snr10, snr15, snr20
 
 
+@_cached_on_view
+@uses_columns(
+    ("i_localbackground_fluxsigma", "i_localbackground_flux"),
+    ("i_localbackground_fluxerr", "i_localbackground_flux"),
+    ("base_LocalBackground_instFlux", "base_LocalBackground_instFluxErr"),
+)
 def get_snr_localBG(catalog):
     """This utility computes the S/N for each object in the catalog,
     based on local background flux. It does not impose any cuts
@@ -1220,6 +2665,14 @@ def get_snr_localBG(catalog):
     return snrloc
 
 
+@_cached_on_view
+@uses_columns(
+    branches={
+        "mizuki": (("mizuki_photoz_best",), ("mizuki_Z",)),
+        "dnn": (("dnnz_photoz_best",), ("dnn_Z",)),
+        "demp": (("dempz_photoz_best",), ("demp_Z",)),
+    }
+)
 def get_photo_z(catalog, method_name):
     """Returns the best photon-z estimation
 
@@ -1255,6 +2708,10 @@ def get_photo_z(catalog, method_name):
     return z
 
 
+@_cached_on_view
+@uses_columns(
+    ("magA10",), ("i_apertureflux_10_mag",), ("base_CircularApertureFlux_3_0_instFlux",)
+)
 def get_imag_A10(catalog):
     """This utility returns the i-band magnitude of the objects in the input
     data or simulation catalog. Does not apply any cuts and returns NaNs for
@@ -1273,6 +2730,10 @@ def get_imag_A10(catalog):
     return magnitude
 
 
+@_cached_on_view
+@uses_columns(
+    ("magA15",), ("i_apertureflux_15_mag",), ("base_CircularApertureFlux_4_5_instFlux",)
+)
 def get_imag_A15(catalog):
     """This utility returns the i-band magnitude of the objects in the input
     data or simulation catalog. Does not apply any cuts and returns NaNs for
@@ -1291,6 +2752,10 @@ def get_imag_A15(catalog):
     return magnitude
 
 
+@_cached_on_view
+@uses_columns(
+    ("magA20",), ("i_apertureflux_20_mag",), ("base_CircularApertureFlux_6_0_instFlux",)
+)
 def get_imag_A20(catalog):
     """This utility returns the i-band magnitude of the objects in the input
     data or simulation catalog. Does not apply any cuts and returns NaNs for
@@ -1309,6 +2774,8 @@ def get_imag_A20(catalog):
     return magnitude
 
 
+@_cached_on_view
+@uses_columns(("i_localbackground_mag",), ("base_LocalBackground_instFlux",))
 def get_imag_lb(catalog):
     """This utility returns the i-band magnitude of the objects in the input
     data or simulation catalog. Does not apply any cuts and returns NaNs for
@@ -1323,6 +2790,11 @@ def get_imag_lb(catalog):
     return magnitude
 
 
+@_cached_on_view
+@uses_columns(
+    ("i_localbackground_flux", "i_apertureflux_10_flux"),
+    ("base_LocalBackground_instFlux", "base_CircularApertureFlux_3_0_instFlux"),
+)
 def get_bs_factor(catalog):
     ratio = np.pi * 9
     if "i_localbackground_flux" in catalog.dtype.names:  # s18
@@ -1344,6 +2816,10 @@ def get_bs_factor(catalog):
     return sb
 
 
+@_cached_on_view
+@uses_columns(
+    ("mag",), ("i_cmodel_mag",), ("imag_cmodel",), ("modelfit_CModel_instFlux",)
+)
 def get_imag(catalog):
     """This utility returns the i-band magnitude of the objects in the input
     data or simulation catalog. Does not apply any cuts and returns NaNs for
@@ -1367,6 +2843,8 @@ def get_imag(catalog):
     return mag
 
 
+@_cached_on_view
+@uses_columns(("i_psfflux_mag",), ("imag_psf",), ("base_PsfFlux_instFlux",))
 def get_imag_psf(catalog):
     """Returns the i-band magnitude of the objects in the input data or
     simulation catalog. Does not apply any cuts and returns NaNs for invalid
@@ -1388,6 +2866,32 @@ def get_imag_psf(catalog):
     return magnitude
 
 
+@_cached_on_view
+@uses_columns(
+    ("npass",),
+    (
+        "g_inputcount_value",
+        "r_inputcount_value",
+        "z_inputcount_value",
+        "y_inputcount_value",
+    )
+    + tuple(
+        "forced_%s_%s%s" % (band, pend, ext)
+        for band in "grzy"
+        for pend in ("cmodel_mag", "apertureflux_10_mag")
+        for ext in ("", "sigma", "err")
+    ),
+    (
+        "gcountinputs",
+        "rcountinputs",
+        "zcountinputs",
+        "ycountinputs",
+        "gmag_forced_cmodel_err",
+        "rmag_forced_cmodel_err",
+        "zmag_forced_cmodel_err",
+        "ymag_forced_cmodel_err",
+    ),
+)
 def get_npass(catalog, meas="cmodel"):
     """Returns npass values
 
@@ -1456,6 +2960,13 @@ def get_npass(catalog, meas="cmodel"):
     return npass
 
 
+@_cached_on_view
+@uses_columns(
+    ("absE",),
+    ("i_hsmshaperegauss_e1", "i_hsmshaperegauss_e2"),
+    ("ishape_hsm_regauss_e1", "ishape_hsm_regauss_e2"),
+    ("ext_shapeHSM_HsmShapeRegauss_e1", "ext_shapeHSM_HsmShapeRegauss_e2"),
+)
 def get_abs_ellip(catalog):
     """Returns the norm of galaxy ellipticities.
 
@@ -1489,6 +3000,8 @@ def get_abs_ellip(catalog):
     return absE
 
 
+@_cached_on_view
+@uses_columns(requires=("get_psf_ellip",))
 def get_abs_ellip_psf(catalog):
     """Returns the amplitude of ellipticities of PSF
 
@@ -1503,30 +3016,171 @@ def get_abs_ellip_psf(catalog):
     return out
 
 
-def get_FDFC_flag(data, hpfname):
-    """Returns the Full Depth Full Color (FDFC) cut
+class FootprintMaskCache(object):
+    """Cache of HEALPix footprint masks (e.g. FDFC, bright-star or visit
+    exclusion maps). Each map is read once per process (keyed by the absolute
+    path and rebuilt when the modification time of the file changes), and
+    composite masks combining several maps are precomputed once (one map per
+    resolution, so that no map is upgraded to a finer resolution). Both caches
+    keep the `maxsize` most recently used entries. Maps are boolean arrays in
+    NEST ordering, so that object flags are direct gathers `m[pix]`.
 
     Args:
-        data (ndarray):     input catalog array
-        hpfname (str):      healpix fname (s16a_wide2_fdfc.fits,
-                            s18a_fdfc_hp_contarea.fits, or
-                            s19a_fdfc_hp_contarea_izy-gt-5_trimmed_fd001.fits)
-    Returns:
-        mask (ndarray):     mask array for FDFC region
+        maxsize (int):      maximum number of cached maps (and of composite
+                            masks)
     """
-    ra, dec = get_radec(data)
-    m = hp.read_map(hpfname, nest=True, dtype=bool)
 
-    # Get flag
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._maps = {}
+        self._composites = {}
+        return
+
+    def _lru(self, cache, key, reader):
+        """Returns the cached value (moved to the end of the dict), or reads
+        and caches it, dropping the least recently used entry
+        """
+        value = cache.pop(key, None)
+        if value is None:
+            value = reader()
+        cache[key] = value
+        if len(cache) > self.maxsize:
+            del cache[next(iter(cache))]
+        return value
+
+    @staticmethod
+    def _key(fname):
+        fname = os.path.abspath(fname)
+        return fname, os.stat(fname).st_mtime_ns
+
+    def get(self, hpfname):
+        """Returns the (cached) boolean HEALPix map in NEST ordering
+
+        Args:
+            hpfname (str):      healpix file name
+        Returns:
+            m (ndarray):        boolean map
+        """
+        key = self._key(hpfname)
+        return self._lru(
+            self._maps, key, lambda: hp.read_map(key[0], nest=True, dtype=bool)
+        )
+
+    def composite(self, hpfnames, exclude_fnames=()):
+        """Returns the (cached) composite mask: inside all the `hpfnames`
+        maps and outside all the `exclude_fnames` maps. The maps with the
+        same resolution are combined into one map, and the maps with
+        different resolutions are kept at their own resolution (an object is
+        inside the composite mask if it is inside the maps of all the nsides).
+
+        Args:
+            hpfnames (list):        healpix maps of the included regions
+            exclude_fnames (list):  healpix maps of the excluded regions
+        Returns:
+            maps (dict):            boolean composite map of each nside
+        """
+        hpfnames = _as_list(hpfnames)
+        exclude_fnames = _as_list(exclude_fnames)
+        key = (
+            tuple(self._key(fn) for fn in hpfnames),
+            tuple(self._key(fn) for fn in exclude_fnames),
+        )
+
+        def _build():
+            out = {}
+            for i, fn in enumerate(hpfnames + exclude_fnames):
+                mm = self.get(fn)
+                if i >= len(hpfnames):
+                    mm = ~mm
+                nside = hp.npix2nside(len(mm))
+                # a new array, so that the cached maps are not modified
+                out[nside] = np.logical_and(out.get(nside, True), mm)
+            return out
+
+        return self._lru(self._composites, key, _build)
+
+    def clear(self):
+        """Empties the cache"""
+        self._maps.clear()
+        self._composites.clear()
+        return
+
+
+def _as_list(names):
+    """Returns a list of names"""
+    if isinstance(names, str):
+        return [names]
+    return list(names)
+
+
+"""footprint_cache: cache of the HEALPix footprint masks"""
+footprint_cache = FootprintMaskCache()
+
+
+def get_healpix_flag(ra, dec, m):
+    """Returns the value of a boolean HEALPix map (NEST ordering) at the
+    positions of objects
+
+    Args:
+        ra (ndarray):       ra [deg]
+        dec (ndarray):      dec [deg]
+        m (ndarray):        boolean map
+    Returns:
+        flag (ndarray):     m[pix] of the objects
+    """
+    nside = hp.npix2nside(len(m))
     mfactor = np.pi / 180.0
-    indices_map = np.where(m)[0]
-    nside = hp.get_nside(m)
     phi = ra * mfactor
     theta = np.pi / 2.0 - dec * mfactor
-    indices_obj = hp.ang2pix(nside, theta, phi, nest=True)
-    return np.in1d(indices_obj, indices_map)
+    return m[hp.ang2pix(nside, theta, phi, nest=True)]
+
 
+@uses_columns(requires=("get_radec",))
+def get_FDFC_flag(data, hpfname):
+    """Returns the Full Depth Full Color (FDFC) cut
+
+    Args:
+        data (ndarray):     input catalog array
+        hpfname (str):      healpix fname (s16a_wide2_fdfc.fits,
+                            s18a_fdfc_hp_contarea.fits, or
+                            s19a_fdfc_hp_contarea_izy-gt-5_trimmed_fd001.fits)
+    Returns:
+        mask (ndarray):     mask array for FDFC region
+    """
+    ra, dec = get_radec(data)
+    m = footprint_cache.get(hpfname)
+    return get_healpix_flag(ra, dec, m)
+
+
+@uses_columns(requires=("get_radec",))
+def get_footprint_flag(data, hpfnames, exclude_fnames=()):
+    """Returns the flag of objects inside the composite footprint (inside all
+    the `hpfnames` maps, e.g. FDFC, and outside all the `exclude_fnames` maps,
+    e.g. bright-star or visit exclusions)
 
+    Args:
+        data (ndarray):         input catalog array
+        hpfnames (list):        healpix maps of the included regions
+        exclude_fnames (list):  healpix maps of the excluded regions
+    Returns:
+        mask (ndarray):         mask array for the footprint
+    """
+    ra, dec = get_radec(data)
+    maps = footprint_cache.composite(hpfnames, exclude_fnames)
+    mask = np.ones(len(ra), dtype=bool)
+    for m in maps.values():
+        mask &= get_healpix_flag(ra, dec, m)
+    return mask
+
+
+@_cached_on_view
+@uses_columns(
+    ("ra", "dec"),
+    ("i_ra", "i_dec"),
+    ("ira", "idec"),
+    ("coord_ra", "coord_dec"),
+    ("ra_mock", "dec_mock"),
+)
 def get_radec(catalog):
     """Returns the angular position
 
@@ -1557,6 +3211,13 @@ def get_radec(catalog):
     return ra, dec
 
 
+@_cached_on_view
+@uses_columns(
+    ("res",),
+    ("i_hsmshaperegauss_resolution",),
+    ("ishape_hsm_regauss_resolution",),
+    ("ext_shapeHSM_HsmShapeRegauss_resolution",),
+)
 def get_res(catalog):
     """Returns the resolution
 
@@ -1578,6 +3239,12 @@ def get_res(catalog):
     return res
 
 
+@_cached_on_view
+@uses_columns(
+    ("base_SdssShape_xx", "base_SdssShape_yy", "base_SdssShape_xy"),
+    ("i_sdssshape_shape11", "i_sdssshape_shape22", "i_sdssshape_shape12"),
+    ("ishape_sdss_ixx", "ishape_sdss_iyy", "ishape_sdss_ixy"),
+)
 def get_sdss_size(catalog, dtype="det"):
     """This utility gets the observed galaxy size from a data or sims catalog
     using the specified size definition from the second moments matrix.
@@ -1614,6 +3281,14 @@ def get_sdss_size(catalog, dtype="det"):
     return size
 
 
+@_cached_on_view
+@uses_columns(
+    ("logb",),
+    ("base_Blendedness_abs",),
+    ("i_blendedness_abs_flux",),
+    ("i_blendedness_abs",),
+    ("iblendedness_abs_flux",),
+)
 def get_logb(catalog):
     """Returns the logb"""
     if "logb" in catalog.dtype.names:
@@ -1631,6 +3306,12 @@ def get_logb(catalog):
     return logb
 
 
+@_cached_on_view
+@uses_columns(
+    ("base_Blendedness_abs", "base_Blendedness_raw", "base_Blendedness_old"),
+    ("i_blendedness_abs_flux", "i_blendedness_raw_flux", "i_blendedness_old"),
+    ("i_blendedness_abs", "i_blendedness_raw", "i_blendedness_old"),
+)
 def get_logbAll(catalog):
     """Returns the logb"""
     if "base_Blendedness_abs" in catalog.dtype.names:  # pipe 7
@@ -1652,6 +3333,13 @@ def get_logbAll(catalog):
     return logbA, logbR, logbO
 
 
+@_cached_on_view
+@uses_columns(
+    ("sigma_e",),
+    ("i_hsmshaperegauss_sigma",),
+    ("ishape_hsm_regauss_sigma",),
+    ("ext_shapeHSM_HsmShapeRegauss_sigma",),
+)
 def get_sigma_e(catalog):
     """
     This utility returns the hsm_regauss_sigma values for the catalog, without
@@ -1672,6 +3360,8 @@ def get_sigma_e(catalog):
     return sigma_e
 
 
+@_cached_on_view
+@uses_columns(("g1", "g2"), ("g1_true", "g2_true"))
 def get_true_shear(catalog):
     """
     This routine accesses the truth tables to get the true shear in the
@@ -1691,6 +3381,23 @@ def get_true_shear(catalog):
         raise NameError("input catalog does not contain g_1/g_2 or g1_true/g2_true")
 
 
+"""_psf_moment_columns: PSF second moments of the catalog schemas (pipe 7, S18A
+and S19A, S16A), read by `get_psf_size` if the size is not in the catalog"""
+_psf_moment_columns = (
+    ("base_SdssShape_psf_xx", "base_SdssShape_psf_yy", "base_SdssShape_psf_xy"),
+    ("i_sdssshape_psf_shape11", "i_sdssshape_psf_shape22", "i_sdssshape_psf_shape12"),
+    ("ishape_sdss_psf_ixx", "ishape_sdss_psf_iyy", "ishape_sdss_psf_ixy"),
+)
+
+
+@_cached_on_view
+@uses_columns(
+    branches={
+        "trace": (("traceR",),) + _psf_moment_columns,
+        "det": (("detR",),) + _psf_moment_columns,
+        "fwhm": (("fwhm",),) + _psf_moment_columns,
+    }
+)
 def get_psf_size(catalog, dtype="fwhm"):
     """This utility gets the PSF size from a data or sims catalog using the
     specified size definition from the second moments matrix.
@@ -1702,6 +3409,13 @@ def get_psf_size(catalog, dtype="fwhm"):
     Returns:
         size (ndarray):     PSF size
     """
+    if dtype not in ["trace", "det", "fwhm"]:
+        raise ValueError("Unknown PSF size type: %s" % dtype)
+    # the size stored in the catalog (sims)
+    name = {"trace": "traceR", "det": "detR", "fwhm": "fwhm"}[dtype]
+    if name in catalog.dtype.names:
+        return catalog[name]
+
     if "base_SdssShape_psf_xx" in catalog.dtype.names:
         psf_mxx = catalog["base_SdssShape_psf_xx"] * 0.168**2.0
         psf_myy = catalog["base_SdssShape_psf_yy"] * 0.168**2.0
@@ -1720,25 +3434,21 @@ def get_psf_size(catalog, dtype="fwhm"):
         psf_mxy = _nan_array(len(catalog))
 
     if dtype == "trace":
-        if "traceR" in catalog.dtype.names:
-            size = catalog["traceR"]
-        else:
-            size = np.sqrt(psf_mxx + psf_myy)
+        size = np.sqrt(psf_mxx + psf_myy)
     elif dtype == "det":
-        if "detR" in catalog.dtype.names:
-            size = catalog["detR"]
-        else:
-            size = (psf_mxx * psf_myy - psf_mxy**2) ** (0.25)
-    elif dtype == "fwhm":
-        if "fwhm" in catalog.dtype.names:
-            size = catalog["fwhm"]
-        else:
-            size = 2.355 * (psf_mxx * psf_myy - psf_mxy**2) ** (0.25)
+        size = (psf_mxx * psf_myy - psf_mxy**2) ** (0.25)
     else:
-        raise ValueError("Unknown PSF size type: %s" % dtype)
+        size = 2.355 * (psf_mxx * psf_myy - psf_mxy**2) ** (0.25)
     return size
 
 
+@_cached_on_view
+@uses_columns(
+    ("noivar",),
+    ("ivariance", "forced_ivariance"),
+    ("i_variance_value",),
+    ("base_Variance_value",),
+)
 def get_noi_var(catalog):
     if "noivar" in catalog.dtype.names:  # smallcat
         varNois = catalog["noivar"]
@@ -1753,6 +3463,15 @@ def get_noi_var(catalog):
     return varNois
 
 
+@_cached_on_view
+@uses_columns(
+    ("e1_regaus", "e2_regaus"),
+    ("i_hsmshaperegauss_e1", "i_hsmshaperegauss_e2"),
+    ("ishape_hsm_regauss_e1", "ishape_hsm_regauss_e2"),
+    ("ext_shapeHSM_HsmShapeRegauss_e1", "ext_shapeHSM_HsmShapeRegauss_e2"),
+    ("i_sdssshape_shape11", "i_sdssshape_shape22", "i_sdssshape_shape12"),
+    ("ishape_sdss_ixx", "ishape_sdss_iyy", "ishape_sdss_ixy"),
+)
 def get_gal_ellip(catalog):
     if "e1_regaus" in catalog.dtype.names:  # small catalog
         return catalog["e1_regaus"], catalog["e2_regaus"]
@@ -1778,6 +3497,13 @@ def get_gal_ellip(catalog):
     return (mxx - myy) / (mxx + myy), 2.0 * mxy / (mxx + myy)
 
 
+@_cached_on_view
+@uses_columns(
+    ("e1_psf", "e2_psf"),
+    ("base_SdssShape_psf_xx", "base_SdssShape_psf_yy", "base_SdssShape_psf_xy"),
+    ("i_sdssshape_psf_shape11", "i_sdssshape_psf_shape22", "i_sdssshape_psf_shape12"),
+    ("ishape_sdss_psf_ixx", "ishape_sdss_psf_iyy", "ishape_sdss_psf_ixy"),
+)
 def get_psf_ellip(catalog, return_shear=False):
     """This utility gets the PSF ellipticity (uncalibrated shear) from a data
     or sims catalog.
@@ -1809,6 +3535,12 @@ def get_psf_ellip(catalog, return_shear=False):
         )
 
 
+@_cached_on_view
+@uses_columns(
+    ("i_sdssshape_shape11", "i_sdssshape_shape22", "i_sdssshape_shape12"),
+    ("ishape_sdss_ixx", "ishape_sdss_iyy", "ishape_sdss_ixy"),
+    ("base_SdssShape_xx", "base_SdssShape_yy", "base_SdssShape_xy"),
+)
 def get_sdss_ellip(catalog, return_shear=False):
     """This utility gets the SDSS ellipticity (uncalibrated shear) from a data
     or sims catalog.
@@ -1837,15 +3569,11 @@ def get_sdss_ellip(catalog, return_shear=False):
         )
 
 
-def get_sigma_e_model(catalog, pltDir="./plot/optimize_weight/"):
-    """This utility returns a model for the shape measurement uncertainty as a
-    function of SNR and resolution.  It uses the catalog directly to get the
-    SNR and resolution values.
-
-    The file storing the data used to build the approximate correction is
-    expected to be found in plot/sigmae_ratio.dat
+def _get_snr_res(catalog):
+    """Returns the SNR, log10(SNR) and resolution used by the calibration
+    models. NaN/inf SNR values are set to the minimum value that passes the
+    nominal cut.
     """
-    # Get the necessary quantities.
     snr = np.array(get_snr(catalog))
     log_snr = np.log10(snr)
     res = np.array(get_res(catalog))
@@ -1853,191 +3581,192 @@ def get_sigma_e_model(catalog, pltDir="./plot/optimize_weight/"):
     m = np.isnan(log_snr) | np.isinf(log_snr)
     log_snr[m] = 1.0  # set to minimum value that passes nominal cut
     snr[m] = 10.0
+    return snr, log_snr, res
+
 
+def _photo_z_dir(pltDir):
+    """Returns the directory of the photo-z dependent calibration tables"""
+    return os.path.join(pltDir[:-12], "sanityTest")
+
+
+def _sigma_e_model(snr, log_snr, res, pltDir):
+    """Model of sigma_e from (SNR, log10(SNR), resolution)"""
     # Build the baseline model for sigma_e.
-    par = np.load(os.path.join(pltDir, "sigma_e_model_par.npy"), allow_pickle=True)[0]
+    par = calib_registry.table(os.path.join(pltDir, "sigma_e_model_par.npy"))[0]
     sigma_e = np.exp(par[2]) * ((snr / 20.0) ** par[0]) * ((res / 0.5) ** par[1])
 
     # Get the corrections from interpolation amongst saved values.
-    dat = np.loadtxt(os.path.join(pltDir, "sigmae_ratio.dat")).transpose()
-    saved_snr = dat[0, :]
-    log_saved_snr = np.log10(saved_snr)
-    saved_res = dat[1, :]
-    saved_corr = dat[2, :]
-
     # Interpolate the corrections (which multiply the power-law results).
-    result = grid_interpolate_2d(log_saved_snr, saved_res, saved_corr, log_snr, res)
+    interp = calib_registry.interpolator(
+        os.path.join(pltDir, "sigmae_ratio.dat"), (0, 1), 2
+    )
+    result = interp(log_snr, res)
     return result * sigma_e
 
 
-def get_erms_model(catalog, pltDir="./plot/optimize_weight/"):
-    """This utility returns a model for the RMS ellipticity as a function of
-    SNR and resolution.  It uses the catalog directly to get the SNR and
-    resolution values.
+def _erms_model(log_snr, res, pltDir):
+    """Model of e_rms from (log10(SNR), resolution)"""
+    # Interpolate the saved e_rms values and return them.
+    interp = calib_registry.interpolator(
+        os.path.join(pltDir, "intrinsicshape_2d.dat"), (0, 1), 2
+    )
+    return interp(log_snr, res)
 
-    The file storing the data used to build the model is expected to be found in
-    plot/eRMS/intrinsicshape_2d.dat
 
-    """
-    # Get the necessary quantities.
-    snr = np.array(get_snr(catalog))
-    log_snr = np.log10(snr)
-    res = np.array(get_res(catalog))
-    # Fix interpolation for NaN/inf
-    m = np.isnan(log_snr) | np.isinf(log_snr)
-    log_snr[m] = 1.0  # set to minimum value that passes nominal cut
-    snr[m] = 10.0
+def _mwt_model(snr, log_snr, res, pltDir):
+    """Model of the weight bias on m from (SNR, log10(SNR), resolution)"""
+    # m = -1.31 + (27.26 + (snr/20.)**-1.22) / (res + 20.8)
+    maFname = os.path.join(pltDir, "weightBias_m_a_model_par.npy")
+    m_opt = calib_registry.table(maFname).item()["m_opt"]
+    fake_x = np.vstack((snr, res))
+    model_m = mwt_func(fake_x, *m_opt)
 
-    # Get saved model values.
-    dat = np.loadtxt(os.path.join(pltDir, "intrinsicshape_2d.dat")).transpose()
-    saved_snr = dat[0, :]
-    log_saved_snr = np.log10(saved_snr)
+    data_file = os.path.join(pltDir, "weightBias_dm_da_2d.csv")
+    # Interpolate the model residuals and return them.  These are additional
+    # biases beyond the power-law model and so should be added to the power-law.
+    interp = calib_registry.interpolator(data_file, ("snr", "res"), "dm")
+    result = interp(log_snr, res)
+    return result + model_m
 
-    saved_res = dat[1, :]
-    saved_model = dat[2, :]
 
-    # Interpolate the e_rms values and return them.
-    result = grid_interpolate_2d(log_saved_snr, saved_res, saved_model, log_snr, res)
-    return result
+def _awt_model(snr, log_snr, res, pltDir):
+    """Model of the weight bias on a from (SNR, log10(SNR), resolution)"""
+    # a = -0.089 * (res-0.71) * ((snr/20.)**-2.2)
+    maFname = os.path.join(pltDir, "weightBias_m_a_model_par.npy")
+    a_opt = calib_registry.table(maFname).item()["a_opt"]
+    fake_x = np.vstack((snr, res))
+    model_a = a_func(fake_x, *a_opt)
 
+    data_file = os.path.join(pltDir, "weightBias_dm_da_2d.csv")
+    # Interpolate the model residuals and return them.  These are additional
+    # biases beyond the power-law model and so should be added to the power-law.
+    interp = calib_registry.interpolator(data_file, ("snr", "res"), "da")
+    result = interp(log_snr, res)
+    return result + model_a
 
-def get_weight_model(catalog, pltDir="./plot/optimize_weight/"):
-    """
-    This utility returns a model for the shape measurement weight as a
-    function of SNR and resolution.  It relies on two other routines
-    to get models for the intrinsic shape RMS and measurement error.
-    """
-    sigmae_meas = get_sigma_e_model(catalog, pltDir)
-    erms = get_erms_model(catalog, pltDir)
-    return 1.0 / (sigmae_meas**2 + erms**2)
 
+def _photo_z_model(photo_z, key, pltDir):
+    """Photo-z dependent correction to m (key='dm') or a (key='da')"""
+    z_file = os.path.join(_photo_z_dir(pltDir), "dnn_z_bin_dm_da_2d.csv")
+    interp = calib_registry.interpolator(z_file, ("z",), key, log_snr=False)
+    return interp(photo_z)
 
-def get_m_model(
-    catalog, weight_bias=True, photo_z_dep=True, pltDir="./plot/reGausCalib/"
-):
-    """
-    Routine to get a model for calibration bias m given some input snr
-    and resolution values or arrays.
-    """
-    # Get the necessary quantities.
-    snr = np.array(get_snr(catalog))
-    log_snr = np.log10(snr)
-    res = np.array(get_res(catalog))
-    # Fix interpolation for NaN/inf
-    m = np.isnan(log_snr) | np.isinf(log_snr)
-    log_snr[m] = 1.0  # set to minimum value that passes nominal cut
-    snr[m] = 10.0
 
+def _m_model(snr, log_snr, res, photo_z, weight_bias, photo_z_dep, pltDir):
+    """Model of m from (SNR, log10(SNR), resolution, photo-z)"""
     # m = -0.1408*((snr/20.)**-1.23)*((res/0.5)**1.76) - 0.0214
     maFname = os.path.join(pltDir, "shear_m_a_model_par.npy")
-    m_opt = np.load(maFname, allow_pickle=True).item()["m_opt"]
+    m_opt = calib_registry.table(maFname).item()["m_opt"]
     fake_x = np.vstack((snr, res))
     model_m = m_func(fake_x, *m_opt)
 
     data_file = os.path.join(pltDir, "shear_dm_da_2d.csv")
-    dat = Table.read(data_file)
-    saved_snr = dat["snr"]
-    log_saved_snr = np.log10(saved_snr)
-    saved_res = dat["res"]
-    saved_m = dat["dm"]
     # Interpolate the model residuals and return them.  These are additional
     # biases beyond the power-law model and so should be added to the power-law.
-    result = grid_interpolate_2d(log_saved_snr, saved_res, saved_m, log_snr, res)
+    interp = calib_registry.interpolator(data_file, ("snr", "res"), "dm")
+    result = interp(log_snr, res)
 
     if weight_bias:
-        result += get_mwt_model(catalog, pltDir=pltDir)
+        result += _mwt_model(snr, log_snr, res, pltDir)
 
     if photo_z_dep:
-        pzDir = os.path.join(pltDir[:-12], "sanityTest")
-        z_file = os.path.join(pzDir, "dnn_z_bin_dm_da_2d.csv")
-        zat = Table.read(z_file)
-        saved_z = zat["z"]
-        saved_m = zat["dm"]
-        result += grid_interpolate_1d(
-            saved_z, saved_m, np.array(get_photo_z(catalog, "dnn"))
-        )
+        result += _photo_z_model(photo_z, "dm", pltDir)
 
     model_m = model_m + result
     return model_m
 
 
-def get_mwt_model(catalog, pltDir="./plot/reGausCalib/"):
-    """Routine to get a model for calibration bias m due to weight bias, given
-    some input snr and resolution values or arrays.
-    """
-    # Get the necessary quantities.
-    snr = np.array(get_snr(catalog))
-    log_snr = np.log10(snr)
-    res = np.array(get_res(catalog))
-    # Fix interpolation for NaN/inf
-    m = np.isnan(log_snr) | np.isinf(log_snr)
-    log_snr[m] = 1.0  # set to minimum value that passes nominal cut
-    snr[m] = 10.0
-
-    # m = -1.31 + (27.26 + (snr/20.)**-1.22) / (res + 20.8)
-    maFname = os.path.join(pltDir, "weightBias_m_a_model_par.npy")
-    m_opt = np.load(maFname, allow_pickle=True).item()["m_opt"]
-    fake_x = np.vstack((snr, res))
-    model_m = mwt_func(fake_x, *m_opt)
-
-    data_file = os.path.join(pltDir, "weightBias_dm_da_2d.csv")
-    dat = Table.read(data_file)
-    saved_snr = dat["snr"]
-    log_saved_snr = np.log10(saved_snr)
-    saved_res = dat["res"]
-    saved_m = dat["dm"]
-    # Interpolate the model residuals and return them.  These are additional
-    # biases beyond the power-law model and so should be added to the power-law.
-    result = grid_interpolate_2d(log_saved_snr, saved_res, saved_m, log_snr, res)
-    return result + model_m
-
-
-def get_c_model(
-    catalog, weight_bias=True, photo_z_dep=True, pltDir="./plot/reGausCalib/"
-):
-    """Routine to get a model for additive bias coefficient a given some input
-    snr and resolution values or arrays.
+def _a_model(snr, log_snr, res, photo_z, weight_bias, photo_z_dep, pltDir):
+    """Model of the additive bias coefficient a from (SNR, log10(SNR),
+    resolution, photo-z)
     """
-    # Get the necessary quantities.
-    snr = np.array(get_snr(catalog))
-    log_snr = np.log10(snr)
-    res = np.array(get_res(catalog))
-    # Fix interpolation for NaN/inf
-    m = np.isnan(log_snr) | np.isinf(log_snr)
-
-    log_snr[m] = 1.0  # set to minimum value that passes nominal cut
-    snr[m] = 10.0
-
     # a = 0.175 * ((snr/20.)**-1.07) * (res - 0.508)
-
     maFname = os.path.join(pltDir, "shear_m_a_model_par.npy")
-    a_opt = np.load(maFname, allow_pickle=True).item()["a_opt"]
+    a_opt = calib_registry.table(maFname).item()["a_opt"]
     fake_x = np.vstack((snr, res))
     model_a = a_func(fake_x, *a_opt)
 
     data_file = os.path.join(pltDir, "shear_dm_da_2d.csv")
-    dat = Table.read(data_file)
-    saved_snr = dat["snr"]
-    log_saved_snr = np.log10(saved_snr)
-    saved_res = dat["res"]
-    saved_a = dat["da"]
     # Interpolate the model residuals and return them.  These are additional
     # biases beyond the power-law model and so should be added to the power-law.
-    result = grid_interpolate_2d(log_saved_snr, saved_res, saved_a, log_snr, res)
+    interp = calib_registry.interpolator(data_file, ("snr", "res"), "da")
+    result = interp(log_snr, res)
     if weight_bias:
-        result += get_awt_model(catalog, pltDir=pltDir)
+        result += _awt_model(snr, log_snr, res, pltDir)
 
     if photo_z_dep:
-        pzDir = os.path.join(pltDir[:-12], "sanityTest")
-        z_file = os.path.join(pzDir, "dnn_z_bin_dm_da_2d.csv")
-        zat = Table.read(z_file)
-        saved_z = zat["z"]
-        saved_a = zat["da"]
-        result += grid_interpolate_1d(
-            saved_z, saved_a, np.array(get_photo_z(catalog, "dnn"))
-        )
+        result += _photo_z_model(photo_z, "da", pltDir)
 
     model_a = model_a + result
+    return model_a
+
+
+def get_sigma_e_model(catalog, pltDir="./plot/optimize_weight/"):
+    """This utility returns a model for the shape measurement uncertainty as a
+    function of SNR and resolution.  It uses the catalog directly to get the
+    SNR and resolution values.
+
+    The file storing the data used to build the approximate correction is
+    expected to be found in plot/sigmae_ratio.dat
+    """
+    snr, log_snr, res = _get_snr_res(catalog)
+    return _sigma_e_model(snr, log_snr, res, pltDir)
+
+
+def get_erms_model(catalog, pltDir="./plot/optimize_weight/"):
+    """This utility returns a model for the RMS ellipticity as a function of
+    SNR and resolution.  It uses the catalog directly to get the SNR and
+    resolution values.
+
+    The file storing the data used to build the model is expected to be found in
+    plot/eRMS/intrinsicshape_2d.dat
+
+    """
+    _, log_snr, res = _get_snr_res(catalog)
+    return _erms_model(log_snr, res, pltDir)
+
+
+def get_weight_model(catalog, pltDir="./plot/optimize_weight/"):
+    """
+    This utility returns a model for the shape measurement weight as a
+    function of SNR and resolution.  It relies on two other routines
+    to get models for the intrinsic shape RMS and measurement error.
+    """
+    snr, log_snr, res = _get_snr_res(catalog)
+    sigmae_meas = _sigma_e_model(snr, log_snr, res, pltDir)
+    erms = _erms_model(log_snr, res, pltDir)
+    return 1.0 / (sigmae_meas**2 + erms**2)
+
+
+def get_m_model(
+    catalog, weight_bias=True, photo_z_dep=True, pltDir="./plot/reGausCalib/"
+):
+    """
+    Routine to get a model for calibration bias m given some input snr
+    and resolution values or arrays.
+    """
+    snr, log_snr, res = _get_snr_res(catalog)
+    photo_z = np.array(get_photo_z(catalog, "dnn")) if photo_z_dep else None
+    return _m_model(snr, log_snr, res, photo_z, weight_bias, photo_z_dep, pltDir)
+
+
+def get_mwt_model(catalog, pltDir="./plot/reGausCalib/"):
+    """Routine to get a model for calibration bias m due to weight bias, given
+    some input snr and resolution values or arrays.
+    """
+    snr, log_snr, res = _get_snr_res(catalog)
+    return _mwt_model(snr, log_snr, res, pltDir)
+
+
+def get_c_model(
+    catalog, weight_bias=True, photo_z_dep=True, pltDir="./plot/reGausCalib/"
+):
+    """Routine to get a model for additive bias coefficient a given some input
+    snr and resolution values or arrays.
+    """
+    snr, log_snr, res = _get_snr_res(catalog)
+    photo_z = np.array(get_photo_z(catalog, "dnn")) if photo_z_dep else None
+    model_a = _a_model(snr, log_snr, res, photo_z, weight_bias, photo_z_dep, pltDir)
     psf_e1, psf_e2 = get_psf_ellip(catalog)
     model_c1 = model_a * psf_e1
     model_c2 = model_a * psf_e2
@@ -2048,31 +3777,8 @@ def get_awt_model(catalog, pltDir="./plot/reGausCalib/"):
     """Routine to get a model for additive bias coefficient a due to weight
     bias given some input snr and resolution values or arrays.
     """
-    # Get the necessary quantities.
-    snr = np.array(get_snr(catalog))
-    log_snr = np.log10(snr)
-    res = np.array(get_res(catalog))
-    # Fix interpolation for NaN/inf
-    m = np.isnan(log_snr) | np.isinf(log_snr)
-    log_snr[m] = 1.0  # set to minimum value that passes nominal cut
-    snr[m] = 10.0
-
-    # a = -0.089 * (res-0.71) * ((snr/20.)**-2.2)
-    maFname = os.path.join(pltDir, "weightBias_m_a_model_par.npy")
-    a_opt = np.load(maFname, allow_pickle=True).item()["a_opt"]
-    fake_x = np.vstack((snr, res))
-    model_a = a_func(fake_x, *a_opt)
-
-    data_file = os.path.join(pltDir, "weightBias_dm_da_2d.csv")
-    dat = Table.read(data_file)
-    saved_snr = dat["snr"]
-    log_saved_snr = np.log10(saved_snr)
-    saved_res = dat["res"]
-    saved_a = dat["da"]
-    # Interpolate the model residuals and return them.  These are additional
-    # biases beyond the power-law model and so should be added to the power-law.
-    result = grid_interpolate_2d(log_saved_snr, saved_res, saved_a, log_snr, res)
-    return result + model_a
+    snr, log_snr, res = _get_snr_res(catalog)
+    return _awt_model(snr, log_snr, res, pltDir)
 
 
 def grid_interpolate_1d(x, z, eval_x):
@@ -2080,11 +3786,7 @@ def grid_interpolate_1d(x, z, eval_x):
     values eval_x, but also enabling extrapolation beyond the (x) bounds using
     the nearest neighbor method.
     """
-    result = griddata(x, z, eval_x, method="linear")
-    nn_result = griddata(x, z, eval_x, method="nearest")
-    mask = np.isnan(result)
-    result[mask] = nn_result[mask]
-    return result
+    return GridInterpolator((x,), z)(eval_x)
 
 
 def grid_interpolate_2d(x, y, z, eval_x, eval_y):
@@ -2092,19 +3794,459 @@ def grid_interpolate_2d(x, y, z, eval_x, eval_y):
     values (x, y) = (eval_x, eval_y), but also enabling extrapolation beyond
     the (x, y) bounds using the nearest neighbor method.
     """
-    result = griddata((x, y), z, (eval_x, eval_y), method="linear")
-    nn_result = griddata((x, y), z, (eval_x, eval_y), method="nearest")
-    mask = np.isnan(result)
-    result[mask] = nn_result[mask]
-    return result
+    return GridInterpolator((x, y), z)(eval_x, eval_y)
+
+
+class GridInterpolator(object):
+    """Linear interpolation of scattered data with nearest-neighbour
+    extrapolation beyond the convex hull of the data points (same as
+    `scipy.interpolate.griddata` with 'linear', then 'nearest' for the points
+    outside). The triangulation and the KD-tree are built once, so that the
+    object can be evaluated repeatedly.
+
+    Args:
+        points (tuple):     coordinate arrays of the data points, e.g. (x, y)
+        values (ndarray):   values at the data points
+    """
+
+    def __init__(self, points, values):
+        points = [np.asarray(pp, dtype=float) for pp in points]
+        values = np.asarray(values)
+        self.ndim = len(points)
+        # (min, max) of each coordinate of the data points
+        self.bounds = [(pp.min(), pp.max()) for pp in points]
+        if self.ndim == 1:
+            # the same as griddata for 1D data
+            x = points[0]
+            idx = np.argsort(x)
+            self.linear = interp1d(
+                x[idx],
+                values[idx],
+                kind="linear",
+                bounds_error=False,
+                fill_value=np.nan,
+            )
+            self.nearest = interp1d(
+                x[idx],
+                values[idx],
+                kind="nearest",
+                bounds_error=False,
+                fill_value="extrapolate",
+            )
+        else:
+            xy = np.stack(points, axis=-1)
+            self.linear = LinearNDInterpolator(xy, values)
+            self.nearest = NearestNDInterpolator(xy, values)
+        return
+
+    def __call__(self, *coords):
+        if len(coords) != self.ndim:
+            raise ValueError("expect %d coordinate arrays" % self.ndim)
+        if self.ndim == 1:
+            xi = np.asarray(coords[0])
+        else:
+            xi = np.stack(np.broadcast_arrays(*coords), axis=-1)
+        result = self.linear(xi)
+        mask = np.isnan(result)
+        if np.any(mask):
+            result[mask] = self.nearest(xi[mask])
+        return result
+
+    def contains(self, *coords):
+        """Returns whether the coordinates are in the convex hull of the data
+        points, i.e. interpolated linearly (not extrapolated)
+        """
+        if len(coords) != self.ndim:
+            raise ValueError("expect %d coordinate arrays" % self.ndim)
+        if self.ndim == 1:
+            xi = np.asarray(coords[0])
+            return (xi >= self.bounds[0][0]) & (xi <= self.bounds[0][1])
+        xi = np.stack(np.broadcast_arrays(*coords), axis=-1)
+        return self.linear.tri.find_simplex(xi) >= 0
+
+
+class CalibrationModelRegistry(object):
+    """Registry of the calibration tables (.npy, .dat, .csv) used by the
+    `get_*_model` functions and of the interpolators built from them. Each
+    table is read, and each interpolator is built, once per file; the entries
+    are keyed by the absolute path and rebuilt when the modification time of
+    the file changes. The registry can be shared by threads.
+
+    Args:
+        maxsize (int):  maximum number of cached tables (and headers); the
+                        least recently used ones are dropped [default: None,
+                        no limit]
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._tables = {}
+        self._headers = {}
+        self._interpolators = {}
+        # reentrant, since the interpolators read the tables
+        self._lock = threading.RLock()
+        return
+
+    def _get(self, cache, key, mtime, reader):
+        """Returns the cached entry (keeping the most recently used entries
+        at the end of the dict), or reads and caches it
+        """
+        with self._lock:
+            entry = cache.pop(key, None)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, reader())
+            cache[key] = entry
+            if self.maxsize is not None and len(cache) > self.maxsize:
+                del cache[next(iter(cache))]
+        return entry[1]
+
+    @staticmethod
+    def _stat(fname):
+        fname = os.path.abspath(fname)
+        return fname, os.stat(fname).st_mtime_ns
+
+    @staticmethod
+    def _read(fname):
+        if fname.endswith(".npy"):
+            return np.load(fname, allow_pickle=True)
+        elif fname.endswith(".dat"):
+            return np.loadtxt(fname).transpose()
+        else:
+            return Table.read(fname)
 
+    def table(self, fname):
+        """Returns the (cached) content of a calibration table
 
+        Args:
+            fname (str):        file name (.npy, .dat or astropy Table)
+        Returns:
+            out:                array (.npy), transposed array (.dat) or
+                                astropy Table
+        """
+        fname, mtime = self._stat(fname)
+        return self._get(self._tables, fname, mtime, lambda: self._read(fname))
+
+    def header(self, fname, ext=0):
+        """Returns the (cached) header of a FITS file
+
+        Args:
+            fname (str):        FITS file name
+            ext (int):          extension
+        Returns:
+            header (Header):    astropy FITS header
+        """
+        fname, mtime = self._stat(fname)
+        return self._get(
+            self._headers,
+            (fname, ext),
+            mtime,
+            lambda: pyfits.getheader(fname, ext),
+        )
+
+    def interpolator(self, fname, xcols, zcol, log_snr=True):
+        """Returns the (cached) interpolator of a calibration table
+
+        Args:
+            fname (str):        file name of the table
+            xcols (tuple):      columns (names, or row indices for .dat files)
+                                of the coordinates, e.g. ('snr', 'res')
+            zcol (str | int):   column of the values
+            log_snr (bool):     whether the first coordinate is SNR and is
+                                interpolated in log10
+        Returns:
+            interp (GridInterpolator):
+                                interpolator taking the coordinates (with
+                                log10(SNR) if log_snr)
+        """
+        key = (os.path.abspath(fname), tuple(xcols), zcol, log_snr)
+        mtime = self._stat(fname)[1]
+        with self._lock:
+            entry = self._interpolators.get(key)
+            if entry is None or entry[0] != mtime:
+                dat = self.table(fname)
+                points = [np.asarray(dat[cc], dtype=float) for cc in xcols]
+                if log_snr:
+                    points[0] = np.log10(points[0])
+                entry = (mtime, GridInterpolator(points, np.asarray(dat[zcol])))
+                self._interpolators[key] = entry
+        return entry[1]
+
+    def clear(self):
+        """Empties the registry"""
+        with self._lock:
+            self._tables.clear()
+            self._headers.clear()
+            self._interpolators.clear()
+        return
+
+
+"""calib_registry: registry of calibration tables shared by the model functions"""
+calib_registry = CalibrationModelRegistry()
+
+"""CALIB_GRID_VERSION (int): version of the compiled calibration bundle"""
+CALIB_GRID_VERSION = 2
+
+
+def _reGaus_table_interpolators(weight_bias, pltDir_weight, pltDir_calib):
+    """Returns the interpolators of the residual tables of the (SNR,
+    resolution) calibration models (see `_sigma_e_model`, `_erms_model`,
+    `_m_model` and `_a_model`)
+    """
+    interps = [
+        calib_registry.interpolator(
+            os.path.join(pltDir_weight, "sigmae_ratio.dat"), (0, 1), 2
+        ),
+        calib_registry.interpolator(
+            os.path.join(pltDir_weight, "intrinsicshape_2d.dat"), (0, 1), 2
+        ),
+        # the m and a residuals share the points
+        calib_registry.interpolator(
+            os.path.join(pltDir_calib, "shear_dm_da_2d.csv"), ("snr", "res"), "dm"
+        ),
+    ]
+    if weight_bias:
+        interps.append(
+            calib_registry.interpolator(
+                os.path.join(pltDir_calib, "weightBias_dm_da_2d.csv"),
+                ("snr", "res"),
+                "dm",
+            )
+        )
+    return interps
+
+
+def compile_reGaus_calibration(
+    outFname,
+    log_snr_range=None,
+    res_range=None,
+    n_snr=512,
+    n_res=512,
+    weight_bias=True,
+    photo_z_dep=True,
+    pltDir_weight="./plot/optimize_weight/",
+    pltDir_calib="./plot/reGausCalib/",
+):
+    """Compiles the reGauss calibration models (sigma_e, e_rms, m and a,
+    including the power-law parts and the residual tables) into a versioned
+    .npz bundle, which is evaluated by `CalibrationGrid`.
+
+    The models depending on (SNR, resolution) are resampled onto a regular
+    grid in (log10(SNR), resolution), within the coordinate bounds of the
+    residual tables. The grid cells outside the convex hull of any table,
+    where the tables are extrapolated with the nearest neighbour, are flagged
+    and evaluated with the original models by `CalibrationGrid`. The photo-z
+    dependent corrections are additive and one-dimensional, so their table is
+    stored as it is and is interpolated exactly (with the nearest-neighbour
+    extrapolation).
+
+    Args:
+        outFname (str):         output file name (.npz)
+        log_snr_range (tuple):  range of the log10(SNR) grid [default: None,
+                                the bounds of the residual tables]
+        res_range (tuple):      range of the resolution grid [default: None,
+                                the bounds of the residual tables]
+        n_snr (int):            number of grid points in log10(SNR)
+        n_res (int):            number of grid points in resolution
+        weight_bias (bool):     whether to include the weight bias in m and a
+        photo_z_dep (bool):     whether to include the photo-z dependence
+        pltDir_weight (str):    directory of the sigma_e and e_rms tables
+        pltDir_calib (str):     directory of the m and a tables
+    Returns:
+        grid (CalibrationGrid): the compiled calibration
+    """
+    interps = _reGaus_table_interpolators(weight_bias, pltDir_weight, pltDir_calib)
+    # intersection of the coordinate bounds of the tables
+    bounds = np.array([ii.bounds for ii in interps])
+    lower = np.max(bounds[:, :, 0], axis=0)
+    upper = np.min(bounds[:, :, 1], axis=0)
+    ranges = [log_snr_range, res_range]
+    for n, name in enumerate(["log_snr_range", "res_range"]):
+        if ranges[n] is None:
+            ranges[n] = (lower[n], upper[n])
+        elif ranges[n][0] < lower[n] or ranges[n][1] > upper[n]:
+            raise ValueError(
+                "%s (%g, %g) exceeds the calibration tables (%g, %g)"
+                % (name, ranges[n][0], ranges[n][1], lower[n], upper[n])
+            )
+    log_snr = np.linspace(ranges[0][0], ranges[0][1], n_snr)
+    res = np.linspace(ranges[1][0], ranges[1][1], n_res)
+    ls, rr = np.meshgrid(log_snr, res, indexing="ij")
+    ls = ls.ravel()
+    rr = rr.ravel()
+    snr = 10.0**ls
+    shape = (n_snr, n_res)
+    # the cells with the four nodes in the convex hulls of all the tables
+    node = np.all([ii.contains(ls, rr) for ii in interps], axis=0).reshape(shape)
+    valid = node[:-1, :-1] & node[1:, :-1] & node[:-1, 1:] & node[1:, 1:]
+    sigma_e = _sigma_e_model(snr, ls, rr, pltDir_weight).reshape(shape)
+    erms = _erms_model(ls, rr, pltDir_weight).reshape(shape)
+    model_m = _m_model(snr, ls, rr, None, weight_bias, False, pltDir_calib)
+    model_a = _a_model(snr, ls, rr, None, weight_bias, False, pltDir_calib)
+
+    if photo_z_dep:
+        z_file = os.path.join(_photo_z_dir(pltDir_calib), "dnn_z_bin_dm_da_2d.csv")
+        zat = calib_registry.table(z_file)
+        z = np.asarray(zat["z"], dtype=float)
+        idx = np.argsort(z)
+        z = z[idx]
+        dm_z = np.asarray(zat["dm"], dtype=float)[idx]
+        da_z = np.asarray(zat["da"], dtype=float)[idx]
+    else:
+        z = np.zeros(0)
+        dm_z = np.zeros(0)
+        da_z = np.zeros(0)
+    np.savez(
+        outFname,
+        version=CALIB_GRID_VERSION,
+        log_snr=log_snr,
+        res=res,
+        valid=valid,
+        sigma_e=sigma_e,
+        erms=erms,
+        m=model_m.reshape(shape),
+        a=model_a.reshape(shape),
+        z=z,
+        dm_z=dm_z,
+        da_z=da_z,
+        weight_bias=weight_bias,
+        photo_z_dep=photo_z_dep,
+        pltDir_weight=pltDir_weight,
+        pltDir_calib=pltDir_calib,
+    )
+    return CalibrationGrid(outFname)
+
+
+class CalibrationGrid(object):
+    """Evaluates the reGauss calibration models compiled by
+    `compile_reGaus_calibration` with vectorized bilinear interpolation on the
+    regular (log10(SNR), resolution) grid. Objects outside the grid, or in the
+    cells outside the convex hulls of the calibration tables, are evaluated
+    with the original models (from the calibration tables).
+
+    Args:
+        fname (str):        file name of the compiled bundle (.npz)
+    """
+
+    def __init__(self, fname):
+        # the arrays are copied out of the archive, which is closed on exit
+        with np.load(fname) as dat:
+            version = int(dat["version"])
+            if version != CALIB_GRID_VERSION:
+                raise ValueError(
+                    "calibration bundle version %d is not supported (expect %d)"
+                    % (version, CALIB_GRID_VERSION)
+                )
+            self.log_snr = np.array(dat["log_snr"])
+            self.res = np.array(dat["res"])
+            self.valid = np.array(dat["valid"])
+            self.grids = {kk: np.array(dat[kk]) for kk in ["sigma_e", "erms", "m", "a"]}
+            self.z = np.array(dat["z"])
+            self.dm_z = np.array(dat["dm_z"])
+            self.da_z = np.array(dat["da_z"])
+            self.weight_bias = bool(dat["weight_bias"])
+            self.photo_z_dep = bool(dat["photo_z_dep"])
+            self.pltDir_weight = str(dat["pltDir_weight"])
+            self.pltDir_calib = str(dat["pltDir_calib"])
+        return
+
+    @staticmethod
+    def _locate(x, nodes):
+        """Returns the lower node index and the fractional offset"""
+        dx = (nodes[-1] - nodes[0]) / (len(nodes) - 1)
+        f = (x - nodes[0]) / dx
+        # NaN is mapped to the first cell (it is outside the grid)
+        i = np.clip(np.floor(np.nan_to_num(f)), 0, len(nodes) - 2).astype(int)
+        return i, f - i
+
+    def _bilinear(self, i, tx, j, ty):
+        """Returns the bilinear interpolation of all the grids in the cells
+        (i, j) at the fractional offsets (tx, ty)
+        """
+        n_res = len(self.res)
+        k = i * n_res + j
+        w00 = (1.0 - tx) * (1.0 - ty)
+        w01 = (1.0 - tx) * ty
+        w10 = tx * (1.0 - ty)
+        w11 = tx * ty
+        out = {}
+        for key, grid in self.grids.items():
+            g = grid.ravel()
+            out[key] = (
+                w00 * g[k]
+                + w01 * g[k + 1]
+                + w10 * g[k + n_res]
+                + w11 * g[k + n_res + 1]
+            )
+        return out
+
+    def evaluate(self, snr, log_snr, res, photo_z=None):
+        """Evaluates the calibration models
+
+        Args:
+            snr (ndarray):      SNR
+            log_snr (ndarray):  log10(SNR)
+            res (ndarray):      resolution
+            photo_z (ndarray):  photo-z [required if compiled with photo_z_dep]
+        Returns:
+            out (dict):         'sigma_e', 'erms', 'm' and 'a' (the additive
+                                bias coefficient, c = a * e_psf)
+        """
+        i, tx = self._locate(log_snr, self.log_snr)
+        j, ty = self._locate(res, self.res)
+        inside = (
+            (log_snr >= self.log_snr[0])
+            & (log_snr <= self.log_snr[-1])
+            & (res >= self.res[0])
+            & (res <= self.res[-1])
+            & self.valid[i, j]
+        )
+        if np.all(inside):
+            out = self._bilinear(i, tx, j, ty)
+        else:
+            out = {kk: np.empty(len(snr)) for kk in self.grids}
+            tmp = self._bilinear(i[inside], tx[inside], j[inside], ty[inside])
+            for key in out:
+                out[key][inside] = tmp[key]
+            # the original models outside the grid
+            outside = ~inside
+            args = (snr[outside], log_snr[outside], res[outside])
+            out["sigma_e"][outside] = _sigma_e_model(*args, self.pltDir_weight)
+            out["erms"][outside] = _erms_model(*args[1:], self.pltDir_weight)
+            out["m"][outside] = _m_model(
+                *args, None, self.weight_bias, False, self.pltDir_calib
+            )
+            out["a"][outside] = _a_model(
+                *args, None, self.weight_bias, False, self.pltDir_calib
+            )
+        if self.photo_z_dep:
+            if photo_z is None:
+                raise ValueError("photo_z is required by the calibration")
+            # np.interp extrapolates with the nearest end point
+            out["m"] += np.interp(photo_z, self.z, self.dm_z)
+            out["a"] += np.interp(photo_z, self.z, self.da_z)
+        return out
+
+
+@uses_columns(requires=("get_wl_cuts",), optional=("weak_lensing_flag",))
 def update_wl_cuts(catalog):
     """Update the weak-lensing cuts"""
     catalog["weak_lensing_flag"] = get_wl_cuts(catalog)
     return catalog
 
 
+@uses_columns(
+    ("a_i",),
+    requires=(
+        "get_sigma_e",
+        "get_abs_ellip",
+        ("get_psf_size", "fwhm"),
+        "get_imag",
+        "get_res",
+        "get_snr",
+        "get_logb",
+        "get_imag_A10",
+    ),
+)
 def get_wl_cuts(catalog):
     """Returns the weak-lensing cuts"""
     sig_e = get_sigma_e(catalog)
@@ -2124,43 +4266,242 @@ def get_wl_cuts(catalog):
     return wlflag
 
 
-def update_reGaus_calibration(catalog):
-    """Updates the columns derived from calibration"""
-    sigmae = get_sigma_e_model(catalog)
-    catalog["i_hsmshaperegauss_derived_sigma_e"] = sigmae
-    erms = get_erms_model(catalog)
-    catalog["i_hsmshaperegauss_derived_rms_e"] = erms
-    catalog["i_hsmshaperegauss_derived_weight"] = 1.0 / (sigmae**2 + erms**2)
-    model_m = get_m_model(catalog, weight_bias=True, photo_z_dep=True)
-    catalog["i_hsmshaperegauss_derived_shear_bias_m"] = model_m
-    model_c1, model_c2 = get_c_model(catalog, weight_bias=True, photo_z_dep=True)
-    catalog["i_hsmshaperegauss_derived_shear_bias_c1"] = model_c1
-    catalog["i_hsmshaperegauss_derived_shear_bias_c2"] = model_c2
+def update_reGaus_calibration(catalog, grid=None):
+    """Updates the columns derived from calibration
+
+    Args:
+        catalog (ndarray):          input catalog
+        grid (CalibrationGrid):     compiled calibration models [default: None,
+                                    evaluate the models from the tables]
+    Returns:
+        catalog (ndarray):          catalog with updated columns
+    """
+    if grid is not None:
+        snr, log_snr, res = _get_snr_res(catalog)
+        photo_z = None
+        if grid.photo_z_dep:
+            photo_z = np.array(get_photo_z(catalog, "dnn"))
+        out = grid.evaluate(snr, log_snr, res, photo_z)
+        psf_e1, psf_e2 = get_psf_ellip(catalog)
+        catalog["i_hsmshaperegauss_derived_sigma_e"] = out["sigma_e"]
+        catalog["i_hsmshaperegauss_derived_rms_e"] = out["erms"]
+        catalog["i_hsmshaperegauss_derived_weight"] = 1.0 / (
+            out["sigma_e"] ** 2 + out["erms"] ** 2
+        )
+        catalog["i_hsmshaperegauss_derived_shear_bias_m"] = out["m"]
+        catalog["i_hsmshaperegauss_derived_shear_bias_c1"] = out["a"] * psf_e1
+        catalog["i_hsmshaperegauss_derived_shear_bias_c2"] = out["a"] * psf_e2
+        return catalog
+
+    out = _calibrate_reGaus_block(catalog)
+    for key, colname in _reGaus_calibration_columns.items():
+        catalog[colname] = out[key]
     return catalog
 
 
-def get_mask_visit_104994(data):
-    """We found that visit 104994 has tracking errors, but that visit contributes
-    to coadds, we remove this region from the catalog level
+"""_reGaus_calibration_columns: output keys of the calibration and the
+corresponding catalog columns"""
+_reGaus_calibration_columns = {
+    "sigma_e": "i_hsmshaperegauss_derived_sigma_e",
+    "erms": "i_hsmshaperegauss_derived_rms_e",
+    "weight": "i_hsmshaperegauss_derived_weight",
+    "m": "i_hsmshaperegauss_derived_shear_bias_m",
+    "c1": "i_hsmshaperegauss_derived_shear_bias_c1",
+    "c2": "i_hsmshaperegauss_derived_shear_bias_c2",
+}
+
+
+def _get_reGaus_calibration_inputs(
+    catalog,
+    pltDir_weight="./plot/optimize_weight/",
+    pltDir_calib="./plot/reGausCalib/",
+):
+    """Returns the inputs shared by all the calibration models, i.e.
+    (snr, log_snr, res, photo_z, psf_e1, psf_e2, pltDir_weight, pltDir_calib)
+    """
+    snr, log_snr, res = _get_snr_res(catalog)
+    photo_z = np.array(get_photo_z(catalog, "dnn"))
+    psf_e1, psf_e2 = get_psf_ellip(catalog)
+    return (
+        snr,
+        log_snr,
+        res,
+        photo_z,
+        np.array(psf_e1),
+        np.array(psf_e2),
+        pltDir_weight,
+        pltDir_calib,
+    )
+
+
+def _calibrate_reGaus_block(
+    catalog,
+    pltDir_weight="./plot/optimize_weight/",
+    pltDir_calib="./plot/reGausCalib/",
+):
+    """Evaluates all the calibration outputs of a row block, computing the
+    inputs shared by the models (see `_get_reGaus_calibration_inputs`) once
 
     Args:
-        data (ndarray): input catalog
+        catalog (ndarray):      rows of the block
+        pltDir_weight (str):    directory of the sigma_e and e_rms tables
+        pltDir_calib (str):     directory of the m and a tables
     Returns:
-        mask (ndarray): mask removing the problematic region
+        out (dict):             'sigma_e', 'erms', 'weight', 'm', 'c1' and 'c2'
     """
-    ra, dec = get_radec(data)
+    inputs = _get_reGaus_calibration_inputs(catalog, pltDir_weight, pltDir_calib)
+    snr, log_snr, res, photo_z, psf_e1, psf_e2, pltDir_weight, pltDir_calib = inputs
+    sigmae = _sigma_e_model(snr, log_snr, res, pltDir_weight)
+    erms = _erms_model(log_snr, res, pltDir_weight)
+    model_m = _m_model(snr, log_snr, res, photo_z, True, True, pltDir_calib)
+    model_a = _a_model(snr, log_snr, res, photo_z, True, True, pltDir_calib)
+    return {
+        "sigma_e": sigmae,
+        "erms": erms,
+        "weight": 1.0 / (sigmae**2 + erms**2),
+        "m": model_m,
+        "c1": model_a * psf_e1,
+        "c2": model_a * psf_e2,
+    }
+
+
+def update_reGaus_calibration_parallel(
+    catalog,
+    n_proc=None,
+    chunk_size=200000,
+    use_process=False,
+    pltDir_weight="./plot/optimize_weight/",
+    pltDir_calib="./plot/reGausCalib/",
+):
+    """Updates the columns derived from calibration (same as
+    `update_reGaus_calibration`) in parallel over row blocks. Each worker
+    gets the rows of a block (views for a thread pool, copies for a process
+    pool) and computes the inputs shared by the models (SNR, resolution,
+    photo-z, PSF ellipticity) once for the block. At most 2*n_proc blocks are
+    in flight, and the outputs are written to the catalog in place as the
+    blocks complete.
 
-    def _calDistanceAngle(a1, d1):
-        """Returns the angular distance on sphere
-        a1 (ndarray): ra of galaxies
-        d1 (ndarray): dec of galaxies
+    Args:
+        catalog (ndarray):      input catalog
+        n_proc (int):           number of workers [default: os.cpu_count()]
+        chunk_size (int):       number of rows per block
+        use_process (bool):     whether to use a process pool instead of a
+                                thread pool
+        pltDir_weight (str):    directory of the sigma_e and e_rms tables
+        pltDir_calib (str):     directory of the m and a tables
+    Returns:
+        catalog (ndarray):      catalog with updated columns
+    """
+    if use_process:
+        Executor = concurrent.futures.ProcessPoolExecutor
+    else:
+        Executor = concurrent.futures.ThreadPoolExecutor
+    if use_process:
+        # relative table paths should not depend on the working directory of
+        # the workers
+        pltDir_weight = os.path.abspath(pltDir_weight) + os.sep
+        pltDir_calib = os.path.abspath(pltDir_calib) + os.sep
+    if n_proc is None:
+        n_proc = os.cpu_count() or 1
+    max_pending = 2 * n_proc
+
+    def _write(done):
+        for future in done:
+            start, nrow = pending.pop(future)
+            out = future.result()
+            for key, colname in _reGaus_calibration_columns.items():
+                catalog[colname][start : start + nrow] = out[key]
+        return
+
+    pending = {}
+    with Executor(max_workers=n_proc) as executor:
+        for start, chunk in _iter_row_chunks(catalog, chunk_size):
+            if len(pending) >= max_pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                _write(done)
+            future = executor.submit(
+                _calibrate_reGaus_block, chunk, pltDir_weight, pltDir_calib
+            )
+            pending[future] = (start, len(chunk))
+        _write(list(pending))
+    return catalog
+
+
+class SkyRegion(object):
+    """Base class of the regions used by `SkyMask`. A region implements the
+    exact test `contains(ra, dec)` and the classification of the HEALPix
+    pixels (NEST ordering) into pixels fully outside (0), fully inside (1) or
+    on the boundary (2) of the region.
+    """
+
+    def contains(self, ra, dec):
+        """Returns whether the positions are in the region (exact test)"""
+        raise NotImplementedError
+
+    def pixel_status(self, nside, ra_c, dec_c, margin):
+        """Returns the status of all pixels
+
+        Args:
+            nside (int):        nside of the pixels
+            ra_c (ndarray):     ra of the pixel centers [deg]
+            dec_c (ndarray):    dec of the pixel centers [deg]
+            margin (float):     maximum distance between the center and any
+                                point of a pixel [deg]
+        Returns:
+            status (ndarray):   0 (outside), 1 (inside) or 2 (boundary)
+        """
+        raise NotImplementedError
+
+
+def _pixel_status(inside, outside):
+    """Returns the pixel status from the inside and outside flags"""
+    status = np.full(len(inside), 2, dtype=np.int8)
+    status[inside] = 1
+    status[outside] = 0
+    return status
+
+
+def _ra_margin(dec_c, margin):
+    """Returns the margin in ra [deg] at the pixel centers; pixels close to the
+    poles get a margin covering all ra
+    """
+    dec_max = np.minimum(np.abs(dec_c) + margin, 90.0)
+    cosd = np.cos(np.deg2rad(dec_max))
+    return np.where(cosd > margin / 360.0, margin / np.maximum(cosd, 1e-12), 360.0)
+
+
+class CapRegion(SkyRegion):
+    """Spherical cap: positions within an angular distance from a center.
+    Positions with undefined distance (e.g. NaN) are counted inside, so that
+    they are removed when the cap is excluded.
+
+    Args:
+        ra (float):         ra of the center [deg]
+        dec (float):        dec of the center [deg]
+        radius (float):     radius of the cap [deg]
+        closed (bool):      whether the edge (distance == radius) is inside
+    """
+
+    def __init__(self, ra, dec, radius, closed=True):
+        self.ra = ra
+        self.dec = dec
+        self.radius = radius
+        self.closed = closed
+        return
+
+    def distance(self, a1, d1):
+        """Returns the angular distance on sphere [deg]
+
+        Args:
+            a1 (ndarray):   ra of galaxies
+            d1 (ndarray):   dec of galaxies
         """
-        a2 = 130.43
-        d2 = -1.02
         a1_f64 = np.array(a1, dtype=np.float64) * np.pi / 180.0
         d1_f64 = np.array(d1, dtype=np.float64) * np.pi / 180.0
-        a2_f64 = np.array(a2, dtype=np.float64) * np.pi / 180.0
-        d2_f64 = np.array(d2, dtype=np.float64) * np.pi / 180.0
+        a2_f64 = np.array(self.ra, dtype=np.float64) * np.pi / 180.0
+        d2_f64 = np.array(self.dec, dtype=np.float64) * np.pi / 180.0
         return (
             np.arccos(
                 np.cos(d1_f64) * np.cos(d2_f64) * np.cos(a1_f64 - a2_f64)
@@ -2170,9 +4511,269 @@ def get_mask_visit_104994(data):
             * 180.0
         )
 
-    d = _calDistanceAngle(ra, dec)
-    mask = (ra > 130.5) & (ra < 131.5) & (dec < -1.5)
-    return (d > 0.80) & (~mask)
+    def contains(self, ra, dec):
+        d = self.distance(ra, dec)
+        if self.closed:
+            return ~(d > self.radius)
+        else:
+            return ~(d >= self.radius)
+
+    def pixel_status(self, nside, ra_c, dec_c, margin):
+        d = self.distance(ra_c, dec_c)
+        return _pixel_status(d < self.radius - margin, d > self.radius + margin)
+
+
+class BoxRegion(SkyRegion):
+    """Box in (ra, dec). The ra values are compared as they are (e.g. the
+    VVDS box extends to ra=363.5 but objects have ra < 360), so pixels near
+    ra=0 (360) are always refined exactly.
+
+    Args:
+        ramin, ramax (float):   ra range [deg]
+        decmin, decmax (float): dec range [deg], can be -np.inf or np.inf
+        closed (tuple):         whether the (ramin, ramax, decmin, decmax)
+                                edges are inside [default: all open]
+    """
+
+    def __init__(
+        self, ramin, ramax, decmin, decmax, closed=(False, False, False, False)
+    ):
+        self.ramin = ramin
+        self.ramax = ramax
+        self.decmin = decmin
+        self.decmax = decmax
+        self.closed = tuple(closed)
+        return
+
+    def contains(self, ra, dec):
+        c0, c1, c2, c3 = self.closed
+        mask = (ra >= self.ramin) if c0 else (ra > self.ramin)
+        mask &= (ra <= self.ramax) if c1 else (ra < self.ramax)
+        mask &= (dec >= self.decmin) if c2 else (dec > self.decmin)
+        mask &= (dec <= self.decmax) if c3 else (dec < self.decmax)
+        return mask
+
+    def pixel_status(self, nside, ra_c, dec_c, margin):
+        mra = _ra_margin(dec_c, margin)
+        wrap = (ra_c < mra) | (ra_c > 360.0 - mra)
+        inside = (
+            (ra_c > self.ramin + mra)
+            & (ra_c < self.ramax - mra)
+            & (dec_c > self.decmin + margin)
+            & (dec_c < self.decmax - margin)
+        )
+        outside = (
+            (ra_c < self.ramin - mra)
+            | (ra_c > self.ramax + mra)
+            | (dec_c < self.decmin - margin)
+            | (dec_c > self.decmax + margin)
+        )
+        return _pixel_status(inside & ~wrap, outside & ~wrap)
+
+
+class PolygonRegion(SkyRegion):
+    """Polygon with straight edges in the (ra, dec) plane, e.g. survey region
+    files with lists of vertices (the ra values are compared as they are).
+
+    Args:
+        vertices (ndarray):     (ra, dec) of the vertices [deg], shape (n, 2)
+    """
+
+    def __init__(self, vertices):
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        assert self.vertices.ndim == 2 and self.vertices.shape[1] == 2
+        return
+
+    def _edges(self):
+        x0, y0 = self.vertices.T
+        x1 = np.roll(x0, -1)
+        y1 = np.roll(y0, -1)
+        return zip(x0, y0, x1, y1)
+
+    def contains(self, ra, dec):
+        # even-odd rule with horizontal rays
+        x = np.asarray(ra, dtype=np.float64)
+        y = np.asarray(dec, dtype=np.float64)
+        inside = np.zeros(x.shape, dtype=bool)
+        for x0, y0, x1, y1 in self._edges():
+            if y0 == y1:
+                continue
+            cross = (y0 > y) != (y1 > y)
+            xint = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= cross & (x < xint)
+        return inside
+
+    def pixel_status(self, nside, ra_c, dec_c, margin):
+        mra = _ra_margin(dec_c, margin)
+        near = (ra_c < mra) | (ra_c > 360.0 - mra)
+        # distance to the edges in units of the (ra, dec) margins; the pixel is
+        # within the normalized distance sqrt(2) of its center
+        for x0, y0, x1, y1 in self._edges():
+            ax = (x0 - ra_c) / mra
+            ay = (y0 - dec_c) / margin
+            bx = (x1 - ra_c) / mra
+            by = (y1 - dec_c) / margin
+            dx = bx - ax
+            dy = by - ay
+            ll = dx * dx + dy * dy
+            t = -(ax * dx + ay * dy) / np.where(ll > 0, ll, 1.0)
+            t = np.clip(t, 0.0, 1.0)
+            px = ax + t * dx
+            py = ay + t * dy
+            near |= px * px + py * py < 2.0
+        inside = self.contains(ra_c, dec_c)
+        return _pixel_status(inside & ~near, ~inside & ~near)
+
+
+class HealpixRegion(SkyRegion):
+    """Region defined by a boolean HEALPix map (NEST ordering)
+
+    Args:
+        m (ndarray | str):  boolean map, or the file name of the map (read
+                            through `footprint_cache`)
+    """
+
+    def __init__(self, m):
+        if isinstance(m, str):
+            m = footprint_cache.get(m)
+        self.m = np.asarray(m, dtype=bool)
+        self.nside = hp.npix2nside(len(self.m))
+        return
+
+    def contains(self, ra, dec):
+        return get_healpix_flag(
+            np.asarray(ra, dtype=np.float64), np.asarray(dec, dtype=np.float64), self.m
+        )
+
+    def pixel_status(self, nside, ra_c, dec_c, margin):
+        if self.nside <= nside:
+            # children of a NEST pixel are contiguous
+            mm = np.repeat(self.m, (nside // self.nside) ** 2)
+            return _pixel_status(mm, ~mm)
+        mm = self.m.reshape(12 * nside * nside, -1)
+        return _pixel_status(np.all(mm, axis=1), ~np.any(mm, axis=1))
+
+
+class SkyMask(object):
+    """Geometric mask: positions inside all the `include` regions (all
+    positions if there is none) and outside all the `exclude` regions.
+
+    The mask is compiled once into a full-sky HEALPix lookup (NEST ordering)
+    whose pixels are fully masked, fully unmasked, or on a boundary. A set of
+    positions is classified with one `ang2pix` and a gather; only the
+    positions in boundary pixels (and the ones with non-finite coordinates)
+    go through the exact tests of the regions.
+
+    Args:
+        include (list):     regions (SkyRegion) to include
+        exclude (list):     regions (SkyRegion) to exclude
+        nside (int):        nside of the lookup
+    """
+
+    def __init__(self, include=(), exclude=(), nside=256):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.nside = nside
+        self._status = None
+        return
+
+    def compile(self):
+        """Computes (once) the pixel status of the mask
+
+        Returns:
+            status (ndarray):   0 (masked), 1 (unmasked) or 2 (boundary)
+        """
+        if self._status is not None:
+            return self._status
+        npix = hp.nside2npix(self.nside)
+        ra_c, dec_c = hp.pix2ang(self.nside, np.arange(npix), nest=True, lonlat=True)
+        # slightly enlarged for rounding
+        margin = hp.max_pixrad(self.nside, degrees=True) * 1.01
+        true = np.ones(npix, dtype=bool)
+        false = np.zeros(npix, dtype=bool)
+        for region in self.include:
+            st = region.pixel_status(self.nside, ra_c, dec_c, margin)
+            true &= st == 1
+            false |= st == 0
+        for region in self.exclude:
+            st = region.pixel_status(self.nside, ra_c, dec_c, margin)
+            true &= st == 0
+            false |= st == 1
+        self._status = _pixel_status(true & ~false, false)
+        return self._status
+
+    def exact(self, ra, dec):
+        """Returns the mask from the exact tests of all the regions"""
+        mask = np.ones(np.shape(ra), dtype=bool)
+        for region in self.include:
+            mask &= region.contains(ra, dec)
+        for region in self.exclude:
+            mask &= ~region.contains(ra, dec)
+        return mask
+
+    def __call__(self, ra, dec):
+        """Returns the mask of positions
+
+        Args:
+            ra (ndarray):       ra [deg]
+            dec (ndarray):      dec [deg]
+        Returns:
+            mask (ndarray):     True for positions passing the mask
+        """
+        status = self.compile()
+        ra = np.asarray(ra)
+        dec = np.asarray(dec)
+        good = np.isfinite(ra) & np.isfinite(dec)
+        st = np.full(len(ra), 2, dtype=np.int8)
+        st[good] = status[
+            hp.ang2pix(
+                self.nside,
+                ra[good].astype(np.float64),
+                dec[good].astype(np.float64),
+                nest=True,
+                lonlat=True,
+            )
+        ]
+        mask = st == 1
+        ind = np.where(st == 2)[0]
+        if len(ind) > 0:
+            mask[ind] = self.exact(ra[ind], dec[ind])
+        return mask
+
+    def apply(self, data):
+        """Returns the mask of a catalog (positions from `get_radec`, which
+        also reads the 'ra_mock' and 'dec_mock' columns of mocks)
+        """
+        ra, dec = get_radec(data)
+        return self(ra, dec)
+
+
+"""visit_104994_mask: region affected by the tracking errors of visit 104994"""
+visit_104994_mask = SkyMask(
+    exclude=[
+        CapRegion(130.43, -1.02, 0.80, closed=True),
+        BoxRegion(130.5, 131.5, -np.inf, -1.5),
+    ]
+)
+
+"""G09_good_seeing_mask: good-seeing region with large high order PSF shape
+residuals in GAMA09H"""
+G09_good_seeing_mask = SkyMask(
+    exclude=[BoxRegion(132.5, 140.0, 1.6, 5.2, closed=(True, True, True, False))]
+)
+
+
+@uses_columns(requires=("get_radec",))
+def get_mask_visit_104994(data):
+    """We found that visit 104994 has tracking errors, but that visit contributes
+    to coadds, we remove this region from the catalog level
+
+    Args:
+        data (ndarray): input catalog
+    Returns:
+        mask (ndarray): mask removing the problematic region
+    """
+    return visit_104994_mask.apply(data)
 
 
 def del_colnull(data):
@@ -2225,6 +4826,9 @@ def get_sel_bias(weight, magA10, res):
     return m_sel, a_sel, m_err, a_err
 
 
+@uses_columns(
+    ("forced_r_cmodel_mag", "a_r"), requires=("get_abs_ellip", "get_sdss_size")
+)
 def get_binarystar_flags(data):
     """Returns the flags for binary stars (|e|>0.8 & logR<1.8-0.1r)
 
@@ -2245,6 +4849,17 @@ def get_binarystar_flags(data):
     return mask
 
 
+"""field_boxes: (ramin, ramax, decmin, decmax) of the S19A fields [open boxes]"""
+field_boxes = {
+    "XMM": (29.0, 39.5, -6.40, -1.19),
+    "GAMA09H": (128.0, 153.50, -1.90, 4.71),
+    "WIDE12H": (153.50, 200.0, -1.68, 4.71),
+    "GAMA15H": (206.0, 226.0, -1.72, 1.31),
+    "VVDS": (330.0, 363.5, -1.01, 5.82),
+    "HECTOMAP": (212.0, 250.5, 42.21, 44.40),
+}
+
+
 def get_flag_infield_s19a(ra, dec, fieldname):
     """Returns the flags for each field
 
@@ -2255,42 +4870,165 @@ def get_flag_infield_s19a(ra, dec, fieldname):
     Returns:
         mask(ndarray):  a boolean mask
     """
-    if fieldname == "XMM":
-        ramin = 29.0
-        ramax = 39.5
-        decmin = -6.40
-        decmax = -1.19
-    elif fieldname == "HECTOMAP":
-        ramin = 212.0
-        ramax = 250.5
-        decmin = 42.21
-        decmax = 44.40
-    elif fieldname == "GAMA09H":
-        ramin = 128
-        ramax = 153.50
-        decmin = -1.90
-        decmax = 4.71
-    elif fieldname == "WIDE12H":
-        ramin = 153.50
-        ramax = 200.0
-        decmin = -1.68
-        decmax = 4.71
-    elif fieldname == "GAMA15H":
-        ramin = 206
-        ramax = 226.0
-        decmin = -1.72
-        decmax = 1.31
-    elif fieldname == "VVDS":
-        ramin = 330.0
-        ramax = 363.5
-        decmin = -1.01
-        decmax = 5.82
-    else:
+    if fieldname not in field_boxes:
         raise ValueError("input field name incorrect")
+    ramin, ramax, decmin, decmax = field_boxes[fieldname]
     mask = (ra > ramin) & (ra < ramax) & (dec > decmin) & (dec < decmax)
     return mask
 
 
+def get_field_separation(field1, field2):
+    """Returns a lower bound of the angular separation between two S19A fields
+    (the boxes in `field_boxes`); adjacent fields (e.g. GAMA09H and WIDE12H)
+    have zero separation
+
+    Args:
+        field1 (str):   name of the first field
+        field2 (str):   name of the second field
+    Returns:
+        sep (float):    lower bound of the separation [deg]
+    """
+    for fieldname in (field1, field2):
+        if fieldname not in field_boxes:
+            raise ValueError("input field name incorrect")
+    ra0a, ra1a, dec0a, dec1a = field_boxes[field1]
+    ra0b, ra1b, dec0b, dec1b = field_boxes[field2]
+    # gap in ra on the circle (zero if the ra ranges overlap or touch)
+    if (ra0b - ra0a) % 360.0 <= ra1a - ra0a or (ra0a - ra0b) % 360.0 <= ra1b - ra0b:
+        dra = 0.0
+    else:
+        dra = min((ra0b - ra1a) % 360.0, (ra0a - ra1b) % 360.0)
+    ddec = max(0.0, dec0b - dec1a, dec0a - dec1b)
+    # hav(sep) >= hav(ddec) + cos(dec1) cos(dec2) hav(dra)
+    cosmin = np.cos(np.deg2rad(max(abs(dec0a), abs(dec1a), abs(dec0b), abs(dec1b))))
+    hav = (
+        np.sin(np.deg2rad(ddec) / 2.0) ** 2.0
+        + cosmin**2.0 * np.sin(np.deg2rad(dra) / 2.0) ** 2.0
+    )
+    return np.rad2deg(2.0 * np.arcsin(np.sqrt(min(hav, 1.0))))
+
+
+def get_field_groups(fieldnames, max_sep):
+    """Groups the fields linked by separations (see `get_field_separation`)
+    not larger than max_sep, so that fields in different groups are separated
+    by more than max_sep
+
+    Args:
+        fieldnames (list):  field names
+        max_sep (float):    maximum separation [deg]
+    Returns:
+        groups (list):      lists of field names (in the input order)
+    """
+    fieldnames = list(fieldnames)
+    groups = []
+    for fieldname in fieldnames:
+        linked = [
+            group
+            for group in groups
+            if any(get_field_separation(fieldname, ff) <= max_sep for ff in group)
+        ]
+        merged = [ff for group in linked for ff in group] + [fieldname]
+        groups = [group for group in groups if group not in linked]
+        groups.append(sorted(merged, key=fieldnames.index))
+    groups.sort(key=lambda group: fieldnames.index(group[0]))
+    return groups
+
+
+"""field_ra_cell: width of the ra cells in the lookup of field codes [deg]"""
+field_ra_cell = 0.25
+
+
+@functools.lru_cache(maxsize=None)
+def _field_ra_lookup():
+    """Returns the lookup table from ra cells to field codes. The sorted ra
+    edges of the fields divide ra into segments; cells in a segment covered by
+    one field get its code, cells in a segment not covered by any field get
+    -2, and cells touching an edge or in a segment covered by several fields
+    (GAMA15H and HECTOMAP) get -1
+    """
+    # indexed by the field codes (the order of field_names)
+    boxes = np.array([field_boxes[ff] for ff in field_names])
+    edges = np.unique(boxes[:, :2])
+    mids = 0.5 * (edges[1:] + edges[:-1])
+    cover = (mids[None, :] > boxes[:, 0:1]) & (mids[None, :] < boxes[:, 1:2])
+    seg_code = np.full(len(edges) + 1, -2, dtype=np.int8)
+    ncover = cover.sum(axis=0)
+    seg_code[1:-1][ncover == 1] = np.argmax(cover, axis=0)[ncover == 1]
+    seg_code[1:-1][ncover > 1] = -1
+    ncell = int(np.ceil(360.0 / field_ra_cell))
+    lo = np.arange(ncell) * field_ra_cell
+    hi = lo + field_ra_cell
+    # cells touching an edge (with a small margin for rounding)
+    eps = 1e-3 * field_ra_cell
+    ilo = np.searchsorted(edges, lo - eps, side="left")
+    touch = ilo != np.searchsorted(edges, hi + eps, side="right")
+    lookup = seg_code[ilo]
+    lookup[touch] = -1
+    return lookup
+
+
+def get_field_code(ra, dec):
+    """Classifies objects into the S19A fields in one pass over the catalog;
+    the field code is the index of the field in `field_names`. The candidate
+    field of each object is read from a lookup table over ra (built from the
+    sorted ra edges of the fields), and the result is the same as the (open
+    box) test of `get_flag_infield_s19a`.
+
+    Args:
+        ra (ndarray):       ra [deg]
+        dec (ndarray):      dec [deg]
+    Returns:
+        code (ndarray):     field codes [-1 for objects outside all fields]
+    """
+    ra = np.asarray(ra)
+    dec = np.asarray(dec)
+    lookup = _field_ra_lookup()
+    icell = np.floor(ra / field_ra_cell)
+    good = (icell >= 0) & (icell < len(lookup))
+    code = np.full(len(ra), -1, dtype=np.int8)
+    code[good] = lookup[icell[good].astype(np.int64)]
+    # objects close to an edge, in the ra range of several fields, or outside
+    # 0 <= ra < 360 (and NaN)
+    ind = np.where(code == -1)[0]
+    code[code == -2] = -1
+    # dec test for the candidates; the bounds are compared in the precision
+    # of the inputs, and the last row (NaN) is used for code -1
+    bounds = np.vstack([[field_boxes[ff] for ff in field_names], np.full(4, np.nan)])
+    decmin = bounds[:, 2].astype(dec.dtype)
+    decmax = bounds[:, 3].astype(dec.dtype)
+    code[~((dec > decmin[code]) & (dec < decmax[code]))] = -1
+    # exact test of get_flag_infield_s19a for the others
+    rr = ra[ind]
+    dd = dec[ind]
+    for i, fieldname in enumerate(field_names):
+        ramin, ramax, decmin, decmax = field_boxes[fieldname]
+        msk = (rr > ramin) & (rr < ramax) & (dd > decmin) & (dd < decmax)
+        code[ind[msk]] = i
+    return code
+
+
+def get_field_partition(code):
+    """Stable partition of a catalog by field code
+
+    Args:
+        code (ndarray):     field codes from `get_field_code`
+    Returns:
+        order (ndarray):    index array grouping the objects by field (the
+                            order within each field is kept); objects outside
+                            all fields go to the beginning
+        ranges (dict):      (start, stop) of each field in `order`
+    """
+    nfield = len(field_names)
+    order = np.argsort(code, kind="stable")
+    counts = np.bincount(np.asarray(code, dtype=np.int64) + 1, minlength=nfield + 1)
+    offsets = np.cumsum(counts)
+    ranges = {}
+    for i, fieldname in enumerate(field_names):
+        ranges[fieldname] = (int(offsets[i]), int(offsets[i + 1]))
+    return order, ranges
+
+
+@uses_columns(requires=("get_radec",))
 def get_mask_G09_good_seeing(data):
     """Gets the mask for the good-seeing region with large high order PSF shape
     residuals
@@ -2300,12 +5038,13 @@ def get_mask_G09_good_seeing(data):
     Returns:
         mm (ndarray):       mask array [if False, in the good-seeing region]
     """
-    (ra, dec) = get_radec(data)
-    mm = (ra >= 132.5) & (ra <= 140.0) & (dec >= 1.6) & (dec < 5.2)
-    mm = ~mm
-    return mm
+    return G09_good_seeing_mask.apply(data)
 
 
+@_cached_on_view
+@uses_columns(
+    ("i_hsmshaperegauss_derived_weight",), ("ishape_hsm_regauss_derived_shape_weight",)
+)
 def get_shape_weight_regauss(catalog):
     """This utility returns the i-band reGauss shape weight"""
     if "i_hsmshaperegauss_derived_weight" in catalog.dtype.names:  # s19
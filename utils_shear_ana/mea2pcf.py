@@ -15,6 +15,7 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 # python lib
+import os
 import treecorr
 from . import catutil
 from . import datvutil
@@ -23,11 +24,30 @@ from scipy.interpolate import interp1d
 
 """nthetaDF (int): default number of angular bins"""
 nthetaDF = 17
+"""correlation_presets (dict): binning of the correlation classes"""
+correlation_presets = {
+    # default
+    "DF": {
+        "nbins": nthetaDF,
+        "min_sep": 2.188,
+        "max_sep": 332.954,
+        "sep_units": "arcmin",
+    },
+    # PSF tests
+    "P": {"nbins": 30, "min_sep": 0.25, "max_sep": 360.0, "sep_units": "arcmin"},
+}
+# B-mode tests: 360 bins from 0.21 to 420 arcmin, with the edges on the 14
+# times finer log grid of 'DF', so that they can be rebinned exactly to 'DF'
+_dlogr = np.log(332.954 / 2.188) / nthetaDF / 14.0
+correlation_presets["B360"] = {
+    "nbins": 360,
+    "min_sep": float(2.188 * np.exp(-111 * _dlogr)),
+    "max_sep": float(2.188 * np.exp(249 * _dlogr)),
+    "sep_units": "arcmin",
+}
 # corDF =   treecorr.GGCorrelation(nbins=nthetaDF,min_sep=0.25,max_sep=360.,sep_units='arcmin') # old one
 """corDF: defult correlation class"""
-corDF = treecorr.GGCorrelation(
-    nbins=nthetaDF, min_sep=2.188, max_sep=332.954, sep_units="arcmin"
-)
+corDF = treecorr.GGCorrelation(**correlation_presets["DF"])
 """rnomDF (ndarray): default angular bins"""
 rnomDF = corDF.rnom
 rminP = 7.13
@@ -40,15 +60,85 @@ mskp = (rnomDF > rminP) & (rnomDF < rmaxP)
 mskm = (rnomDF > rminM) & (rnomDF < rmaxM)
 
 """corP: correlation for PSF tests"""
-corP = treecorr.GGCorrelation(nbins=30, min_sep=0.25, max_sep=360.0, sep_units="arcmin")
+corP = treecorr.GGCorrelation(**correlation_presets["P"])
 """mskSys (ndarray): scale cut used for systematic tests"""
 mskSys = (rnomDF > 2.0) & (rnomDF < 300.0)
 """rnomSys (ndarray): angular bins for systematic tests"""
 rnomSys = rnomDF[mskSys]
 """corB360: correlation for B-mode tests"""
-corB360 = treecorr.GGCorrelation(
-    nbins=360, min_sep=0.21, max_sep=420.0, sep_units="arcmin"
-)
+corB360 = treecorr.GGCorrelation(**correlation_presets["B360"])
+
+
+class CorrelationEngine(object):
+    """Measures shear-shear correlations with a fixed binning. Each
+    measurement returns a new treecorr.GGCorrelation, so that one engine can
+    be shared by threads (or pickled to processes) without racing on a global
+    correlation object such as `corDF`.
+
+    Args:
+        preset (str | dict):    name of the binning in `correlation_presets`
+                                ('DF', 'P' or 'B360'), or the configuration of
+                                treecorr.GGCorrelation
+        num_threads (int):      number of threads used by each measurement
+                                [default: None, all the cores]
+    """
+
+    def __init__(self, preset="DF", num_threads=None):
+        if isinstance(preset, str):
+            if preset not in correlation_presets:
+                raise ValueError("Unknown correlation preset: %s" % preset)
+            preset = correlation_presets[preset]
+        self.config = dict(preset)
+        self.num_threads = num_threads
+        # for the binning (never processed)
+        self._template = treecorr.GGCorrelation(**self.config)
+        return
+
+    @property
+    def rnom(self):
+        """nominal centers of the angular bins"""
+        return self._template.rnom
+
+    @property
+    def logr(self):
+        """logarithm of the nominal centers of the angular bins"""
+        return self._template.logr
+
+    @property
+    def max_sep_deg(self):
+        """maximum separation [deg]"""
+        return np.rad2deg(self._template._max_sep)
+
+    def new(self):
+        """Returns an empty correlation with the binning of the engine"""
+        return treecorr.GGCorrelation(**self.config)
+
+    def process(self, cat1, cat2):
+        """Measures the correlation between two catalogs
+
+        Args:
+            cat1 (treecorr.Catalog):    the first catalog
+            cat2 (treecorr.Catalog):    the second catalog
+        Returns:
+            cor (treecorr.GGCorrelation):   correlation function
+        """
+        cor = self.new()
+        cor.process(cat1, cat2, num_threads=self.num_threads)
+        return cor
+
+    def process_pairs(self, pairs):
+        """Measures the correlations of a list of catalog pairs
+
+        Args:
+            pairs (list):       list of (cat1, cat2)
+        Returns:
+            cors (list):        correlation functions
+        """
+        return [self.process(cat1, cat2) for cat1, cat2 in pairs]
+
+
+"""engineDF: default correlation engine"""
+engineDF = CorrelationEngine("DF")
 
 
 class EBmode:
@@ -280,13 +370,18 @@ class EBmode:
         return rnom, xiE, xiB
 
 
-def measure_2pcf_mock(datIn, mbias, msel=0.0):
+@catutil.uses_columns(
+    ("noise1_int", "noise2_int", "noise1_mea", "noise2_mea"),
+    requires=(catutil.make_mock_catalog_inplace, "convert_mock2treecat"),
+)
+def measure_2pcf_mock(datIn, mbias, msel=0.0, engine=None):
     """Measures 2pcf from hsc mocks using treecorr
 
     Args:
         datIn (ndarray):    input mock catalog
         mbias (float):      average multiplicative bias (m+dm2)
         msel (float):       selection bias
+        engine (CorrelationEngine): correlation engine [default: engineDF]
         Returns:
         correlation function (treecorr object)
     """
@@ -295,21 +390,49 @@ def measure_2pcf_mock(datIn, mbias, msel=0.0):
     msk = (datIn["noise1_int"] ** 2.0 + datIn["noise2_int"] ** 2.0) < 10.0
     msk = msk & ((datIn["noise1_mea"] ** 2.0 + datIn["noise2_mea"] ** 2.0) < 10.0)
     datIn = datIn[msk]
+    if isinstance(datIn, catutil.CatalogView):
+        # copy the needed columns of the selected rows (e.g. from a column store)
+        datIn = datIn[catutil.required_columns(measure_2pcf_mock, datIn.dtype.names)]
 
     if not isinstance(mbias, (float, int)):
         raise TypeError("multiplicative shear estimation bias should be a float.")
     if not isinstance(msel, (float, int)):
         raise TypeError("multiplicative selection bias should be a float.")
 
-    datIn = catutil.make_mock_catalog(datIn, mbias=mbias, msel=msel)
+    # datIn is already a copy after the mask
+    datIn = catutil.make_mock_catalog_inplace(datIn, mbias=mbias, msel=msel)
 
     tree_cat = convert_mock2treecat(datIn, mbias, msel)
-    corDF.clear()
-    corDF.process(tree_cat, tree_cat)
-    return corDF.copy()
+    if engine is None:
+        engine = engineDF
+    return engine.process(tree_cat, tree_cat)
+
+
+def _make_treecat(g1, g2, ra, dec, weight, index=None):
+    """Makes the treecorr catalog, or the treecorr catalogs of the subsets in
+    index (dict of index arrays)
+    """
+    if index is not None:
+        return {
+            kk: _make_treecat(g1[ind], g2[ind], ra[ind], dec[ind], weight[ind])
+            for kk, ind in index.items()
+        }
+    tree_cat = treecorr.Catalog(
+        g1=g1,
+        g2=g2,
+        ra=ra,
+        dec=dec,
+        w=weight,
+        ra_units="deg",
+        dec_units="deg",
+    )
+    return tree_cat
 
 
-def convert_mock2treecat(datIn, mbias, msel=0.0, version="all"):
+@catutil.uses_columns(
+    ("ra_mock", "dec_mock", "weight"), requires=(catutil.get_shear_regauss_mock,)
+)
+def convert_mock2treecat(datIn, mbias, msel=0.0, version="all", index=None):
     """Converts HSC mock catalog to treecorr catalog
 
     Args:
@@ -317,24 +440,21 @@ def convert_mock2treecat(datIn, mbias, msel=0.0, version="all"):
         mbias (float):      average multiplicative bias (m+dm2)
         msel (float):       selection multiplicative bias [default=0]
         version (str):      the version of mock (all, shape or shear) [default="all"]
+        index (dict):       index arrays of subsets (e.g. fields); if given,
+                            returns a dict of treecorr catalogs of the subsets
+                            calibrated with the whole catalog [default: None]
         Returns:
         treecorr catalog
     """
     g1I, g2I = catutil.get_shear_regauss_mock(datIn, mbias, msel, version)
     # g2 is sign-flipped for convention reason (+x is west for treecorr)
-    tree_cat = treecorr.Catalog(
-        g1=g1I,
-        g2=-g2I,
-        ra=datIn["ra_mock"],
-        dec=datIn["dec_mock"],
-        w=datIn["weight"],
-        ra_units="deg",
-        dec_units="deg",
+    return _make_treecat(
+        g1I, -g2I, datIn["ra_mock"], datIn["dec_mock"], datIn["weight"], index
     )
-    return tree_cat
 
 
-def measure_2pcf_data(datIn, mbias, msel=0.0, asel=0.0):
+@catutil.uses_columns(requires=("convert_data2treecat",))
+def measure_2pcf_data(datIn, mbias, msel=0.0, asel=0.0, engine=None):
     """Measures 2pcf from HSC mocks (https://arxiv.org/pdf/1901.09488.pdf)
     using treecorr
 
@@ -343,6 +463,7 @@ def measure_2pcf_data(datIn, mbias, msel=0.0, asel=0.0):
         mbias (float):      average multiplicative bias (m+dm2)
         msel (float):       selection multiplicative bias
         asel (float):       selection additive bias
+        engine (CorrelationEngine): correlation engine [default: engineDF]
         Returns:
         correlation function (treecorr object)
     """
@@ -353,12 +474,19 @@ def measure_2pcf_data(datIn, mbias, msel=0.0, asel=0.0):
         raise TypeError("multiplicative selection bias should be a float.")
 
     tree_cat = convert_data2treecat(datIn, mbias, msel, asel)
-    corDF.clear()
-    corDF.process(tree_cat, tree_cat)
-    return corDF.copy()
+    if engine is None:
+        engine = engineDF
+    return engine.process(tree_cat, tree_cat)
 
 
-def convert_data2treecat(datIn, mbias, msel=0.0, asel=0.0):
+@catutil.uses_columns(
+    requires=(
+        catutil.get_shear_regauss,
+        catutil.get_radec,
+        catutil.get_shape_weight_regauss,
+    )
+)
+def convert_data2treecat(datIn, mbias, msel=0.0, asel=0.0, index=None):
     """Converts HSC catalog to treecorr catalog
 
     Args:
@@ -366,25 +494,457 @@ def convert_data2treecat(datIn, mbias, msel=0.0, asel=0.0):
         mbias (float):      average multiplicative bias (m+dm2)
         msel (float):       selection multiplicative bias
         asel (float):       selection additive bias
+        index (dict):       index arrays of subsets (e.g. fields); if given,
+                            returns a dict of treecorr catalogs of the subsets
+                            calibrated with the whole catalog [default: None]
         Returns:
         tree_cat:           treecorr catalog
     """
     g1I, g2I = catutil.get_shear_regauss(datIn, mbias, msel, asel)
     ra, dec = catutil.get_radec(datIn)
     weight = catutil.get_shape_weight_regauss(datIn)
-    tree_cat = treecorr.Catalog(
-        g1=g1I,
-        g2=-g2I,
-        ra=ra,
-        dec=dec,
-        w=weight,
-        ra_units="deg",
-        dec_units="deg",
+    return _make_treecat(g1I, -g2I, ra, dec, weight, index)
+
+
+def measure_tomographic_2pcf(
+    catalogs, biases, engine=None, outFname=None, overwrite=False, fields=None
+):
+    """Measures the 2pcf of all the pairs of redshift bins (i <= j). The
+    treecorr catalog of each redshift bin is built once and kept for all the
+    pairs using the bin, so that treecorr reuses its cached tree.
+
+    If fields is given, the correlations are measured in each field, and the
+    correlations over all the fields ("all") are the sums of the pair sums of
+    the fields (see `sum_correlations`) and of the pairs across the fields
+    closer than the maximum separation (e.g. GAMA09H and WIDE12H, see
+    `catutil.get_field_groups`); the shear of the fields is calibrated with the
+    whole redshift bin, as in a measurement over all the fields.
+
+    Args:
+        catalogs (list):        HSC catalogs of the redshift bins
+        biases (list):          (mbias, msel, asel) of each redshift bin
+        engine (CorrelationEngine): correlation engine [default: engineDF]
+        outFname (str):         output file name with the two bin numbers
+                                replaced by format, e.g. 'cor%d%d.fits'; a
+                                dict keyed by field name (and "all") if fields
+                                is given [default: None, not written]
+        overwrite (bool):       whether to measure the pairs whose outputs
+                                exist [default: False, read the outputs]
+        fields (list):          index arrays of the fields in each redshift
+                                bin (dict keyed by field name) [default: None]
+    Returns:
+        cors (dict):            correlation functions (treecorr.GGCorrelation)
+                                keyed by the pair of bins ('11', '12', ...);
+                                keyed by field name first if fields is given
+    """
+    nzs = len(catalogs)
+    assert len(biases) == nzs, "biases do not match the catalogs"
+
+    def _get_treecats(k):
+        mbias, msel, asel = biases[k]
+        if fields is None:
+            return {"all": convert_data2treecat(catalogs[k], mbias, msel, asel)}
+        return convert_data2treecat(catalogs[k], mbias, msel, asel, index=fields[k])
+
+    return _measure_tomographic_pairs(
+        nzs, _get_treecats, engine, outFname, overwrite, fields
     )
-    return tree_cat
+
+
+def check_field_groups(fieldnames, engine=None):
+    """Groups the fields whose pairs across fields are counted by the engine
+    (see `catutil.get_field_groups`); the fields in different groups are
+    separated by more than the maximum separation of the engine
+
+    Args:
+        fieldnames (list):      field names
+        engine (CorrelationEngine): correlation engine [default: engineDF]
+    Returns:
+        groups (list):          lists of field names
+    """
+    if engine is None:
+        engine = engineDF
+    return catutil.get_field_groups(fieldnames, engine.max_sep_deg)
+
+
+def _measure_tomographic_pairs(nzs, get_treecats, engine, outFname, overwrite, fields):
+    """Measures the correlations of all the pairs of redshift bins, building
+    the treecorr catalogs of each bin (dict keyed by field, with get_treecats)
+    once; the catalogs are kept until the last pair using them is measured
+    """
+    if engine is None:
+        engine = engineDF
+    cross = []
+    if fields is None:
+        fieldnames = ["all"]
+        outFname = {"all": outFname}
+    else:
+        assert len(fields) == nzs, "fields do not match the catalogs"
+        fieldnames = [ff for ff in fields[0].keys() if ff != "all"]
+        if outFname is None:
+            outFname = {}
+        # fields closer than the maximum separation have pairs across them,
+        # which are measured as cross correlations of the fields
+        for group in check_field_groups(fieldnames, engine):
+            for ia, fa in enumerate(group):
+                cross.extend([(fa, fb) for fb in group[ia + 1 :]])
+    cors = {ff: {} for ff in fieldnames + ["all"]}
+    todo = []
+    for i in range(nzs):
+        for j in range(i, nzs):
+            key = "%d%d" % (i + 1, j + 1)
+            for ff in cors.keys():
+                _ofname = outFname.get(ff, None)
+                if _ofname is not None and not overwrite:
+                    _ofname = _ofname % (i + 1, j + 1)
+                    if os.path.isfile(_ofname):
+                        cor = engine.new()
+                        cor.read(_ofname)
+                        cors[ff][key] = cor
+            if any(key not in cors[ff] for ff in fieldnames) or (
+                cross and key not in cors["all"]
+            ):
+                todo.append((i, j))
+
+    tree_cats = {}
+    cross_cors = {}
+    for n, (i, j) in enumerate(todo):
+        for k in (i, j):
+            if k not in tree_cats:
+                tree_cats[k] = get_treecats(k)
+        key = "%d%d" % (i + 1, j + 1)
+        for ff in fieldnames:
+            if key in cors[ff]:
+                continue
+            cor = engine.process(tree_cats[i][ff], tree_cats[j][ff])
+            if outFname.get(ff, None) is not None:
+                cor.write(outFname[ff] % (i + 1, j + 1))
+            cors[ff][key] = cor
+        if cross and key not in cors["all"]:
+            cross_cors[key] = []
+            for fa, fb in cross:
+                cor = engine.process(tree_cats[i][fa], tree_cats[j][fb])
+                cross_cors[key].append(cor)
+                if i != j:
+                    cor = engine.process(tree_cats[i][fb], tree_cats[j][fa])
+                # the auto correlation (i == j) counts the pairs in both
+                # orders, so the cross correlation of the fields counts twice
+                cross_cors[key].append(cor)
+        # release the catalogs not used by the remaining pairs
+        for k in list(tree_cats.keys()):
+            if all(k not in pair for pair in todo[n + 1 :]):
+                del tree_cats[k]
+    if fields is None:
+        return cors["all"]
+
+    # the correlations over all the fields are the sums of the correlations
+    # of the fields and of the cross correlations of the close fields
+    for i in range(nzs):
+        for j in range(i, nzs):
+            key = "%d%d" % (i + 1, j + 1)
+            if key in cors["all"]:
+                continue
+            cor = sum_correlations(
+                [cors[ff][key] for ff in fieldnames] + cross_cors.pop(key, [])
+            )
+            if outFname.get("all", None) is not None:
+                cor.write(outFname["all"] % (i + 1, j + 1))
+            cors["all"][key] = cor
+    return cors
+
+
+@catutil.uses_columns(requires=(measure_2pcf_mock,))
+def prepare_mock_treecat(datIn, mbias, msel=0.0, corr=1.0, workspace=None, index=None):
+    """Makes the mock shapes of an HSC mock catalog (with m=mbias, see
+    `catutil.make_mock_catalog_inplace`) and converts it to a treecorr catalog.
+    The mock ellipticities are written into the input catalog (or a copy of
+    the selected rows).
+
+    Args:
+        datIn (ndarray):    input mock catalog
+        mbias (float):      average multiplicative bias (m+dm2)
+        msel (float):       selection multiplicative bias
+        corr (float):       correction term for shell thickness
+        workspace (MockWorkspace):  scratch buffers [default: None]
+        index (dict):       index arrays of subsets (e.g. fields); if given,
+                            returns a dict of treecorr catalogs of the subsets
+                            calibrated with the whole catalog [default: None]
+    Returns:
+        tree_cat:           treecorr catalog
+    """
+    # a few galaxies with infinite |e| were found in the first version,
+    # so let me keep this msk here for safety
+    msk = (datIn["noise1_int"] ** 2.0 + datIn["noise2_int"] ** 2.0) < 10.0
+    msk = msk & ((datIn["noise1_mea"] ** 2.0 + datIn["noise2_mea"] ** 2.0) < 10.0)
+    if not np.all(msk):
+        datIn = datIn[msk]
+        if index is not None:
+            # index of the selected objects after the cut
+            inew = np.cumsum(msk) - 1
+            index = {kk: inew[ind[msk[ind]]] for kk, ind in index.items()}
+            del inew
+    del msk
+    if isinstance(datIn, catutil.CatalogView):
+        datIn = datIn[catutil.required_columns(prepare_mock_treecat, datIn.dtype.names)]
+    datIn = catutil.make_mock_catalog_inplace(
+        datIn, mbias=mbias, msel=msel, corr=corr, workspace=workspace
+    )
+    return convert_mock2treecat(datIn, mbias, msel, index=index)
+
+
+def measure_tomographic_2pcf_mock(
+    catalogs,
+    biases,
+    corrs=None,
+    engine=None,
+    outFname=None,
+    overwrite=False,
+    workspace=None,
+    fields=None,
+):
+    """Measures the 2pcf of all the pairs of redshift bins (i <= j) of a mock
+    realization. The mock shapes and the treecorr catalog of each redshift bin
+    are made once (see `prepare_mock_treecat`) and kept for all the pairs using
+    the bin.
+
+    If fields is given, the correlations are measured in each field and summed
+    to the correlations over all the fields (see `measure_tomographic_2pcf`).
+
+    Args:
+        catalogs (list):        HSC mock catalogs of the redshift bins
+        biases (list):          (mbias, msel) of each redshift bin
+        corrs (list):           correction for shell thickness of each
+                                redshift bin [default: None, no correction]
+        engine (CorrelationEngine): correlation engine [default: engineDF]
+        outFname (str):         output file name with the two bin numbers
+                                replaced by format, e.g. 'cor%d%d.fits'; a
+                                dict keyed by field name (and "all") if fields
+                                is given [default: None, not written]
+        overwrite (bool):       whether to measure the pairs whose outputs
+                                exist [default: False, read the outputs]
+        workspace (MockWorkspace):  scratch buffers [default: None]
+        fields (list):          index arrays of the fields in each redshift
+                                bin (dict keyed by field name) [default: None]
+    Returns:
+        cors (dict):            correlation functions (treecorr.GGCorrelation)
+                                keyed by the pair of bins ('11', '12', ...);
+                                keyed by field name first if fields is given
+    """
+    nzs = len(catalogs)
+    assert len(biases) == nzs, "biases do not match the catalogs"
+    if corrs is None:
+        corrs = [1.0] * nzs
+    if workspace is None:
+        workspace = catutil.MockWorkspace()
+
+    def _get_treecats(k):
+        mbias, msel = biases[k]
+        tree_cats = prepare_mock_treecat(
+            catalogs[k],
+            mbias,
+            msel,
+            corr=corrs[k],
+            workspace=workspace,
+            index=None if fields is None else fields[k],
+        )
+        if fields is None:
+            return {"all": tree_cats}
+        return tree_cats
+
+    return _measure_tomographic_pairs(
+        nzs, _get_treecats, engine, outFname, overwrite, fields
+    )
+
+
+def sum_correlations(cors):
+    """Combines shear-shear correlations with disjoint sets of pairs (e.g. the
+    correlations of fields separated by more than the maximum separation, and
+    the cross correlations of the closer fields) into the correlation of the
+    union by summing the pair sums (up to the bin_slop approximation of the
+    tree, which depends on the catalogs).
+
+    The summed quantities are xi*weight, weight, npairs, meanr*weight and
+    meanlogr*weight; the variance is sum(weight^2 * var) / sum(weight)^2.
+
+    Args:
+        cors (list):        correlations (treecorr.GGCorrelation) of the
+                            regions with the same binning
+    Returns:
+        cor (treecorr.GGCorrelation):   correlation of the union
+    """
+    cors = list(cors)
+    if len(cors) == 0:
+        raise ValueError("no correlation to sum")
+    out = cors[0].copy()
+    for cor in cors[1:]:
+        if not (
+            cor.nbins == out.nbins
+            and cor.min_sep == out.min_sep
+            and cor.max_sep == out.max_sep
+        ):
+            raise ValueError("the correlations do not have the same binning")
+    parts = [_get_pair_sums(cor) for cor in cors]
+    parts = {name: np.stack([pp[name] for pp in parts]) for name in parts[0]}
+    return _sum_pair_sums(out, parts)
+
+
+"""pair_sum_names (list): per-bin quantities combined by summing pair sums"""
+pair_sum_names = [
+    "xip",
+    "xim",
+    "xip_im",
+    "xim_im",
+    "varxip",
+    "varxim",
+    "meanr",
+    "meanlogr",
+    "weight",
+    "npairs",
+]
+
+
+def _get_pair_sums(cor):
+    """Returns the per-bin quantities (`pair_sum_names`) of a correlation
+    (treecorr.GGCorrelation or the ndarray of its output file)
+    """
+    if isinstance(cor, treecorr.GGCorrelation):
+        return {name: getattr(cor, name) for name in pair_sum_names}
+    if not isinstance(cor, np.ndarray):
+        raise TypeError("cor should be a GGCorrelation or an ndarray.")
+    out = {}
+    for name in pair_sum_names:
+        if name.startswith("var"):
+            out[name] = cor["sigma_" + name[3:]] ** 2.0
+        else:
+            out[name] = cor[name]
+    return out
+
+
+def _sum_pair_sums(out, parts):
+    """Fills the correlation out with the sums over the first axis of the
+    per-bin quantities in parts (dict of ndarray, see `pair_sum_names`)
+    """
+    weights = parts["weight"]
+    weight = np.sum(weights, axis=0)
+    msk = weight > 0
+    # empty bins are set to zero (nominal separation for meanr, meanlogr) as
+    # in treecorr
+    wnorm = np.where(msk, weight, 1.0)
+
+    def _sum_mean(name):
+        return np.sum(weights * parts[name], axis=0) / wnorm
+
+    out.weight[:] = weight
+    out.npairs[:] = np.sum(parts["npairs"], axis=0)
+    for name in ["xip", "xim", "xip_im", "xim_im"]:
+        getattr(out, name)[:] = _sum_mean(name)
+    out.meanr[:] = np.where(msk, _sum_mean("meanr"), out.rnom)
+    out.meanlogr[:] = np.where(msk, _sum_mean("meanlogr"), out.logr)
+    varxi = []
+    for name in ["varxip", "varxim"]:
+        varxi.append(np.sum(weights**2.0 * parts[name], axis=0) / wnorm**2.0)
+    out._varxi = varxi
+    out._cov = np.concatenate(varxi)
+    return out
+
+
+def sum_tomographic_2pcf(cors_fields):
+    """Sums the tomographic correlations of the fields (see
+    `sum_correlations`) into the correlations over all the fields
+
+    Args:
+        cors_fields (dict): correlations of each field, keyed by field name;
+                            each item is a dict keyed by the pair of bins
+                            (output of `measure_tomographic_2pcf[_mock]`)
+    Returns:
+        cors (dict):        correlations over all the fields keyed by the pair
+                            of bins
+    """
+    cors_fields = list(cors_fields.values())
+    cors = {}
+    for key in cors_fields[0]:
+        cors[key] = sum_correlations([cf[key] for cf in cors_fields])
+    return cors
+
+
+def rebin_correlation(cor, engine="DF", tol=1e-6):
+    """Rebins a correlation measured with a fine log binning (e.g. 'B360') to
+    a coarser log binning (e.g. 'DF') by summing the pair sums of the fine
+    bins in each coarse bin (see `sum_correlations`). Each coarse bin edge
+    should be an edge of the fine binning, and the coarse bin size should be
+    a multiple of the fine bin size.
+
+    With a tolerance larger than the round-off (e.g. for the correlations
+    measured with a binning not aligned to the coarse one), the fine bins are
+    summed into the nearest coarse bins, and the output has the binning of
+    the summed fine bins, which is not exactly the coarse binning.
+
+    Args:
+        cor (GGCorrelation):    correlation with the fine binning (or the
+                                ndarray read from its output file, with the
+                                same sep_units as the coarse binning)
+        engine (CorrelationEngine): correlation engine (or its preset) of the
+                                coarse binning [default: 'DF']
+        tol (float):            tolerance of the edge alignment in units of
+                                the fine bin size [default: 1e-6]
+    Returns:
+        cor (treecorr.GGCorrelation):   correlation with the coarse binning
+    """
+    if not isinstance(engine, CorrelationEngine):
+        engine = CorrelationEngine(engine)
+    out = engine.new()
+    if isinstance(cor, treecorr.GGCorrelation):
+        if cor.sep_units != out.sep_units:
+            raise ValueError("the correlations do not have the same sep_units")
+        logr = cor.logr
+        dfine = cor.bin_size
+    else:
+        logr = np.log(cor["r_nom"])
+        if len(logr) < 2:
+            raise ValueError("cannot get the binning from a single bin")
+        dfine = (logr[-1] - logr[0]) / (len(logr) - 1.0)
+    nfine = len(logr)
+    # log(r) of the first fine bin edge
+    edge0 = logr[0] - dfine / 2.0
+
+    # number of fine bins in a coarse bin, and the offset of the first coarse
+    # bin edge
+    nsub = out.bin_size / dfine
+    offset = (np.log(out.min_sep) - edge0) / dfine
+    dev = max(abs(nsub - np.round(nsub)), abs(offset - np.round(offset)))
+    if dev > tol:
+        raise ValueError("the coarse bin edges are not aligned with the fine bin edges")
+    nsub = int(np.round(nsub))
+    offset = int(np.round(offset))
+    nbins = out.nbins
+    if nsub < 1 or offset < 0 or offset + nbins * nsub > nfine:
+        raise ValueError("the coarse binning is not covered by the fine binning")
+    if dev > 1e-6:
+        # the binning of the summed fine bins
+        config = dict(engine.config)
+        config.pop("bin_size", None)
+        config["nbins"] = nbins
+        config["min_sep"] = np.exp(edge0 + offset * dfine)
+        config["max_sep"] = np.exp(edge0 + (offset + nbins * nsub) * dfine)
+        out = treecorr.GGCorrelation(**config)
+
+    parts = {}
+    for name, val in _get_pair_sums(cor).items():
+        val = np.asarray(val)[offset : offset + nbins * nsub]
+        parts[name] = val.reshape((nbins, nsub)).T
+    return _sum_pair_sums(out, parts)
 
 
 # ---PSF ----
+@catutil.uses_columns(
+    requires=(
+        catutil.get_radec,
+        catutil.get_psf_ellip,
+        catutil.get_sdss_ellip,
+        catutil.get_sdss_size,
+        (catutil.get_psf_size, "trace"),
+    )
+)
 def convert_star2treecat(scat, types="P"):
     """Converts star catalog to treecorr catalog
 
@@ -429,7 +989,7 @@ def convert_star2treecat(scat, types="P"):
     return tuple(treecat)
 
 
-def measure_rho_simple(catP, catQ):
+def measure_rho_simple(catP, catQ, engine=None):
     """
 
     Args:
@@ -437,27 +997,21 @@ def measure_rho_simple(catP, catQ):
                 tree catalog for star shape
         catQ (treecorr.Catalog):
                 tree catalog for star shape residual
+        engine (CorrelationEngine):
+                correlation engine [default: engineDF]
     Returns:
         pp,pq,qq (treecorr.Correlation):
                 three rho correlations of PSF
     """
-    # pp
-    corDF.clear()
-    corDF.process(catP, catP)
-    corpp = corDF.copy()
-    # pq
-    corDF.clear()
-    corDF.process(catP, catQ)
-    corpq = corDF.copy()
-    # qq
-    corDF.clear()
-    corDF.process(catQ, catQ)
-    corqq = corDF.copy()
-    corDF.clear()
+    if engine is None:
+        engine = engineDF
+    corpp, corpq, corqq = engine.process_pairs(
+        [(catP, catP), (catP, catQ), (catQ, catQ)]
+    )
     return corpp, corpq, corqq
 
 
-def measure_rho_all(catP, catQ, catR):
+def measure_rho_all(catP, catQ, catR, engine=None):
     """
 
     Args:
@@ -467,35 +1021,25 @@ def measure_rho_all(catP, catQ, catR):
                 tree catalog for star shape residual
         catR (treecorr.Catalog):
                 tree catalog for star size residual
+        engine (CorrelationEngine):
+                correlation engine [default: engineDF]
     Returns:
         pp,pq,pr,qq,qr,rr (treecorr.Correlation):
                 six rho correlations of PSF
     """
-    # pp
-    corDF.clear()
-    corDF.process(catP, catP)
-    corpp = corDF.copy()
-    # pq
-    corDF.clear()
-    corDF.process(catP, catQ)
-    corpq = corDF.copy()
-    # pr
-    corDF.clear()
-    corDF.process(catP, catR)
-    corpr = corDF.copy()
-    # qq
-    corDF.clear()
-    corDF.process(catQ, catQ)
-    corqq = corDF.copy()
-    # qr
-    corDF.clear()
-    corDF.process(catQ, catR)
-    corqr = corDF.copy()
-    # rr
-    corDF.clear()
-    corDF.process(catR, catR)
-    corrr = corDF.copy()
-    corDF.clear()
+    if engine is None:
+        engine = engineDF
+    cors = engine.process_pairs(
+        [
+            (catP, catP),
+            (catP, catQ),
+            (catP, catR),
+            (catQ, catQ),
+            (catQ, catR),
+            (catR, catR),
+        ]
+    )
+    corpp, corpq, corpr, corqq, corqr, corrr = cors
     return corpp, corpq, corpr, corqq, corqr, corrr
 
 
@@ -17,6 +17,9 @@
 # python lib
 import os
 import gc
+import json
+import logging
+import concurrent.futures
 import fitsio
 import numpy as np
 from . import catutil
@@ -50,14 +53,14 @@ def bin_catalog_inz(catFname):
             "S19ACatalogs/photoz_2pt/fiducial_dnnzbin_w95c027/source_sel_%s.fits"
             % fieldname,
         )
-        binarray = fitsio.read(pzsname)
-        assert np.all(binarray["object_id"] == data["object_id"])
+        # matched by object_id
+        dnnz_bin = _read_aligned_column(_tmpnm, pzsname, "dnnz_bin")
         for iz in range(nzs):
-            _msk = binarray["dnnz_bin"] == (iz + 1)
+            _msk = dnnz_bin == (iz + 1)
             # add field to list
             dataG[iz].append(data[_msk])
             del _msk
-        del binarray, data
+        del dnnz_bin, data
         gc.collect()
     dataG = [np.hstack(dataG[i]) for i in range(nzs)]
     return dataG
@@ -71,35 +74,12 @@ def bin_catalog_inz2(catFname, outFname, zbin):
         catFname (str):     catalog name divided into fields [replace field name with %]
         outFname (str):     file name for outcome
         zbin (int):         bin number
+
+    Note:
+        use `split_catalog_inz` to write all the redshift bins in one pass
     """
     assert zbin in [1, 2, 3, 4], "zbin should be either 1,2,3 or 4"
-    assert "%" in catFname
-    wrkDir = os.environ["homeWrk"]
-    # catFname=   os.path.join(wrkDir,catFname)
-    # outFname=   os.path.join(wrkDir,outFname)
-    # 4 bins
-    dataG = []
-    for fieldname in catutil.field_names:
-        # mock catalog
-        _tmpnm = catFname % fieldname
-        assert os.path.isfile(_tmpnm)
-        data = fitsio.read(_tmpnm)
-        # selection using measured photo-z (not the true source photo-z)
-        pzsname = os.path.join(
-            wrkDir,
-            "S19ACatalogs/photoz_2pt/fiducial_dnnzbin_w95c027/source_sel_%s.fits"
-            % fieldname,
-        )
-        binarray = fitsio.read(pzsname)
-        assert np.all(binarray["object_id"] == data["object_id"])
-        _msk = binarray["dnnz_bin"] == zbin
-        del binarray
-        # add field to list
-        dataG.append(data[_msk])
-        del _msk, data
-        gc.collect()
-    dataO = np.hstack(dataG)
-    fitsio.write(outFname, dataO)
+    split_catalog_inz(catFname, outFname, zbins=[zbin])
     return
 
 
@@ -128,12 +108,704 @@ def bin_catalog_inz3x2pt(catFname, outFname):
             "cosmicShear/tpcf/from_sunao/cosmic-shear-meas-s19a/3x2pt/source_sel_dnnz_%s.fits"
             % fieldname,
         )
-        binarray = fitsio.read(pzsname)
-        assert np.all(binarray["object_id"] == data["object_id"])
+        # matched by object_id
+        z075 = _read_aligned_column(catFname % fieldname, pzsname, "z075")
         # add field to list
-        dataG.append(data[binarray["z075"]])
-        del data, binarray
+        dataG.append(data[z075])
+        del data, z075
         gc.collect()
     dataO = np.hstack(dataG)
     fitsio.write(outFname, dataO)
     return
+
+
+def _as_fname_list(fnames):
+    """Returns a list of file names"""
+    if isinstance(fnames, str):
+        return [fnames]
+    return list(fnames)
+
+
+def count_fits_rows(fnames, ext=1):
+    """Returns the total number of rows in (a list of) FITS tables
+
+    Args:
+        fnames (str | list):    FITS file name or a list of file names
+        ext (int):              extension of the table
+    Returns:
+        nrow (int):             total number of rows
+    """
+    nrow = 0
+    for fname in _as_fname_list(fnames):
+        with fitsio.FITS(fname) as fits:
+            nrow += fits[ext].get_nrows()
+    return nrow
+
+
+def get_fits_colnames(fnames, ext=1):
+    """Returns the column names of (the first of a list of) FITS tables"""
+    fname = _as_fname_list(fnames)[0]
+    with fitsio.FITS(fname) as fits:
+        names = tuple(fits[ext].get_colnames())
+    return names
+
+
+def get_fits_dtype(fnames, columns=None, ext=1):
+    """Returns the dtype of the rows of (the first of a list of) FITS tables
+
+    Args:
+        fnames (str | list):    FITS file name or a list of file names
+        columns (list):         columns to read [default: all]
+        ext (int):              extension of the table
+    Returns:
+        dtype (dtype):          dtype of the rows read by `iter_fits_chunks`
+    """
+    fname = _as_fname_list(fnames)[0]
+    with fitsio.FITS(fname) as fits:
+        hdu = fits[ext]
+        if columns is not None:
+            hdu = hdu[list(columns)]
+        dtype = hdu[0:0].dtype
+    return dtype
+
+
+def iter_fits_chunks(fnames, chunk_size=1000000, columns=None, ext=1):
+    """Reads (a list of) FITS tables in row chunks. The files are treated as
+    one catalog concatenated in the input order (e.g. the per-field catalogs
+    used by `bin_catalog_inz`), so that only one chunk is in memory at a time.
+
+    Args:
+        fnames (str | list):    FITS file name or a list of file names
+        chunk_size (int):       number of rows in a chunk
+        columns (list):         columns to read [default: all]
+        ext (int):              extension of the table
+    Yields:
+        start (int):            index of the first row of the chunk in the
+                                concatenated catalog
+        chunk (ndarray):        rows of the chunk
+    """
+    assert chunk_size > 0, "chunk_size should be positive"
+    offset = 0
+    for fname in _as_fname_list(fnames):
+        with fitsio.FITS(fname) as fits:
+            hdu = fits[ext]
+            nrow = hdu.get_nrows()
+            if columns is not None:
+                hdu = hdu[list(columns)]
+            for i0 in range(0, nrow, chunk_size):
+                i1 = min(i0 + chunk_size, nrow)
+                yield offset + i0, hdu[i0:i1]
+        offset += nrow
+
+
+def read_fits_required(fnames, funcs, columns=(), ext=1):
+    """Reads (a list of) FITS tables, loading only the columns needed by a list
+    of catalog accessors (declared with `catutil.uses_columns`, e.g.
+    `mea2pcf.convert_data2treecat`)
+
+    Args:
+        fnames (str | list):    FITS file name or a list of file names
+        funcs (list):           accessors [or a single accessor]
+        columns (list):         other columns to read
+        ext (int):              extension of the table
+    Returns:
+        data (ndarray):         catalog with the needed columns
+    """
+    fnames = _as_fname_list(fnames)
+    names = get_fits_colnames(fnames, ext)
+    cols = catutil.required_columns(funcs, names)
+    cols = cols + [col for col in columns if col not in cols]
+    assert len(cols) > 0, "no column is needed"
+    data = [fitsio.read(fname, ext=ext, columns=cols) for fname in fnames]
+    if len(data) == 1:
+        return data[0]
+    return np.hstack(data)
+
+
+def _native_dtype(dtype):
+    """Returns the dtype in the native byte order"""
+    return dtype.newbyteorder("=") if dtype.byteorder not in "=|" else dtype
+
+
+def write_column_store(
+    fnames, outDir, columns=None, chunk_size=1000000, meta=None, ext=1
+):
+    """Converts (a list of) FITS catalogs [or a structured array] to a column
+    store: a directory with one .npy file per column (in the native byte
+    order) and a JSON manifest with the schema and the metadata, which is read
+    by `catutil.ColumnStore` with memory maps. The input is converted in
+    chunks, and the manifest is written last, so an interrupted conversion is
+    not mistaken for a store.
+
+    Args:
+        fnames (str | list | ndarray):
+                                FITS file name or a list of file names
+                                (treated as one concatenated catalog), or a
+                                structured array
+        outDir (str):           directory of the store
+        columns (list):         columns to convert [default: all]
+        chunk_size (int):       number of rows in a chunk
+        meta (dict):            metadata to store in the manifest (should be
+                                JSON serializable)
+        ext (int):              extension of the tables
+    Returns:
+        store (ColumnStore):    the store
+    """
+    if isinstance(fnames, np.ndarray):
+        nrow = len(fnames)
+        dtype = fnames.dtype
+        data = fnames
+
+        def _chunks():
+            for i0 in range(0, nrow, chunk_size):
+                yield i0, data[i0 : i0 + chunk_size]
+
+        sources = []
+    else:
+        fnames = _as_fname_list(fnames)
+        nrow = count_fits_rows(fnames, ext)
+        with fitsio.FITS(fnames[0]) as fits:
+            dtype = fits[ext][0:1].dtype
+
+        def _chunks():
+            return iter_fits_chunks(fnames, chunk_size, columns, ext)
+
+        sources = [
+            {"fname": os.path.abspath(fname), "mtime": os.path.getmtime(fname)}
+            for fname in fnames
+        ]
+    if columns is None:
+        columns = list(dtype.names)
+    os.makedirs(outDir, exist_ok=True)
+    mname = os.path.join(outDir, "manifest.json")
+    if os.path.isfile(mname):
+        os.remove(mname)
+    outs = {}
+    schema = []
+    for name in columns:
+        base = _native_dtype(dtype[name].base)
+        shape = dtype[name].shape
+        outs[name] = np.lib.format.open_memmap(
+            os.path.join(outDir, "%s.npy" % name),
+            mode="w+",
+            dtype=base,
+            shape=(nrow,) + shape,
+        )
+        schema.append([name, base.str, list(shape)])
+    for start, chunk in _chunks():
+        for name in columns:
+            outs[name][start : start + len(chunk)] = chunk[name]
+        del chunk
+    for name in columns:
+        outs[name].flush()
+    del outs
+    manifest = {
+        "version": catutil.column_store_version,
+        "nrow": nrow,
+        "columns": schema,
+        "sources": sources,
+        "meta": meta or {},
+    }
+    with open(mname + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(mname + ".tmp", mname)
+    return catutil.ColumnStore(outDir)
+
+
+def is_column_store(fname):
+    """Returns whether fname is a column store"""
+    return os.path.isfile(os.path.join(fname, "manifest.json"))
+
+
+def load_catalog(fnames, funcs=None, columns=(), ext=1):
+    """Loads a catalog from a column store (memory-mapped, see
+    `catutil.ColumnStore`) or from (a list of) FITS tables. For FITS tables,
+    only the columns needed by the accessors `funcs` (and `columns`) are read
+    if funcs is given.
+
+    Args:
+        fnames (str | list):    column store directory, FITS file name or a
+                                list of FITS file names
+        funcs (list):           accessors declared with `catutil.uses_columns`
+        columns (list):         other columns to read
+        ext (int):              extension of the FITS tables
+    Returns:
+        catalog (ColumnStore | ndarray):  the catalog
+    """
+    if isinstance(fnames, str) and is_column_store(fnames):
+        return catutil.ColumnStore(fnames)
+    if funcs is None:
+        if len(columns) == 0:
+            columns = None
+        data = [
+            fitsio.read(fname, ext=ext, columns=columns)
+            for fname in _as_fname_list(fnames)
+        ]
+        return data[0] if len(data) == 1 else np.hstack(data)
+    return read_fits_required(fnames, funcs, columns, ext)
+
+
+class _FitsAppender(object):
+    """Appends rows to a FITS table, creating it with the first rows; if no
+    row is appended, an empty table of dtype is written on close
+
+    Args:
+        fname (str):        output file name
+        dtype (dtype):      dtype of the rows [default: the appended rows]
+    """
+
+    def __init__(self, fname, dtype=None):
+        self.fits = fitsio.FITS(fname, "rw", clobber=True)
+        self.nrow = 0
+        self.dtype = dtype
+        return
+
+    def append(self, data):
+        if len(self.fits) == 1:
+            self.fits.write(data)
+        else:
+            self.fits[-1].append(data)
+        self.nrow += len(data)
+        return
+
+    def close(self):
+        if len(self.fits) == 1:
+            if self.dtype is None:
+                self.fits.close()
+                raise ValueError("no row is appended and dtype is not given")
+            self.fits.write(np.zeros(0, dtype=self.dtype))
+        self.fits.close()
+        return
+
+
+def _write_mask(fname, mask):
+    """Writes a boolean mask to a .npy file or to a FITS table ('mask' column)"""
+    if fname.endswith(".npy"):
+        np.save(fname, mask)
+    else:
+        out = np.zeros(len(mask), dtype=[("mask", "?")])
+        out["mask"] = mask
+        fitsio.write(fname, out, clobber=True)
+    return
+
+
+def select_catalog_chunked(
+    fnames, cuts, outFname=None, output="mask", chunk_size=1000000, columns=None
+):
+    """Applies a galaxy selection to (a list of) FITS catalogs without loading
+    them into memory. The peak memory is set by the chunk size (plus a few
+    bytes per row for the boolean results).
+
+    Args:
+        fnames (str | list):    FITS file name or a list of file names (treated
+                                as one concatenated catalog)
+        cuts (GalaxyCuts | callable):
+                                a `catutil.GalaxyCuts` object (which needs the
+                                whole catalog for the pair and PSF-size
+                                cuts), or a row-wise function returning the
+                                mask of a chunk, e.g. `catutil.get_wl_cuts`
+        outFname (str):         output file name [default: None, not written]
+        output (str):           'mask' to write the boolean mask (.npy or FITS
+                                table with a 'mask' column), or 'rows' to write
+                                the selected rows to a FITS table
+        chunk_size (int):       number of rows in a chunk
+        columns (list):         columns to read [default: all]
+    Returns:
+        mask (ndarray):         selection mask of the concatenated catalog
+    """
+    assert output in ["mask", "rows"], "output should be 'mask' or 'rows'"
+    assert output == "mask" or outFname is not None, "outFname is required"
+    fnames = _as_fname_list(fnames)
+    nrow = count_fits_rows(fnames)
+    appender = None
+    if output == "rows":
+        appender = _FitsAppender(outFname, get_fits_dtype(fnames, columns))
+    if isinstance(cuts, catutil.GalaxyCuts):
+        names = columns or get_fits_colnames(fnames)
+        mask = cuts.evaluate(
+            iter_fits_chunks(fnames, chunk_size, columns), nrow, tuple(names)
+        )
+        if appender is not None:
+            # second pass to stream the selected rows
+            for start, chunk in iter_fits_chunks(fnames, chunk_size, columns):
+                appender.append(chunk[mask[start : start + len(chunk)]])
+    else:
+        mask = np.zeros(nrow, dtype=bool)
+        for start, chunk in iter_fits_chunks(fnames, chunk_size, columns):
+            _msk = np.asarray(cuts(chunk), dtype=bool)
+            mask[start : start + len(chunk)] = _msk
+            if appender is not None:
+                appender.append(chunk[_msk])
+            del _msk, chunk
+    if appender is not None:
+        appender.close()
+    elif outFname is not None:
+        _write_mask(outFname, mask)
+    return mask
+
+
+def update_catalog_chunked(fnames, outFname, func, chunk_size=1000000):
+    """Applies an in-place column update (e.g.
+    `catutil.update_reGaus_calibration` or `catutil.update_wl_cuts`) to (a
+    list of) FITS catalogs chunk by chunk, streaming the updated rows to a
+    single output FITS table.
+
+    Args:
+        fnames (str | list):    FITS file name or a list of file names
+        outFname (str):         output file name
+        func (callable):        function updating the columns of a chunk
+        chunk_size (int):       number of rows in a chunk
+    Returns:
+        nrow (int):             number of rows written
+    """
+    # the columns are updated in place, so the rows keep the input dtype
+    appender = _FitsAppender(outFname, get_fits_dtype(fnames))
+    for _, chunk in iter_fits_chunks(fnames, chunk_size):
+        chunk = func(chunk)
+        appender.append(chunk)
+        del chunk
+    appender.close()
+    return appender.nrow
+
+
+def match_object_id(object_id, ref_object_id):
+    """Matches objects to a reference table by 'object_id' (argsort of the
+    reference and binary search); neither input needs to be sorted or in the
+    same order
+
+    Args:
+        object_id (ndarray):        object_id of the catalog
+        ref_object_id (ndarray):    object_id of the reference table (unique)
+    Returns:
+        index (ndarray):            row of each object in the reference table
+                                    [-1 for objects missing in the reference]
+    """
+    object_id = np.asarray(object_id)
+    ref_object_id = np.asarray(ref_object_id)
+    if len(object_id) == len(ref_object_id) and np.array_equal(
+        object_id, ref_object_id
+    ):
+        # already aligned
+        return np.arange(len(object_id), dtype=np.int64)
+    if np.all(ref_object_id[1:] > ref_object_id[:-1]):
+        order = np.arange(len(ref_object_id), dtype=np.int64)
+        sorted_ids = ref_object_id
+    else:
+        order = np.argsort(ref_object_id, kind="stable")
+        sorted_ids = ref_object_id[order]
+        if np.any(sorted_ids[1:] == sorted_ids[:-1]):
+            raise ValueError("object_id of the reference table is not unique")
+    if len(sorted_ids) == 0:
+        return np.full(len(object_id), -1, dtype=np.int64)
+    pos = np.searchsorted(sorted_ids, object_id)
+    pos[pos == len(sorted_ids)] = 0
+    index = order[pos]
+    index[sorted_ids[pos] != object_id] = -1
+    return index
+
+
+def _stat_key(fname):
+    """Returns the (mtime, size) of a file"""
+    st = os.stat(fname)
+    return np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+
+
+def get_object_id_index(fname, refFname, cacheFname=None, ext=1):
+    """Returns the row of each object of a catalog in a reference table (e.g.
+    a photo-z selection file) matched by 'object_id'. The index is cached in a
+    .npz file next to the catalog and reused as long as neither file is
+    modified.
+
+    Args:
+        fname (str):        FITS file name of the catalog
+        refFname (str):     FITS file name of the reference table
+        cacheFname (str):   file name of the cache [default: next to the
+                            catalog, named after the reference table]; ''
+                            to disable the cache
+        ext (int):          extension of the tables
+    Returns:
+        index (ndarray):    row of each object in the reference table [-1 for
+                            objects missing in the reference]
+    """
+    if cacheFname is None:
+        cacheFname = "%s.%s.idx.npz" % (
+            os.path.splitext(fname)[0],
+            os.path.splitext(os.path.basename(refFname))[0],
+        )
+    key = np.concatenate([_stat_key(fname), _stat_key(refFname)])
+    if cacheFname and os.path.isfile(cacheFname):
+        with np.load(cacheFname) as cache:
+            if np.array_equal(cache["key"], key):
+                return cache["index"]
+    object_id = fitsio.read(fname, ext=ext, columns=["object_id"])["object_id"]
+    ref_object_id = fitsio.read(refFname, ext=ext, columns=["object_id"])
+    index = match_object_id(object_id, ref_object_id["object_id"])
+    del object_id, ref_object_id
+    if cacheFname:
+        try:
+            np.savez(cacheFname, key=key, index=index)
+        except OSError as err:
+            logging.warning("Cannot cache the object_id index: %s" % err)
+    return index
+
+
+def attach_columns(data, ref, columns, index=None, fill_value=0):
+    """Attaches columns of a reference table (e.g. photo-z, weights or masks)
+    to a catalog without reordering the catalog
+
+    Args:
+        data (ndarray):     catalog
+        ref (ndarray):      reference table
+        columns (list):     columns of the reference table to attach
+        index (ndarray):    row of each object in the reference table
+                            [default: matched by 'object_id']
+        fill_value:         value of objects missing in the reference table
+    Returns:
+        out (ndarray):      catalog with the attached columns
+    """
+    if index is None:
+        index = match_object_id(data["object_id"], ref["object_id"])
+    assert len(index) == len(data), "index does not match the catalog"
+    columns = list(columns)
+    dtype = [d for d in data.dtype.descr if d[0] not in columns]
+    dtype = dtype + [(col, ref.dtype[col]) for col in columns]
+    out = np.empty(len(data), dtype=dtype)
+    for col in data.dtype.names:
+        if col not in columns:
+            out[col] = data[col]
+    found = index >= 0
+    for col in columns:
+        out[col] = fill_value
+        out[col][found] = ref[col][index[found]]
+    return out
+
+
+def _read_aligned_column(catFname, refFname, column, fill_value=0):
+    """Reads a column of a reference table aligned to the rows of a catalog
+    (matched by 'object_id', with a cached index)
+    """
+    index = get_object_id_index(catFname, refFname)
+    values = fitsio.read(refFname, ext=1, columns=[column])[column]
+    out = np.full(len(index), fill_value, dtype=values.dtype)
+    found = index >= 0
+    out[found] = values[index[found]]
+    return out
+
+
+"""pzsname_dnnz: photo-z source selection of each field (relative to $homeWrk)"""
+pzsname_dnnz = "S19ACatalogs/photoz_2pt/fiducial_dnnzbin_w95c027/source_sel_%s.fits"
+
+
+def split_catalog_inz(
+    catFname,
+    outFname,
+    fieldFname=None,
+    zbins=(1, 2, 3, 4),
+    columns=None,
+    pzsname=None,
+    chunk_size=1000000,
+):
+    """Divides the catalogs [mock or real] of all fields into redshift bins in
+    one pass: each field catalog is read once in chunks, and the rows of each
+    chunk are routed to all the redshift bins and appended to the output
+    files. The photo-z selection file is matched by 'object_id' (objects
+    missing in it are dropped), so it does not need to be in the row order of
+    the catalog. The peak memory is set by the chunk size. Redshift bins
+    without objects (and fields without objects) give empty tables.
+
+    Args:
+        catFname (str):     catalog name divided into fields [replace field
+                            name with %]
+        outFname (str):     output file name [replace redshift bin with %d]
+        fieldFname (str):   output file name of the field index, a table with
+                            a 'field' column for each row of the outputs
+                            [replace redshift bin with %d; default: None, not
+                            written]
+        zbins (list):       redshift bins (values of 'dnnz_bin') to write
+        columns (list):     columns to read and write [default: all]
+        pzsname (str):      photo-z selection file divided into fields
+                            [replace field name with %; default: the fiducial
+                            dnnz selection in $homeWrk]
+        chunk_size (int):   number of rows in a chunk
+    Returns:
+        ranges (dict):      (start, stop) rows of each field in the output of
+                            each redshift bin
+    """
+    assert "%" in catFname, "% not in catFname"
+    zbins = [int(zbin) for zbin in zbins]
+    if "%" not in outFname:
+        assert len(zbins) == 1, "% not in outFname"
+    if fieldFname is not None and "%" not in fieldFname:
+        assert len(zbins) == 1, "% not in fieldFname"
+    if pzsname is None:
+        pzsname = os.path.join(os.environ["homeWrk"], pzsname_dnnz)
+
+    def _fname(fname, zbin):
+        return fname % zbin if "%" in fname else fname
+
+    # the rows of all the fields are appended to the same outputs (and empty
+    # redshift bins are written as empty tables with the same columns)
+    field0 = None
+    dtype = None
+    for fieldname in catutil.field_names:
+        _tmpnm = catFname % fieldname
+        assert os.path.isfile(_tmpnm), _tmpnm
+        _dtype = get_fits_dtype(_tmpnm, columns)
+        if dtype is None:
+            field0 = fieldname
+            dtype = _dtype
+        elif _dtype != dtype:
+            raise ValueError(
+                "field %s has a different dtype from field %s: %s vs %s"
+                % (fieldname, field0, _dtype, dtype)
+            )
+    appenders = [_FitsAppender(_fname(outFname, zbin), dtype) for zbin in zbins]
+    field_appenders = None
+    if fieldFname is not None:
+        field_appenders = [
+            _FitsAppender(_fname(fieldFname, zbin), [("field", "U8")]) for zbin in zbins
+        ]
+    ranges = {zbin: {} for zbin in zbins}
+    bin_values = np.array(zbins)
+    order_bins = np.argsort(bin_values)
+    for fieldname in catutil.field_names:
+        _tmpnm = catFname % fieldname
+        starts = [app.nrow for app in appenders]
+        # redshift bins aligned to the catalog rows [0 for missing objects]
+        dnnz_bin = _read_aligned_column(_tmpnm, pzsname % fieldname, "dnnz_bin")
+        for start, data in iter_fits_chunks(_tmpnm, chunk_size, columns):
+            bins = dnnz_bin[start : start + len(data)]
+            # stable partition of the chunk by redshift bin
+            order = np.argsort(bins, kind="stable")
+            sorted_bins = bins[order]
+            i0 = np.searchsorted(sorted_bins, bin_values[order_bins], side="left")
+            i1 = np.searchsorted(sorted_bins, bin_values[order_bins], side="right")
+            for k, j in enumerate(order_bins):
+                if i1[k] == i0[k]:
+                    continue
+                rows = order[i0[k] : i1[k]]
+                appenders[j].append(data[rows])
+                if field_appenders is not None:
+                    out = np.zeros(len(rows), dtype=[("field", "U8")])
+                    out["field"] = fieldname
+                    field_appenders[j].append(out)
+            del data, bins, order
+        del dnnz_bin
+        for j, zbin in enumerate(zbins):
+            ranges[zbin][fieldname] = (starts[j], appenders[j].nrow)
+        gc.collect()
+    for app in appenders:
+        app.close()
+    if field_appenders is not None:
+        for app in field_appenders:
+            app.close()
+    return ranges
+
+
+def _prepare_sim_subfield(args):
+    """Prepares the catalog of a simulated subfield, returning (isim, catalog,
+    error message); failures are returned instead of raised
+    """
+    fname_pattern, fieldname, isim, ngalR, ngrid = args
+    try:
+        catalog = catutil.prepare_field_catalog(
+            fname_pattern % isim, fieldname, isim=isim, ngalR=ngalR, ngrid=ngrid
+        )
+    except Exception as err:
+        return isim, None, repr(err)
+    if catalog is None:
+        return isim, None, "no galaxy passes the cuts"
+    catalog = catalog.as_array()
+    if isinstance(catalog, np.ma.MaskedArray):
+        catalog = catalog.filled()
+    return isim, catalog, None
+
+
+def prepare_sim_catalogs(
+    fname_pattern,
+    fieldname,
+    isims,
+    outFname=None,
+    n_proc=None,
+    ngalR=100,
+    ngrid=64,
+    use_process=True,
+):
+    """Prepares the catalogs of a range of simulated subfields with
+    `catutil.prepare_field_catalog` over a worker pool and combines them into
+    one catalog. At most 2*n_proc subfields are in flight, and they are
+    written in the input order, appended to the output FITS file as they
+    finish (or into one output array, which is preallocated for ngalR*ngalR
+    rows, the grid points, per subfield and resized in place). Subfields
+    failing or returning no galaxy are skipped and logged.
+
+    Args:
+        fname_pattern (str):    file name of the pipeline outputs, with the
+                                subfield index replaced by a format (e.g.
+                                'src-%05d.fits')
+        fieldname (str):        HSC field information
+        isims (list):           simulation subfield indices
+        outFname (str):         output FITS file name [default: None, return
+                                the combined catalog]
+        n_proc (int):           number of workers [default: os.cpu_count()]
+        ngalR (int):            number of stamps in each row
+        ngrid (int):            number of grids in each stamp
+        use_process (bool):     whether to use a process pool instead of a
+                                thread pool
+    Returns:
+        out (ndarray | int):    the combined catalog, or the number of rows
+                                written to outFname
+        skipped (list):         indices of the skipped subfields
+    """
+    assert "%" in fname_pattern, "% not in fname_pattern"
+    if use_process:
+        Executor = concurrent.futures.ProcessPoolExecutor
+    else:
+        Executor = concurrent.futures.ThreadPoolExecutor
+    tasks = [(fname_pattern, fieldname, int(isim), ngalR, ngrid) for isim in isims]
+    if n_proc is None:
+        n_proc = os.cpu_count() or 1
+    max_pending = 2 * n_proc
+    dtype = None
+    out = None
+    appender = None
+    skipped = []
+    nrow = 0
+    ntask = 0
+    pending = []
+    with Executor(max_workers=n_proc) as executor:
+        while ntask < len(tasks) or len(pending) > 0:
+            while ntask < len(tasks) and len(pending) < max_pending:
+                pending.append(executor.submit(_prepare_sim_subfield, tasks[ntask]))
+                ntask += 1
+            # the oldest task first, to keep the input order
+            isim, catalog, err = pending.pop(0).result()
+            if catalog is None:
+                logging.warning("Skip subfield %d: %s" % (isim, err))
+                skipped.append(isim)
+                continue
+            if dtype is None:
+                dtype = catalog.dtype
+                if outFname is not None:
+                    appender = _FitsAppender(outFname, dtype)
+                else:
+                    out = np.empty(len(tasks) * ngalR * ngalR, dtype=dtype)
+            elif catalog.dtype != dtype:
+                raise ValueError("subfield %d has a different dtype" % isim)
+            nnew = nrow + len(catalog)
+            if appender is not None:
+                appender.append(catalog)
+            else:
+                if nnew > len(out):
+                    out.resize(max(nnew, 2 * len(out)), refcheck=False)
+                out[nrow:nnew] = catalog
+            nrow = nnew
+            del catalog
+    if dtype is None:
+        logging.warning("No subfield is prepared")
+        return (0 if outFname is not None else None), skipped
+    if appender is not None:
+        appender.close()
+        return nrow, skipped
+    out.resize(nrow, refcheck=False)
+    return out, skipped